@@ -21,6 +21,44 @@ interface QueryDetails {
     sentiment: SentimentAnalysis;
 }
 
+interface StreamEvent {
+    event: string;
+    data: any;
+}
+
+// Parse a Server-Sent Events body into { event, data } pairs
+async function* readEventStream(body: ReadableStream<Uint8Array>): AsyncGenerator<StreamEvent> {
+    const reader = body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    try {
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let event = 'message';
+                const dataLines: string[] = [];
+                for (const line of rawEvent.split('\n')) {
+                    if (line.startsWith('event:')) event = line.slice(6).trim();
+                    else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+                }
+                if (dataLines.length) {
+                    yield { event, data: JSON.parse(dataLines.join('\n')) };
+                }
+            }
+        }
+    } finally {
+        reader.releaseLock();
+    }
+}
+
 export default function ChatPage() {
     const [messages, setMessages] = useState<Message[]>([
         { text: "Hello! How can I assist you today?", isUser: false }
@@ -93,53 +131,61 @@ export default function ChatPage() {
         setIsLoading(true);
 
         try {
-            const response = await fetch('http://localhost:8000/api/query', {
+            const response = await fetch('http://localhost:8000/api/query/stream', {
                 method: 'POST',
                 headers: {
-                    'Accept': 'application/json',
+                    'Accept': 'text/event-stream',
                     'Content-Type': 'application/json',
                 },
                 body: JSON.stringify({ text }),
             });
 
-            if (!response.ok) {
+            if (!response.ok || !response.body) {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
 
-            const data = await response.json();
-            console.log('Received data:', data); // Debug log
-            
-            // Ensure we have valid data
-            if (!data || typeof data.response !== 'string') {
-                throw new Error('Invalid response format from server');
-            }
-            
-            // Add bot response
-            addMessage(data.response);
-            
-            // Update query details if we have valid data
-            if (data.intent && data.sentiment) {
-                console.log('Setting query details:', data.sentiment); // Debug log
-                const sentiment = data.sentiment;
-                setQueryDetails({
-                    intent: String(data.intent),
-                    sentiment: {
-                        emotion: String(sentiment.emotion || 'neutral'),
-                        urgency: String(sentiment.urgency || 'medium'),
-                        satisfaction: Number(sentiment.satisfaction || 5)
-                    }
+            let intent = 'unknown';
+            let sentiment: SentimentAnalysis = { emotion: 'neutral', urgency: 'medium', satisfaction: 5 };
+            let botMessageAdded = false;
+
+            // Render tokens as they arrive instead of waiting for the full answer
+            const appendToBotMessage = (token: string) => {
+                if (!botMessageAdded) {
+                    botMessageAdded = true;
+                    setIsLoading(false);
+                    addMessage(token);
+                    return;
+                }
+                setMessages(prev => {
+                    const last = prev[prev.length - 1];
+                    return [...prev.slice(0, -1), { ...last, text: last.text + token }];
                 });
-            } else {
-                console.log('Missing intent or sentiment data:', data); // Debug log
-                // Set default values if missing
-                setQueryDetails({
-                    intent: String(data.intent || 'unknown'),
-                    sentiment: {
-                        emotion: 'neutral',
-                        urgency: 'medium',
-                        satisfaction: 5
+            };
+
+            for await (const { event, data } of readEventStream(response.body)) {
+                if (event === 'token') {
+                    appendToBotMessage(String(data.text));
+                } else if (event === 'intent') {
+                    intent = String(data.intent || 'unknown');
+                } else if (event === 'sentiment') {
+                    sentiment = {
+                        emotion: String(data.emotion || 'neutral'),
+                        urgency: String(data.urgency || 'medium'),
+                        satisfaction: Number(data.satisfaction || 5)
+                    };
+                } else if (event === 'error') {
+                    console.error('Stream error:', data); // Debug log
+                    if (data.stage === 'response') {
+                        throw new Error(String(data.detail));
                     }
-                });
+                } else {
+                    continue;
+                }
+                setQueryDetails({ intent, sentiment });
+            }
+
+            if (!botMessageAdded) {
+                throw new Error('Invalid response format from server');
             }
         } catch (error) {
             console.error('Error:', error);
@@ -0,0 +1,95 @@
+import json
+import os
+import platform
+import time
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+# Project root (one level up from benchmarks)
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(PROJECT_ROOT, 'benchmarks', 'results')
+
+
+def summarize_latencies(seconds: List[float]) -> Dict[str, float]:
+    """Latency percentiles in milliseconds"""
+    if not seconds:
+        return {"count": 0}
+    ms = np.asarray(seconds) * 1000
+    return {
+        "count": int(len(ms)),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p90_ms": float(np.percentile(ms, 90)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max())
+    }
+
+
+def write_results(name: str, results: Dict[str, Any], path: str = None) -> str:
+    """Write benchmark results as JSON, with enough context to compare runs"""
+    path = path or os.path.join(RESULTS_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    document = {
+        "benchmark": name,
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "results": results
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(document, f, indent=2)
+    print(f"Results written to {path}")
+    return path
+
+
+def _flatten(results: Dict[str, Any], prefix: str = '') -> Dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = float(value)
+    return flat
+
+
+def compare_to_baseline(results: Dict[str, Any], baseline_path: str, tolerance: float = 0.15,
+                        ignore: Tuple[str, ...] = ('max_ms',)) -> List[str]:
+    """Compare results with a saved baseline and return the regressions found.
+
+    Metrics ending in `_ms` or `_error_rate` regress when they grow by more
+    than `tolerance`; metrics ending in `_qps` or `_per_s` regress when they
+    shrink by more than `tolerance`. Metrics ending in one of `ignore` (too
+    noisy to gate on) and other numbers are informational.
+    """
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = _flatten(json.load(f)["results"])
+    current = _flatten(results)
+
+    regressions = []
+    for name, base in sorted(baseline.items()):
+        value = current.get(name)
+        if value is None or name.endswith(ignore):
+            continue
+        if name.endswith(('_ms', 'error_rate')):
+            # Absolute floor so sub-millisecond noise or 0 -> 0.001 error rates do not fail runs
+            limit = base * (1 + tolerance) + (0.05 if name.endswith('_ms') else 0.01)
+            if value > limit:
+                regressions.append(f"{name}: {value:.3f} > baseline {base:.3f} (+{tolerance:.0%})")
+        elif name.endswith(('_qps', '_per_s')):
+            if value < base * (1 - tolerance):
+                regressions.append(f"{name}: {value:.3f} < baseline {base:.3f} (-{tolerance:.0%})")
+    return regressions
+
+
+def report_regressions(results: Dict[str, Any], baseline_path: str, tolerance: float,
+                       ignore: Tuple[str, ...] = ('max_ms',)) -> int:
+    """Print the comparison with a baseline; returns the process exit code"""
+    regressions = compare_to_baseline(results, baseline_path, tolerance, ignore)
+    if regressions:
+        print(f"\n{len(regressions)} regressions against {baseline_path}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print(f"\nNo regressions against {baseline_path}")
+    return 0
@@ -0,0 +1,107 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+REPLY = ("Thanks for reaching out. Based on our help articles, here is what you can do: open your account "
+         "settings, review the order details and follow the steps described in the policy. If the problem "
+         "persists, reply to this message and a support specialist will follow up with you shortly.")
+
+CLASSIFICATION = json.dumps({"intent": "faq", "emotion": "neutral", "urgency": "medium", "satisfaction": 5})
+
+
+def create_app(latency_ms: float = 300, jitter_ms: float = 50, tokens: int = 60, tokens_per_s: float = 200,
+               error_rate: float = 0.0, error_status: int = 503, retry_after: float = 1) -> FastAPI:
+    """OpenRouter stand-in serving /api/v1/chat/completions with simulated latency and errors.
+
+    A completion waits `latency_ms` (+/- `jitter_ms`) before its first token,
+    then produces `tokens` words at `tokens_per_s`, streamed as SSE when the
+    request sets `stream`. A fraction `error_rate` of requests fails with
+    `error_status` and a Retry-After header. Usage is reported like OpenRouter.
+    """
+    app = FastAPI(title="Fake OpenRouter")
+    words = (REPLY.split() * (tokens // len(REPLY.split()) + 1))[:tokens]
+    stats = {"requests": 0, "errors": 0, "streams": 0}
+
+    def first_token_delay():
+        return max(0.0, random.gauss(latency_ms, jitter_ms / 2) / 1000) if jitter_ms else latency_ms / 1000
+
+    @app.post("/api/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        if random.random() < error_rate:
+            stats["errors"] += 1
+            return JSONResponse(
+                {"error": {"message": "Simulated upstream error", "code": error_status}},
+                status_code=error_status,
+                headers={"Retry-After": f"{retry_after:g}"}
+            )
+
+        prompt_tokens = sum(len(str(message.get("content", ""))) for message in body.get("messages", [])) // 4
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(words),
+                 "total_tokens": prompt_tokens + len(words)}
+        model = body.get("model", "fake/model")
+
+        if not body.get("stream"):
+            # Structured classification requests get a short JSON object
+            content = CLASSIFICATION if body.get("response_format") else " ".join(words)
+            await asyncio.sleep(first_token_delay() + len(content.split()) / tokens_per_s)
+            return {
+                "id": f"gen-{time.time_ns()}",
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": "stop"}],
+                "usage": usage
+            }
+
+        stats["streams"] += 1
+
+        async def events():
+            yield ": OPENROUTER PROCESSING\n\n"
+            await asyncio.sleep(first_token_delay())
+            for i, word in enumerate(words):
+                chunk = {"model": model, "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(1 / tokens_per_s)
+            final = {"model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            if (body.get("usage") or {}).get("include"):
+                final["usage"] = usage
+            yield f"data: {json.dumps(final)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local OpenRouter stand-in for benchmarks")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency-ms', type=float, default=300, help="Time to first token")
+    parser.add_argument('--jitter-ms', type=float, default=50, help="Spread of the time to first token")
+    parser.add_argument('--tokens', type=int, default=60, help="Completion length in tokens")
+    parser.add_argument('--tokens-per-s', type=float, default=200, help="Generation speed")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument('--error-status', type=int, default=503, help="Status code of simulated failures")
+    parser.add_argument('--retry-after', type=float, default=1, help="Retry-After seconds sent with failures")
+    args = parser.parse_args()
+
+    import uvicorn
+    app = create_app(args.latency_ms, args.jitter_ms, args.tokens, args.tokens_per_s, args.error_rate,
+                     args.error_status, args.retry_after)
+    print(f"Fake OpenRouter at http://{args.host}:{args.port}/api/v1")
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
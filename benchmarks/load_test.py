@@ -0,0 +1,122 @@
+import argparse
+import asyncio
+import random
+import sys
+import time
+from collections import Counter
+
+import httpx
+
+from benchmarks.common import report_regressions, summarize_latencies, write_results
+from scripts.intent_classifier import load_training_data
+
+
+async def wait_until_ready(client: httpx.AsyncClient, url: str, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get(f"{url}/health/ready")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(1)
+    raise RuntimeError(f"{url} did not become ready within {timeout:.0f}s")
+
+
+async def send_query(client: httpx.AsyncClient, url: str, endpoint: str, text: str, headers: dict) -> dict:
+    """Send one query; returns status, latency and (for streams) time to first token"""
+    start = time.perf_counter()
+    first_token = None
+    try:
+        if endpoint == 'stream':
+            async with client.stream('POST', f"{url}/api/query/stream", json={"text": text}, headers=headers) as response:
+                status = response.status_code
+                async for line in response.aiter_lines():
+                    if first_token is None and line == 'event: token':
+                        first_token = time.perf_counter() - start
+                    if line.startswith('data:') and '"status": "error"' in line:
+                        status = 'stream_error'
+        else:
+            response = await client.post(f"{url}/api/query", json={"text": text}, headers=headers)
+            status = response.status_code
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    return {"status": status, "latency": time.perf_counter() - start, "first_token": first_token}
+
+
+async def run_load(url: str, endpoint: str, queries: list, qps: float, duration: float, warmup: float,
+                   bypass_cache: bool, max_in_flight: int) -> dict:
+    """Open-loop load: requests start on a fixed schedule regardless of how fast earlier ones finish"""
+    headers = {"X-Cache-Bypass": "1"} if bypass_cache else {}
+    limits = httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight)
+    async with httpx.AsyncClient(timeout=httpx.Timeout(120.0), limits=limits) as client:
+        await wait_until_ready(client, url, timeout=300)
+
+        if warmup:
+            print(f"Warming up for {warmup:.0f}s...")
+            warmup_end = time.monotonic() + warmup
+            while time.monotonic() < warmup_end:
+                await send_query(client, url, endpoint, random.choice(queries), headers)
+
+        print(f"Sending {qps:g} queries/s to /api/query{'/stream' if endpoint == 'stream' else ''} for {duration:.0f}s...")
+        tasks = []
+        start = time.perf_counter()
+        n_requests = int(qps * duration)
+        for i in range(n_requests):
+            delay = start + i / qps - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.ensure_future(send_query(client, url, endpoint, queries[i % len(queries)], headers)))
+        results = await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+    statuses = Counter(str(result["status"]) for result in results)
+    succeeded = [result for result in results if result["status"] == 200]
+    summary = {
+        "config": {"endpoint": endpoint, "target_qps": qps, "duration_s": duration, "bypass_cache": bypass_cache},
+        "requests": len(results),
+        "achieved_qps": len(succeeded) / elapsed if elapsed else 0.0,
+        "error_rate": 1 - len(succeeded) / len(results) if results else 0.0,
+        "status_codes": dict(statuses),
+        "latency": summarize_latencies([result["latency"] for result in succeeded])
+    }
+    if endpoint == 'stream':
+        summary["first_token"] = summarize_latencies(
+            [result["first_token"] for result in succeeded if result["first_token"] is not None]
+        )
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay intent dataset queries against the API at a target QPS")
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help="API base URL")
+    parser.add_argument('--endpoint', choices=['query', 'stream'], default='query')
+    parser.add_argument('--qps', type=float, default=5, help="Target queries per second")
+    parser.add_argument('--duration', type=float, default=30, help="Seconds of measured load")
+    parser.add_argument('--warmup', type=float, default=5, help="Seconds of sequential warmup traffic (not measured)")
+    parser.add_argument('--max-in-flight', type=int, default=256, help="Connection pool size")
+    parser.add_argument('--bypass-cache', action='store_true', help="Send X-Cache-Bypass so every query hits the pipeline")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Results JSON path (default benchmarks/results/load-<time>.json)")
+    parser.add_argument('--baseline', help="Baseline results JSON to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="Allowed relative regression")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    queries = [text for text, _ in load_training_data(include_test=True)]
+    random.shuffle(queries)
+
+    results = asyncio.run(run_load(args.url, args.endpoint, queries, args.qps, args.duration, args.warmup,
+                                   args.bypass_cache, args.max_in_flight))
+    latency = results["latency"]
+    print(f"\n{results['requests']} requests, {results['achieved_qps']:.2f} successful/s, "
+          f"error rate {results['error_rate']:.2%}")
+    if latency["count"]:
+        print(f"Latency p50 {latency['p50_ms']:.1f} ms, p90 {latency['p90_ms']:.1f} ms, p99 {latency['p99_ms']:.1f} ms")
+    write_results('load', results, args.output)
+    if args.baseline:
+        sys.exit(report_regressions(results, args.baseline, args.tolerance))
+
+
+if __name__ == '__main__':
+    main()
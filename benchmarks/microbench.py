@@ -0,0 +1,110 @@
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Callable, Dict
+
+import numpy as np
+
+from benchmarks.common import PROJECT_ROOT, report_regressions, write_results
+from scripts.embedder import load_embedder
+from scripts.intent_classifier import load_training_data
+from scripts.lexical_index import BM25Index
+from scripts.pipeline import parse_sentiment
+from scripts.sentiment import SentimentScorer
+from scripts.vector_store import NumpyVectorStore
+
+AGENT_OUTPUT = "Emotion: Frustrated\nUrgency: High\nSatisfaction: 3"
+SSE_CHUNK = 'data: {"id":"gen-1","choices":[{"index":0,"delta":{"content":" refund"}}]}'
+
+
+def bench(fn: Callable, min_time: float = 1.0, min_runs: int = 5) -> Dict[str, float]:
+    """Time `fn` repeatedly for at least `min_time` seconds; returns per-call latency in ms"""
+    fn()  # Warm up caches and lazy initialization
+    timings = []
+    deadline = time.perf_counter() + min_time
+    while len(timings) < min_runs or time.perf_counter() < deadline:
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    ms = np.asarray(timings) * 1000
+    return {"runs": len(ms), "mean_ms": float(ms.mean()), "p50_ms": float(np.percentile(ms, 50)),
+            "p99_ms": float(np.percentile(ms, 99))}
+
+
+def synthetic_corpus(n: int, dim: int = 384, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    embeddings = rng.standard_normal((n, dim)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    vocabulary = [f"term{i}" for i in range(5000)] + [f"err-{i}" for i in range(500)]
+    documents = [" ".join(rng.choice(vocabulary, 40)) for _ in range(n)]
+    return embeddings, documents
+
+
+def run(args) -> Dict[str, Dict[str, float]]:
+    results = {}
+    queries = [text for text, _ in load_training_data(include_test=True)][:256]
+
+    # Response parsing and local scoring (no model needed)
+    results["parse_sentiment"] = bench(lambda: parse_sentiment(AGENT_OUTPUT))
+    results["parse_sse_chunk"] = bench(lambda: json.loads(SSE_CHUNK[len('data:'):]))
+    scorer = SentimentScorer()
+    results["sentiment_score"] = bench(lambda: scorer.score(queries[0]))
+    results["sentiment_score_batch64"] = bench(lambda: scorer.score_batch(queries[:64]))
+
+    # Exact vector search and BM25 over a synthetic corpus
+    embeddings, documents = synthetic_corpus(args.corpus)
+    ids = [f"chunk-{i}" for i in range(args.corpus)]
+    index_dir = os.path.join(args.workdir, 'numpy_index')
+    NumpyVectorStore.write(index_dir, ids, documents, embeddings, [{"source": "synthetic.txt"}] * args.corpus)
+    store = NumpyVectorStore(index_dir)
+    results[f"numpy_search_{args.corpus}"] = bench(lambda: store.search(embeddings[:1], 3))
+    bm25 = BM25Index.build(ids, documents)
+    results[f"bm25_search_{args.corpus}"] = bench(lambda: bm25.search("term12 err-42 term999", 20))
+
+    if not args.skip_model:
+        model = load_embedder()  # EMBEDDING_BACKEND selects PyTorch or ONNX Runtime
+        results["encode_single"] = bench(lambda: model.encode([queries[0]], normalize_embeddings=True))
+        batch = bench(lambda: model.encode(queries[:64], batch_size=64, normalize_embeddings=True))
+        batch["texts_per_s"] = 64 / (batch["mean_ms"] / 1000)
+        results["encode_batch64"] = batch
+
+    if not args.skip_chroma:
+        import chromadb
+        try:
+            collection = chromadb.PersistentClient(path=os.path.join(PROJECT_ROOT, 'chroma_db')).get_collection(
+                "customer_support_docs")
+        except Exception as e:
+            print(f"Skipping collection.query: {e}")
+        else:
+            query_embedding = embeddings[0].tolist()
+            results["chroma_query"] = bench(lambda: collection.query(query_embeddings=[query_embedding], n_results=3))
+            results["chroma_query_batch64"] = bench(
+                lambda: collection.query(query_embeddings=embeddings[:64].tolist(), n_results=3))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage microbenchmarks (encode, vector search, parsing)")
+    parser.add_argument('--corpus', type=int, default=10000, help="Synthetic chunks for the vector/BM25 benchmarks")
+    parser.add_argument('--skip-model', action='store_true', help="Skip the sentence-transformers benchmarks")
+    parser.add_argument('--skip-chroma', action='store_true', help="Skip the ChromaDB benchmarks")
+    parser.add_argument('--workdir', default=os.path.join(PROJECT_ROOT, 'benchmarks', 'results', 'work'),
+                        help="Scratch directory for the synthetic index")
+    parser.add_argument('--output', help="Results JSON path (default benchmarks/results/micro-<time>.json)")
+    parser.add_argument('--baseline', help="Baseline results JSON to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="Allowed relative regression")
+    args = parser.parse_args()
+
+    results = run(args)
+    for name, timing in results.items():
+        print(f"{name:32s} mean {timing['mean_ms']:9.3f} ms  p99 {timing['p99_ms']:9.3f} ms  ({timing['runs']} runs)")
+    write_results('micro', results, args.output)
+    if args.baseline:
+        # Tail latencies of microsecond-scale calls are dominated by scheduler noise
+        sys.exit(report_regressions(results, args.baseline, args.tolerance, ignore=('p99_ms',)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+import argparse
+import os
+import sys
+from typing import Dict
+
+import numpy as np
+
+from benchmarks.common import PROJECT_ROOT, report_regressions, write_results
+from benchmarks.microbench import bench
+from scripts.vector_store import VECTOR_DTYPES, NumpyVectorStore
+
+
+def clustered_corpus(n: int, dim: int = 384, clusters: int = 256, spread: float = 0.6, seed: int = 0) -> np.ndarray:
+    """Normalized vectors grouped around random topics, like chunk embeddings of a knowledge base"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    noise = rng.standard_normal((n, dim)).astype(np.float32) * (spread / np.sqrt(dim))
+    embeddings = centers[rng.integers(0, clusters, n)] + noise
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def load_index_embeddings(path: str) -> np.ndarray:
+    """Full-precision embeddings of an existing NumPy index"""
+    store = NumpyVectorStore(path, rescore_factor=1)
+    source = store.full if store.full is not None else store.embeddings
+    embeddings = np.asarray(source, dtype=np.float32)
+    if store.scales is not None and store.full is None:
+        embeddings *= np.asarray(store.scales)[:, None]
+    return embeddings
+
+
+def top_rows(store: NumpyVectorStore, queries: np.ndarray, k: int):
+    return [[store.rows[chunk_id] for chunk_id in result] for result in store.search(queries, k)]
+
+
+def recall_at_k(results, exact, k: int) -> float:
+    """Mean fraction of the exact top-k found in the approximate top-k"""
+    return float(np.mean([len(set(found[:k]) & set(truth[:k])) / k for found, truth in zip(results, exact)]))
+
+
+def run(args) -> Dict[str, Dict[str, float]]:
+    if args.index:
+        embeddings = load_index_embeddings(args.index)
+    else:
+        embeddings = clustered_corpus(args.corpus)
+    rng = np.random.default_rng(1)
+    # Queries near (but not at) indexed chunks
+    queries = embeddings[rng.integers(0, len(embeddings), args.queries)]
+    queries = queries + rng.standard_normal(queries.shape).astype(np.float32) * (0.3 / np.sqrt(queries.shape[1]))
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    ids = [f"chunk-{i}" for i in range(len(embeddings))]
+    documents = [""] * len(embeddings)
+    metadatas = [{"source": "synthetic.txt"}] * len(embeddings)
+    results, exact = {}, None
+    for dtype in args.dtypes:
+        index_dir = os.path.join(args.workdir, f'quantization_{dtype}')
+        NumpyVectorStore.write(index_dir, ids, documents, embeddings, metadatas, dtype=dtype)
+        store = NumpyVectorStore(index_dir, rescore_factor=1)
+        in_memory = store.embeddings.nbytes + (store.scales.nbytes if store.scales is not None else 0)
+        on_disk = in_memory + (store.full.nbytes if store.full is not None else 0)
+        result = {
+            "bytes_per_vector": in_memory / len(ids),
+            "disk_bytes_per_vector": on_disk / len(ids),
+            "search_ms": bench(lambda: store.search(queries[:1], args.k))["p50_ms"]
+        }
+        found = top_rows(store, queries, args.k)
+        if dtype == 'float32':
+            exact = found
+        if exact is not None:
+            result[f"recall_at_{args.k}"] = recall_at_k(found, exact, args.k)
+        if store.full is not None:
+            store.rescore_factor = args.rescore_factor
+            result["rescored_search_ms"] = bench(lambda: store.search(queries[:1], args.k))["p50_ms"]
+            if exact is not None:
+                result[f"rescored_recall_at_{args.k}"] = recall_at_k(top_rows(store, queries, args.k), exact, args.k)
+        results[dtype] = result
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory, latency and recall@k of quantized NumPy vector indexes")
+    parser.add_argument('--corpus', type=int, default=100000, help="Synthetic chunks (ignored with --index)")
+    parser.add_argument('--index', help="Existing NumPy index directory to take the embeddings from")
+    parser.add_argument('--queries', type=int, default=200, help="Queries used to measure recall")
+    parser.add_argument('--k', type=int, default=10, help="Results per query")
+    parser.add_argument('--rescore-factor', type=int, default=4, help="Candidates re-scored per result")
+    parser.add_argument('--dtypes', nargs='+', default=list(VECTOR_DTYPES), choices=VECTOR_DTYPES)
+    parser.add_argument('--workdir', default=os.path.join(PROJECT_ROOT, 'benchmarks', 'results', 'work'),
+                        help="Scratch directory for the indexes")
+    parser.add_argument('--output', help="Results JSON path (default benchmarks/results/quantization-<time>.json)")
+    parser.add_argument('--baseline', help="Baseline results JSON to compare latencies against")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="Allowed relative regression")
+    parser.add_argument('--min-recall', type=float, help="Fail if any rescored recall@k falls below this")
+    args = parser.parse_args()
+    if 'float32' in args.dtypes:
+        # The float32 index provides the exact results recall is measured against
+        args.dtypes = ['float32'] + [dtype for dtype in args.dtypes if dtype != 'float32']
+
+    results = run(args)
+    for dtype, result in results.items():
+        print(f"{dtype:8s} {result['bytes_per_vector']:7.1f} B/vector in memory "
+              f"({result['disk_bytes_per_vector']:7.1f} on disk)  search {result['search_ms']:7.2f} ms  "
+              f"recall@{args.k} {result.get(f'recall_at_{args.k}', float('nan')):.3f}"
+              + (f"  rescored {result[f'rescored_recall_at_{args.k}']:.3f} in {result['rescored_search_ms']:.2f} ms"
+                 if f'rescored_recall_at_{args.k}' in result else ""))
+    write_results('quantization', results, args.output)
+
+    exit_code = 0
+    if args.min_recall is not None:
+        low = [dtype for dtype, result in results.items()
+               if result.get(f'rescored_recall_at_{args.k}', 1.0) < args.min_recall]
+        if low:
+            print(f"\nRescored recall@{args.k} below {args.min_recall} for: {', '.join(low)}")
+            exit_code = 1
+    if args.baseline:
+        exit_code = report_regressions(results, args.baseline, args.tolerance) or exit_code
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
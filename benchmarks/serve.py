@@ -0,0 +1,30 @@
+import argparse
+import os
+import sys
+
+from benchmarks import stub_crew
+from benchmarks.common import PROJECT_ROOT
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API offline: stub agents, OpenRouter pointed at the fake server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--openrouter-url', default='http://127.0.0.1:8081/api/v1', help="Fake OpenRouter base URL")
+    parser.add_argument('--agent-latency-ms', type=float, default=800, help="Simulated Crew kickoff latency")
+    parser.add_argument('--real-agents', action='store_true', help="Use the real crewai agents")
+    args = parser.parse_args()
+
+    if not args.real_agents:
+        stub_crew.install(args.agent_latency_ms)
+    os.environ['OPENROUTER_BASE_URL'] = args.openrouter_url
+    os.environ.setdefault('OPENROUTER_API_KEY', 'benchmark')
+
+    import uvicorn
+    sys.path.insert(0, PROJECT_ROOT)
+    from main import app  # Imported after the stub is installed
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
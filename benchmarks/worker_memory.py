@@ -0,0 +1,90 @@
+import argparse
+import os
+from typing import Dict, List
+
+from benchmarks.common import write_results
+
+# /proc/<pid>/smaps_rollup fields reported per process
+FIELDS = ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty', 'Swap')
+
+
+def read_memory(pid: int) -> Dict[str, float]:
+    """Memory of one process in MiB, from /proc/<pid>/smaps_rollup (Linux 4.14+)"""
+    memory = {}
+    with open(f'/proc/{pid}/smaps_rollup', 'r') as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            if name in FIELDS:
+                memory[name.lower() + '_mb'] = int(value.split()[0]) / 1024
+    return memory
+
+
+def child_pids(pid: int) -> List[int]:
+    """Direct children of a process (the gunicorn workers of a master)"""
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'r') as f:
+                # The parent pid is the second field after the parenthesised command name
+                parent = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if parent == pid and int(entry) != os.getpid():
+            children.append(int(entry))
+    return sorted(children)
+
+
+def measure(master: int) -> Dict[str, Dict[str, float]]:
+    """Per-process memory of the master and its workers, plus totals.
+
+    RSS counts every shared page in full in every process, so summing it
+    over-states the footprint; PSS splits shared pages between the processes
+    mapping them, so the PSS total is what the server really costs.
+    """
+    workers = child_pids(master)
+    results = {"master": read_memory(master)}
+    for i, pid in enumerate(workers):
+        results[f"worker_{i}"] = dict(read_memory(pid), pid=pid)
+    processes = list(results.values())
+    private = [process['private_clean_mb'] + process['private_dirty_mb'] for process in processes[1:]]
+    results["total"] = {
+        "workers": len(workers),
+        "rss_sum_mb": sum(process['rss_mb'] for process in processes),
+        "pss_sum_mb": sum(process['pss_mb'] for process in processes),
+        "worker_private_mean_mb": sum(private) / len(private) if private else 0.0
+    }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RSS, PSS and shared/private memory of the gunicorn processes")
+    parser.add_argument('--pid', type=int, help="Master pid (default: read from --pidfile)")
+    parser.add_argument('--pidfile', default=os.getenv('GUNICORN_PIDFILE', '/tmp/gunicorn.pid'),
+                        help="gunicorn pid file (default: GUNICORN_PIDFILE or /tmp/gunicorn.pid, like gunicorn.conf.py)")
+    parser.add_argument('--output', help="Results JSON path (default benchmarks/results/worker_memory-<time>.json)")
+    args = parser.parse_args()
+
+    master = args.pid
+    if master is None:
+        with open(args.pidfile, 'r') as f:
+            master = int(f.read().strip())
+
+    results = measure(master)
+    print(f"{'process':10s} {'pid':>7s} {'RSS':>9s} {'PSS':>9s} {'shared':>9s} {'private':>9s}  (MiB)")
+    for name, memory in results.items():
+        if name == 'total':
+            continue
+        shared = memory['shared_clean_mb'] + memory['shared_dirty_mb']
+        private = memory['private_clean_mb'] + memory['private_dirty_mb']
+        print(f"{name:10s} {memory.get('pid', master):7d} {memory['rss_mb']:9.1f} {memory['pss_mb']:9.1f} "
+              f"{shared:9.1f} {private:9.1f}")
+    total = results['total']
+    print(f"\n{total['workers']} workers: RSS sum {total['rss_sum_mb']:.1f} MiB, PSS sum {total['pss_sum_mb']:.1f} MiB "
+          f"(actual footprint), {total['worker_private_mean_mb']:.1f} MiB private per worker")
+    write_results('worker_memory', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
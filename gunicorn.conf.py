@@ -0,0 +1,38 @@
+"""Multi-process serving: `gunicorn main:app` (this file is picked up from the working directory).
+
+The master imports the app and loads every component (embedding model,
+vector index, classifiers, FAQ index) once, then forks the workers, so they
+share those pages copy-on-write instead of each loading its own copy. Each
+worker rebuilds its per-process state (thread pools, HTTP connection pool)
+in post_fork. Measure the result with `python -m benchmarks.worker_memory`.
+"""
+import importlib.util
+import multiprocessing
+import os
+
+bind = os.getenv('BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+# uvicorn.workers is deprecated in favour of the uvicorn-worker package
+worker_class = ('uvicorn_worker.UvicornWorker' if importlib.util.find_spec('uvicorn_worker')
+                else 'uvicorn.workers.UvicornWorker')
+# PRELOAD_APP=0 loads the components in every worker instead (e.g. to compare memory)
+preload_app = os.getenv('PRELOAD_APP', '1') != '0'
+timeout = int(os.getenv('WORKER_TIMEOUT', '120'))
+graceful_timeout = 30
+# Outside the checkout, so a running server leaves no untracked file in the repo
+pidfile = os.getenv('GUNICORN_PIDFILE', '/tmp/gunicorn.pid')
+
+# Split the cores between the workers' embedding (torch or ONNX Runtime) thread pools
+os.environ.setdefault('EMBEDDING_THREADS', str(max(1, multiprocessing.cpu_count() // workers)))
+
+
+def when_ready(server):
+    # Runs in the master after the app is imported and before any worker is forked
+    if preload_app:
+        import main
+        main.preload()
+
+
+def post_fork(server, worker):
+    import main
+    main.after_fork()
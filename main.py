@@ -1,13 +1,25 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware  
 from pydantic import BaseModel  
 from scripts.rag import RAGPipeline
-from agents.agents import SupportAgents
-from textwrap import dedent
-from crewai import Task, Crew
+from scripts.embedder import set_num_threads
+from scripts.pipeline import QueryPipeline
+from scripts.classification import LLMClassifier
+from scripts.intent_classifier import IntentClassifier
+from scripts.faq_index import FAQIndex
+from scripts.scheduler import Overloaded
+from scripts.sentiment import SentimentScorer
+from scripts.answer_cache import SemanticAnswerCache
+from scripts.startup import Startup
+from scripts.tracing import Tracer, TracingMiddleware, annotate, capture, record_error
+from scripts.metrics import IN_FLIGHT, REGISTRY, REQUESTS
+from typing import Dict, Any, List, Literal, Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
+import gc
 import json
-from typing import Dict, Any
-import re
+import os
 
 app = FastAPI(title="AI Customer Support API")
 
@@ -22,12 +34,128 @@ app.add_middleware(
     max_age=3600  # Cache preflight requests for 1 hour
 )  
 
-# Initialize components
-rag = RAGPipeline()  
-agents = SupportAgents()  
+# Request ids and sampled per-stage traces, written off the request path (see scripts/tracing.py)
+tracer = Tracer()
+app.add_middleware(TracingMiddleware, tracer=tracer)
+
+# Components are loaded in the background at startup (see load_components);
+# requests get a 503 until /health/ready reports ready
+rag = None
+agents = None
+pipeline = None
+# Set when the components were loaded before forking (see preload)
+preloaded = False
+# Sentiment agent is opt-in (SENTIMENT_MODE=llm), e.g. for audits
+sentiment_scorer = SentimentScorer() if os.getenv('SENTIMENT_MODE', 'local') == 'local' else None
+answer_cache = SemanticAnswerCache() if os.getenv('ANSWER_CACHE', 'on') == 'on' else None
+use_local_intent = os.getenv('INTENT_CLASSIFIER', 'local') == 'local'
+# `combined` classifies with one structured LLM call, `agents` with the intent and sentiment Crews
+use_agents = os.getenv('CLASSIFICATION_MODE', 'combined') == 'agents'
+use_faq_fast_path = os.getenv('FAQ_FAST_PATH', 'on') == 'on'
+startup = Startup(["rag"] + (["agents"] if use_agents else []) + ["warmup"]
+                  + (["intent_classifier"] if use_local_intent else [])
+                  + (["faq_index"] if use_faq_fast_path else []))
+
+def load_agents():
+    # Imported here: crewai is slow to import
+    from agents.agents import SupportAgents
+    return SupportAgents()
+
+def load_components(startup: Startup):
+    """Load the model, indexes and agents, warm them up and build the pipeline"""
+    global rag, agents, pipeline
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='startup') as loader:
+        # The agents (crewai) load alongside the embedding model and indexes
+        agents_future = loader.submit(startup.step, "agents", load_agents) if use_agents else None
+        loaded_rag = startup.step("rag", RAGPipeline)
+        rag = loaded_rag
+        startup.step("warmup", loaded_rag.warmup)
+        # Local intent classifier shares the retrieval embedding model
+        intent_classifier = None
+        if use_local_intent:
+            intent_classifier = startup.step("intent_classifier", IntentClassifier.load_or_fit, loaded_rag.model)
+        # Curated FAQ answers, matched against the same query embeddings
+        faq_index = None
+        if use_faq_fast_path:
+            faq_index = startup.step("faq_index", FAQIndex.load_or_build, loaded_rag.model)
+        agents = agents_future.result() if agents_future is not None else None
+    # Shares the RAG pipeline's pooled OpenRouter client
+    llm_classifier = None if use_agents else LLMClassifier(loaded_rag.llm)
+    pipeline = QueryPipeline(loaded_rag, agents, intent_classifier=intent_classifier,
+                             sentiment_scorer=sentiment_scorer, answer_cache=answer_cache,
+                             llm_classifier=llm_classifier, faq_index=faq_index)
+
+def preload():
+    """Load every component in this process before workers are forked (gunicorn.conf.py).
+
+    Workers then share the model weights and indexes copy-on-write instead
+    of each loading its own copy.
+    """
+    global preloaded
+    # Embed on one thread in the master: an inference thread pool (torch's
+    # OpenMP pool, ONNX Runtime's) does not survive fork. Workers set their
+    # own thread count in after_fork.
+    worker_threads = os.environ.get('EMBEDDING_THREADS')
+    os.environ['EMBEDDING_THREADS'] = '1'
+    try:
+        startup.run(load_components)
+    finally:
+        if worker_threads is None:
+            del os.environ['EMBEDDING_THREADS']
+        else:
+            os.environ['EMBEDDING_THREADS'] = worker_threads
+    # Loaded objects are never collected; freezing them keeps the collector
+    # from writing to (and so un-sharing) their pages in the workers
+    gc.freeze()
+    preloaded = True
+
+def after_fork():
+    """Rebuild per-process state (threads, connection pools) in a forked worker"""
+    if not preloaded:
+        return
+    if rag is not None:
+        set_num_threads(rag.model, int(os.getenv('EMBEDDING_THREADS', '0')) or os.cpu_count())
+        rag.after_fork()
+    if pipeline is not None:
+        pipeline.after_fork()
+
+@app.on_event("startup")
+async def start_loading():
+    if not preloaded:
+        startup.start(load_components)
+
+@app.on_event("shutdown")
+async def shutdown_pipeline():
+    if pipeline is not None:
+        pipeline.shutdown()
+    if rag is not None:
+        await rag.aclose()
+    tracer.writer.close()
+
+def require_ready() -> QueryPipeline:
+    """The query pipeline, or a 503 while components are still loading"""
+    if not startup.ready:
+        raise HTTPException(
+            status_code=503,
+            detail="Service is starting, retry shortly" if startup.error is None else f"Startup failed: {startup.error}",
+            headers={"Retry-After": "5"}
+        )
+    return pipeline
 
 class QueryRequest(BaseModel):  
     text: str  
+    retrieval_mode: Optional[Literal["vector", "lexical", "hybrid"]] = None  # Defaults to RETRIEVAL_MODE
+
+class BatchQueryRequest(BaseModel):
+    texts: List[str]
+    retrieval_mode: Optional[Literal["vector", "lexical", "hybrid"]] = None
+
+# Largest batch accepted by /api/query/batch; split bigger jobs client-side
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', '1000'))
+
+def cache_bypassed(http_request: Request) -> bool:
+    """Whether the caller asked to skip the answer cache (debugging)"""
+    return http_request.headers.get("X-Cache-Bypass", "").lower() in ("1", "true", "yes")
 
 class HealthResponse(BaseModel):
     status: str
@@ -35,103 +163,116 @@ class HealthResponse(BaseModel):
 
 @app.get("/health")
 async def health_check():
-    return HealthResponse(status="healthy")
+    return HealthResponse(status="healthy" if startup.ready else "starting")
+
+@app.get("/health/live")
+async def liveness():
+    """The process is up and serving HTTP (models may still be loading)"""
+    return {"status": "alive", "uptime_seconds": startup.status()["uptime_seconds"]}
+
+@app.get("/health/ready")
+async def readiness():
+    """Per-component load status and timings; 503 until every component is ready"""
+    status = startup.status()
+    return JSONResponse(status, status_code=200 if startup.ready else 503)
+
+@app.get("/metrics")
+async def metrics():
+    """Pipeline metrics in the Prometheus text exposition format"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/stats")
+async def stats():
+    return {
+        "embedding_cache": rag.embedding_cache.stats() if rag else None,
+        "embedding_service": rag.embedding_service.stats() if rag and rag.embedding_service else None,
+        "answer_cache": answer_cache.stats() if answer_cache else None,
+        "llm_scheduler": pipeline.scheduler.stats() if pipeline else None
+    }
 
 @app.post("/api/query")  
-async def handle_query(request: QueryRequest) -> Dict[str, Any]:
+async def handle_query(request: QueryRequest, http_request: Request) -> Dict[str, Any]:
+    pipeline = require_ready()
     try:
-        # Step 1: Classify intent using Task and Crew
-        intent_task = Task(
-            description=dedent(f"""
-                Classify this query: {request.text}  
-                Options: faq, complaint, troubleshooting
-            """),
-            expected_output="The category of the query: either 'faq', 'complaint', or 'troubleshooting'",
-            agent=agents.intent_agent
-        )
-        
-        intent_crew = Crew(
-            agents=[agents.intent_agent],
-            tasks=[intent_task]
+        with IN_FLIGHT.labels("query").track():
+            result = await pipeline.run(request.text, use_cache=not cache_bypassed(http_request),
+                                        retrieval_mode=request.retrieval_mode)
+        capture(query=request.text, result=result)
+        REQUESTS.labels("query", "success").inc()
+        return result
+
+    except Overloaded as e:
+        REQUESTS.labels("query", "shed").inc()
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
         )
-        
-        intent = intent_crew.kickoff()
-        print(f"Intent result: {intent}")  # Debug log
-        
-        # Step 2: Analyze sentiment
-        sentiment_task = Task(
-            description=dedent(f"""
-                Analyze the sentiment of this query: {request.text}
-                
-                Return a single word for each category:
-                1. Emotion: frustrated, confused, neutral, or positive
-                2. Urgency: low, medium, or high
-                3. Satisfaction: a number from 1 to 10
-                
-                Format your response exactly like this:
-                Emotion: [word]
-                Urgency: [word]
-                Satisfaction: [number]
-            """),
-            expected_output="Three lines with emotion, urgency, and satisfaction values",
-            agent=agents.sentiment_agent
+    except Exception as e:
+        REQUESTS.labels("query", "error").inc()
+        print(f"Error in handle_query: {str(e)}")  # Debug log
+        capture(query=request.text)
+        record_error("query", e)
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occurred while processing your query: {str(e)}"
         )
 
-        sentiment_crew = Crew(
-            agents=[agents.sentiment_agent],
-            tasks=[sentiment_task]
+@app.post("/api/query/batch")
+async def handle_query_batch(request: BatchQueryRequest, http_request: Request) -> Dict[str, Any]:
+    """Process many queries in one call; results keep the order of `texts`"""
+    pipeline = require_ready()
+    if len(request.texts) > BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch of {len(request.texts)} queries exceeds the limit of {BATCH_MAX_SIZE}"
         )
+    try:
+        with IN_FLIGHT.labels("batch").track():
+            results = await pipeline.run_batch(request.texts, use_cache=not cache_bypassed(http_request),
+                                               retrieval_mode=request.retrieval_mode)
+        annotate(batch_size=len(results))
+        capture(texts=request.texts, results=results)
+        REQUESTS.labels("batch", "success").inc()
+        return {"results": results, "status": "success"}
 
-        sentiment_result = sentiment_crew.kickoff()
-        print(f"Raw sentiment result: {sentiment_result}")  # Debug log
-        
-        # Parse sentiment result
-        sentiment_analysis = {
-            "emotion": "neutral",
-            "urgency": "medium",
-            "satisfaction": 5
-        }
-        
-        try:
-            # Extract values using regex
-            emotion_match = re.search(r'Emotion:\s*(\w+)', sentiment_result)
-            urgency_match = re.search(r'Urgency:\s*(\w+)', sentiment_result)
-            satisfaction_match = re.search(r'Satisfaction:\s*(\d+)', sentiment_result)
-            
-            if emotion_match:
-                sentiment_analysis["emotion"] = emotion_match.group(1).lower()
-            if urgency_match:
-                sentiment_analysis["urgency"] = urgency_match.group(1).lower()
-            if satisfaction_match:
-                satisfaction = int(satisfaction_match.group(1))
-                sentiment_analysis["satisfaction"] = max(1, min(10, satisfaction))  # Clamp between 1-10
-                
-            print(f"Parsed sentiment analysis: {sentiment_analysis}")  # Debug log
-        except Exception as e:
-            print(f"Error parsing sentiment: {e}")  # Debug log
-        
-        # Step 3: Retrieve documents and generate response
-        context = rag.retrieve_documents(request.text)  
-        response = rag.generate_response(request.text, context)  
-        
-        # Ensure response is a string
-        if isinstance(response, dict):
-            response = response.get('response', str(response))
-        else:
-            response = str(response)
-        
-        result = {
-            "intent": str(intent),  # Ensure intent is a string
-            "sentiment": sentiment_analysis,
-            "response": response,
-            "status": "success"
-        }
-        print(f"Final response: {result}")  # Debug log
-        return result
-        
     except Exception as e:
-        print(f"Error in handle_query: {str(e)}")  # Debug log
+        REQUESTS.labels("batch", "error").inc()
+        print(f"Error in handle_query_batch: {str(e)}")  # Debug log
+        capture(texts=request.texts)
+        record_error("batch", e)
         raise HTTPException(
             status_code=500,
-            detail=f"An error occurred while processing your query: {str(e)}"
-        )
\ No newline at end of file
+            detail=f"An error occurred while processing the batch: {str(e)}"
+        )
+
+@app.post("/api/query/stream")
+async def handle_query_stream(request: QueryRequest, http_request: Request) -> StreamingResponse:
+    """Stream query results as Server-Sent Events"""
+    pipeline = require_ready()
+    capture(query=request.text)
+
+    async def event_stream():
+        # aclosing() guarantees the pipeline stages (and the upstream LLM call)
+        # are cancelled when the client goes away
+        events = pipeline.stream(request.text, use_cache=not cache_bypassed(http_request),
+                                 retrieval_mode=request.retrieval_mode)
+        status = "disconnected"
+        try:
+            with IN_FLIGHT.labels("stream").track():
+                async with aclosing(events):
+                    async for event, data in events:
+                        if await http_request.is_disconnected():
+                            annotate(disconnected=True)
+                            break
+                        if event == "done":
+                            status = data["status"]
+                        yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            REQUESTS.labels("stream", status).inc()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
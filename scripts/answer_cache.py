@@ -0,0 +1,125 @@
+import copy
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from scripts.metrics import CACHE_LOOKUPS
+
+
+class SemanticAnswerCache:
+    """Cache of generated answers keyed by query embedding.
+
+    A lookup returns the answer of the most similar cached query when it lies
+    within `max_distance` (cosine distance) and was answered with the same
+    retrieval mode, so paraphrases of a recent query skip retrieval and
+    generation. Entries expire after `ttl` seconds, the
+    least recently used entry is evicted when the cache is full, and
+    everything is dropped when the knowledge base index version changes.
+    """
+
+    def __init__(self, max_entries: int = None, ttl: float = None, max_distance: float = None):
+        self.max_entries = max_entries or int(os.getenv('ANSWER_CACHE_SIZE', '1000'))
+        self.ttl = ttl or float(os.getenv('ANSWER_CACHE_TTL', '3600'))
+        self.max_distance = max_distance if max_distance is not None else float(os.getenv('ANSWER_CACHE_MAX_DISTANCE', '0.1'))
+
+        self._lock = threading.Lock()
+        self._vectors: Optional[np.ndarray] = None  # Allocated on first store, once the dimension is known
+        self._expires = np.zeros(self.max_entries, dtype=np.float64)
+        self._last_used = np.zeros(self.max_entries, dtype=np.float64)
+        self._payloads = [None] * self.max_entries
+        self._modes = [None] * self.max_entries  # Retrieval mode each answer was generated with
+        self._size = 0
+        self._index_version = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_version(self, index_version):
+        """Drop every entry when the knowledge base has been re-indexed (caller holds the lock)"""
+        if index_version != self._index_version:
+            if self._size:
+                self.invalidations += 1
+                print(f"Knowledge base index changed, dropping {self._size} cached answers")  # Debug log
+            self._size = 0
+            self._payloads = [None] * self.max_entries
+            self._modes = [None] * self.max_entries
+            self._index_version = index_version
+
+    def _remove(self, slot: int):
+        """Remove an entry by moving the last entry into its slot (caller holds the lock)"""
+        last = self._size - 1
+        if slot != last:
+            self._vectors[slot] = self._vectors[last]
+            self._expires[slot] = self._expires[last]
+            self._last_used[slot] = self._last_used[last]
+            self._payloads[slot] = self._payloads[last]
+            self._modes[slot] = self._modes[last]
+        self._payloads[last] = None
+        self._modes[last] = None
+        self._size -= 1
+
+    def lookup(self, query_embedding: np.ndarray, index_version=None, mode: str = None) -> Optional[Dict[str, Any]]:
+        """Return a copy of the cached payload for the closest query with this retrieval mode, if close enough"""
+        with self._lock:
+            self._check_version(index_version)
+            if not self._size:
+                self.misses += 1
+                CACHE_LOOKUPS.labels('answer', 'miss').inc()
+                return None
+
+            now = time.monotonic()
+            similarities = self._vectors[:self._size] @ query_embedding
+            similarities[self._expires[:self._size] <= now] = -np.inf
+            similarities[[entry_mode != mode for entry_mode in self._modes[:self._size]]] = -np.inf
+            best = int(np.argmax(similarities))
+            if 1.0 - similarities[best] > self.max_distance:
+                self.misses += 1
+                CACHE_LOOKUPS.labels('answer', 'miss').inc()
+                return None
+
+            self._last_used[best] = now
+            self.hits += 1
+            CACHE_LOOKUPS.labels('answer', 'hit').inc()
+            # Callers get their own copy so responses never share mutable state
+            payload = copy.deepcopy(self._payloads[best])
+            payload["distance"] = float(1.0 - similarities[best])
+            return payload
+
+    def store(self, query_embedding: np.ndarray, payload: Dict[str, Any], index_version=None, mode: str = None):
+        """Cache a payload (sources and answer) for a query embedding and retrieval mode"""
+        with self._lock:
+            self._check_version(index_version)
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, len(query_embedding)), dtype=np.float32)
+
+            now = time.monotonic()
+            if self._size:
+                # Drop expired entries before considering eviction
+                for slot in np.flatnonzero(self._expires[:self._size] <= now)[::-1]:
+                    self._remove(int(slot))
+            if self._size == self.max_entries:
+                self._remove(int(np.argmin(self._last_used[:self._size])))
+                self.evictions += 1
+
+            slot = self._size
+            self._vectors[slot] = query_embedding
+            self._expires[slot] = now + self.ttl
+            self._last_used[slot] = now
+            self._payloads[slot] = copy.deepcopy(payload)
+            self._modes[slot] = mode
+            self._size += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": self._size
+            }
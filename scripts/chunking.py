@@ -0,0 +1,127 @@
+import hashlib
+import re
+from typing import Callable, List, NamedTuple, Tuple
+
+# Sentences end with terminal punctuation or a line break
+SENTENCE_RE = re.compile(r'[^.!?\n]+(?:[.!?]+|\n|$)')
+WORD_RE = re.compile(r'\S+')
+
+
+class Chunk(NamedTuple):
+    text: str
+    start: int  # Character offsets into the source document
+    end: int
+    n_tokens: int
+
+
+def _spans(pattern: re.Pattern, text: str, offset: int = 0) -> List[Tuple[int, int]]:
+    """Character spans of non-blank matches, with surrounding whitespace trimmed"""
+    spans = []
+    for match in pattern.finditer(text):
+        raw = match.group()
+        stripped = raw.strip()
+        if stripped:
+            start = offset + match.start() + (len(raw) - len(raw.lstrip()))
+            spans.append((start, start + len(stripped)))
+    return spans
+
+
+def sentence_spans(text: str) -> List[Tuple[int, int]]:
+    """Character spans of the sentences in a text"""
+    return _spans(SENTENCE_RE, text)
+
+
+def chunk_text(text: str, count_tokens: Callable[[List[str]], List[int]],
+               max_tokens: int = 200, overlap_tokens: int = 40) -> List[Chunk]:
+    """Split a document into overlapping, token-bounded chunks.
+
+    Sentences are packed greedily until `max_tokens` is reached; the next
+    chunk starts with the trailing sentences of the previous one that fit in
+    `overlap_tokens`. Sentences longer than `max_tokens` are split on words.
+    `count_tokens` returns the token count of each string in a list.
+    """
+    units = _spans(SENTENCE_RE, text)
+    counts = count_tokens([text[start:end] for start, end in units])
+
+    # Fall back to word units for sentences that do not fit in a chunk
+    if any(count > max_tokens for count in counts):
+        split_units, split_counts = [], []
+        for (start, end), count in zip(units, counts):
+            if count <= max_tokens:
+                split_units.append((start, end))
+                split_counts.append(count)
+            else:
+                words = _spans(WORD_RE, text[start:end], offset=start)
+                split_units.extend(words)
+                split_counts.extend(min(c, max_tokens) for c in count_tokens([text[s:e] for s, e in words]))
+        units, counts = split_units, split_counts
+
+    chunks = []
+    i = 0
+    while i < len(units):
+        # Pack units into the chunk
+        j = i
+        total = 0
+        while j < len(units) and (j == i or total + counts[j] <= max_tokens):
+            total += counts[j]
+            j += 1
+        start, end = units[i][0], units[j - 1][1]
+        chunks.append(Chunk(text[start:end], start, end, total))
+        if j == len(units):
+            break
+
+        # Step back over trailing units that fit in the overlap
+        next_i = j
+        overlap = 0
+        while next_i - 1 > i and overlap + counts[next_i - 1] <= overlap_tokens:
+            next_i -= 1
+            overlap += counts[next_i]
+        i = next_i
+    return chunks
+
+
+def chunk_id(source: str, chunk: Chunk) -> str:
+    """Stable chunk ID derived from the source name, offset and content"""
+    digest = hashlib.sha1(f"{source}\x00{chunk.text}".encode('utf-8')).hexdigest()[:12]
+    return f"{source}:{chunk.start}:{digest}"
+
+
+def tokenizer_counter(tokenizer) -> Callable[[List[str]], List[int]]:
+    """Build a `count_tokens` function from a Hugging Face tokenizer"""
+    def count_tokens(texts: List[str]) -> List[int]:
+        if not texts:
+            return []
+        return [len(ids) for ids in tokenizer(texts, add_special_tokens=False)['input_ids']]
+    return count_tokens
+
+
+# Per-process tokenizer for multiprocessing workers
+_worker_count_tokens = None
+
+
+def init_worker(tokenizer_json: str):
+    """Process pool initializer: load the embedder's tokenizer once per worker.
+
+    `tokenizer_json` is the serialized tokenizer.json of the embedder (see
+    embedder.tokenizer_json), so workers count tokens exactly like it and need
+    only the `tokenizers` package, whichever embedding backend is in use.
+    """
+    global _worker_count_tokens
+    from tokenizers import Tokenizer
+    tokenizer = Tokenizer.from_str(tokenizer_json)
+    tokenizer.no_truncation()
+    tokenizer.no_padding()
+
+    def count_tokens(texts: List[str]) -> List[int]:
+        if not texts:
+            return []
+        return [len(encoding.ids) for encoding in tokenizer.encode_batch(list(texts), add_special_tokens=False)]
+    _worker_count_tokens = count_tokens
+
+
+def chunk_file(path: str, source: str, max_tokens: int, overlap_tokens: int,
+               count_tokens: Callable[[List[str]], List[int]] = None) -> Tuple[str, List[Chunk]]:
+    """Read and chunk one knowledge base file (also used as a worker task)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    return source, chunk_text(content, count_tokens or _worker_count_tokens, max_tokens, overlap_tokens)
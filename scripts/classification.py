@@ -0,0 +1,132 @@
+import json
+import os
+import re
+from typing import Any, Dict, Tuple
+
+from scripts.metrics import LLM_ERRORS
+from scripts.tracing import annotate, stage
+
+INTENTS = ('faq', 'complaint', 'troubleshooting')
+EMOTIONS = ('frustrated', 'confused', 'neutral', 'positive')
+URGENCIES = ('low', 'medium', 'high')
+
+# Used when the model never returns a valid object
+DEFAULT_SENTIMENT = {"emotion": "neutral", "urgency": "medium", "satisfaction": 5}
+
+CLASSIFICATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "intent": {"type": "string", "enum": list(INTENTS)},
+        "emotion": {"type": "string", "enum": list(EMOTIONS)},
+        "urgency": {"type": "string", "enum": list(URGENCIES)},
+        # Strict structured outputs reject "minimum"/"maximum"; the range is in the prompt
+        # and parse_classification clamps it to 1-10
+        "satisfaction": {"type": "integer"}
+    },
+    "required": ["intent", "emotion", "urgency", "satisfaction"],
+    "additionalProperties": False
+}
+
+SYSTEM_PROMPT = (
+    "You classify customer support queries. Reply with only a JSON object with these keys: "
+    f"\"intent\" ({', '.join(INTENTS)}), \"emotion\" ({', '.join(EMOTIONS)}), "
+    f"\"urgency\" ({', '.join(URGENCIES)}) and \"satisfaction\" (an integer from 1 to 10)."
+)
+
+JSON_OBJECT_RE = re.compile(r'\{.*\}', re.DOTALL)
+
+
+class ClassificationError(ValueError):
+    """The model output is not a valid classification object"""
+
+
+def parse_classification(content: str) -> Dict[str, Any]:
+    """Decode and validate a classification object against CLASSIFICATION_SCHEMA.
+
+    Tolerates code fences or text around the object and normalizes case and
+    numeric strings; anything else that does not match the schema raises
+    ClassificationError with a message suitable for asking the model to fix it.
+    """
+    match = JSON_OBJECT_RE.search(content or '')
+    if not match:
+        raise ClassificationError("the reply does not contain a JSON object")
+    try:
+        data = json.loads(match.group())
+    except json.JSONDecodeError as e:
+        raise ClassificationError(f"the reply is not valid JSON ({e.msg})")
+    if not isinstance(data, dict):
+        raise ClassificationError("the reply must be a JSON object")
+
+    missing = [key for key in CLASSIFICATION_SCHEMA["required"] if key not in data]
+    if missing:
+        raise ClassificationError(f"missing keys: {', '.join(missing)}")
+
+    result = {}
+    for key, allowed in (('intent', INTENTS), ('emotion', EMOTIONS), ('urgency', URGENCIES)):
+        value = str(data[key]).strip().lower()
+        if value not in allowed:
+            raise ClassificationError(f"\"{key}\" must be one of {', '.join(allowed)}, got {data[key]!r}")
+        result[key] = value
+    try:
+        satisfaction = int(float(data['satisfaction']))
+    except (TypeError, ValueError):
+        raise ClassificationError(f"\"satisfaction\" must be an integer, got {data['satisfaction']!r}")
+    result['satisfaction'] = max(1, min(10, satisfaction))
+    return result
+
+
+class LLMClassifier:
+    """Classifies intent and sentiment with a single structured LLM call.
+
+    The model is asked for one JSON object (enforced with a JSON schema
+    `response_format` where the model supports it). Output that fails
+    validation is sent back with the validation error for a repair, up to
+    `max_attempts` calls in total. Shares the RAG pipeline's pooled OpenRouter
+    client, so no per-request agent or client objects are built.
+    """
+
+    def __init__(self, llm, model: str = None, max_attempts: int = None):
+        self.llm = llm
+        self.model = model or os.getenv('CLASSIFICATION_MODEL') or os.getenv('OPENROUTER_MODEL', 'openai/gpt-4o-mini')
+        self.max_attempts = max_attempts or int(os.getenv('CLASSIFICATION_MAX_ATTEMPTS', '2'))
+        self.timeout = float(os.getenv('CLASSIFICATION_TIMEOUT', '10'))
+
+    async def classify(self, text: str) -> Tuple[str, Dict[str, Any]]:
+        """Return (intent, sentiment) for a query; raises ClassificationError if no valid reply"""
+        with stage('classify_llm'):
+            messages = [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": text}
+            ]
+            error = None
+            for attempt in range(self.max_attempts):
+                data = await self.llm.chat(
+                    messages,
+                    timeout=self.timeout,
+                    model=self.model,
+                    temperature=0,
+                    max_tokens=60,
+                    response_format={
+                        "type": "json_schema",
+                        "json_schema": {"name": "classification", "strict": True, "schema": CLASSIFICATION_SCHEMA}
+                    }
+                )
+                content = data['choices'][0]['message'].get('content') or ''
+                try:
+                    result = parse_classification(content)
+                except ClassificationError as e:
+                    error = e
+                    LLM_ERRORS.labels('classification_invalid').inc()
+                    annotate(invalid_attempts=attempt + 1, last_error=str(e))
+                    # Ask the model to repair its own output
+                    messages = messages[:2] + [
+                        {"role": "assistant", "content": content},
+                        {"role": "user", "content": f"That reply is invalid: {e}. Reply with only the corrected JSON object."}
+                    ]
+                    continue
+
+                annotate(**result)
+                sentiment = {key: result[key] for key in ('emotion', 'urgency', 'satisfaction')}
+                return result['intent'], sentiment
+
+            raise ClassificationError(f"no valid classification after {self.max_attempts} attempts: {error}")
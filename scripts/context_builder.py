@@ -0,0 +1,151 @@
+import os
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from scripts.chunking import sentence_spans
+
+# Chat format overhead per message and for priming the reply (OpenAI's accounting)
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+
+# Loaded encoders per model, and when a model whose encoder failed to load may be retried
+_encoders: Dict[str, Any] = {}
+_retry_at: Dict[str, float] = {}
+_encoder_lock = threading.Lock()
+ENCODER_RETRY_SECONDS = 60
+
+
+def _load_encoder(model: str):
+    """Load an encoder, recording a failure for a later retry (caller holds _encoder_lock)"""
+    try:
+        import tiktoken
+        name = model.split('/')[-1]
+        try:
+            encoder = tiktoken.encoding_for_model(name)
+        except KeyError:
+            newer = name.startswith(('gpt-4o', 'gpt-4.1', 'o1', 'o3'))
+            encoder = tiktoken.get_encoding('o200k_base' if newer else 'cl100k_base')
+    except Exception as e:
+        _retry_at[model] = time.monotonic() + ENCODER_RETRY_SECONDS
+        print(f"tiktoken encoder for {model} unavailable ({e}), estimating token counts "
+              f"and retrying in {ENCODER_RETRY_SECONDS}s")  # Debug log
+        return None
+    _encoders[model] = encoder
+    _retry_at.pop(model, None)
+    return encoder
+
+
+def _retry_encoder(model: str):
+    try:
+        _load_encoder(model)
+    finally:
+        _encoder_lock.release()
+
+
+def get_encoder(model: str):
+    """tiktoken encoder for an OpenRouter model id, cached per model.
+
+    Models tiktoken does not know (non-OpenAI models behind OpenRouter) are
+    approximated with o200k_base/cl100k_base. The first call loads the
+    encoding synchronously (RAGPipeline.warmup makes it at startup). Returns
+    None while tiktoken or its encoding files are unavailable (e.g. offline);
+    token counts then fall back to a characters-per-token estimate, and the
+    load is retried in a background thread every ENCODER_RETRY_SECONDS, so a
+    transient failure neither sticks nor blocks the event loop.
+    """
+    encoder = _encoders.get(model)
+    if encoder is not None:
+        return encoder
+    if model not in _retry_at:
+        with _encoder_lock:
+            if model in _encoders or model in _retry_at:
+                return _encoders.get(model)
+            return _load_encoder(model)
+    if time.monotonic() >= _retry_at.get(model, 0.0) and _encoder_lock.acquire(blocking=False):
+        threading.Thread(target=_retry_encoder, args=(model,), name='tiktoken-retry', daemon=True).start()
+    return None
+
+
+def count_tokens(text: str, model: str) -> int:
+    encoder = get_encoder(model)
+    if encoder is None:
+        return (len(text) + 3) // 4
+    return len(encoder.encode_ordinary(text))
+
+
+def count_message_tokens(messages: List[Dict[str, str]], model: str) -> int:
+    """Prompt tokens of a chat request, including the per-message overhead"""
+    return sum(count_tokens(message["content"], model) + TOKENS_PER_MESSAGE for message in messages) + TOKENS_PER_REPLY
+
+
+def truncate_tokens(text: str, max_tokens: int, model: str) -> str:
+    """First `max_tokens` tokens of a text"""
+    encoder = get_encoder(model)
+    if encoder is None:
+        return text[:max_tokens * 4]
+    return encoder.decode(encoder.encode_ordinary(text)[:max_tokens])
+
+
+class BuiltContext(NamedTuple):
+    text: str
+    tokens: int
+    passages: int  # Retrieved passages that contributed at least one sentence
+    truncated: bool  # Whether the budget cut off part of the context
+
+
+class ContextBuilder:
+    """Assembles retrieved passages into a compact, token-budgeted prompt section.
+
+    Passages are taken in relevance (retrieval) order and added sentence by
+    sentence until `max_tokens` is reached, so truncation always happens at a
+    sentence boundary. Sentences already included (the overlap between
+    neighbouring chunks, or the same passage retrieved twice) are skipped.
+    The output is plain text: a `[n] source` header followed by the passage.
+    """
+
+    def __init__(self, model: str, max_tokens: int = None):
+        self.model = model
+        self.max_tokens = max_tokens or int(os.getenv('CONTEXT_TOKEN_BUDGET', '1500'))
+
+    def build(self, context: List[Dict[str, str]], max_tokens: Optional[int] = None) -> BuiltContext:
+        budget = max_tokens or self.max_tokens
+        seen = set()
+        sections = []
+        used = 0
+        truncated = False
+
+        for doc in context:
+            content = doc.get('content') or ''
+            header = f"[{len(sections) + 1}] {doc.get('source', 'unknown')}\n"
+            header_tokens = count_tokens(header, self.model) + 1  # Plus the blank line between sections
+            sentences = []
+            section_tokens = header_tokens
+
+            for start, end in sentence_spans(content):
+                sentence = content[start:end]
+                key = ' '.join(sentence.lower().split())
+                if key in seen:
+                    continue
+                tokens = count_tokens(sentence + ' ', self.model)
+                if used + section_tokens + tokens > budget:
+                    if not sections and not sentences:
+                        # Never send an empty context because the top sentence alone is too long
+                        sentence = truncate_tokens(sentence, budget - used - section_tokens, self.model)
+                        if sentence:
+                            sentences.append(sentence)
+                            section_tokens = budget - used
+                    truncated = True
+                    break
+                seen.add(key)
+                sentences.append(sentence)
+                section_tokens += tokens
+
+            if sentences:
+                sections.append(header + ' '.join(sentences))
+                used += section_tokens
+            if truncated:
+                break
+
+        return BuiltContext("\n\n".join(sections), used, len(sections), truncated)
@@ -1,7 +1,7 @@
 import chromadb
 import os
 from dotenv import load_dotenv
-from sentence_transformers import SentenceTransformer
+from scripts.embedder import load_embedder
 
 # Load environment variables
 load_dotenv()
@@ -17,7 +17,7 @@ collection = client.get_collection("customer_support_docs")
 
 # Load the model once at startup
 print("Loading sentence transformer model...")
-model = SentenceTransformer('all-MiniLM-L6-v2')
+model = load_embedder()
 print("Model loaded successfully!")
 
 def query_documents(query_text, n_results=3):
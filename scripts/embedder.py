@@ -0,0 +1,309 @@
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Dict, List, Union
+
+import numpy as np
+
+# Project root (one level up from scripts)
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ONNX_DIR = os.path.join(PROJECT_ROOT, 'models', 'onnx')
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+
+# 'torch' runs SentenceTransformer; 'onnx' and 'onnx-int8' run the exported model on ONNX Runtime
+EMBEDDING_BACKENDS = ('torch', 'onnx', 'onnx-int8')
+
+
+def onnx_model_dir(model_name: str = EMBEDDING_MODEL_NAME) -> str:
+    return os.path.join(ONNX_DIR, model_name)
+
+
+def onnx_model_file(quantized: bool) -> str:
+    return 'model_int8.onnx' if quantized else 'model.onnx'
+
+
+def export_onnx(model_name: str = EMBEDDING_MODEL_NAME, output_dir: str = None, quantize: bool = True) -> str:
+    """Export a SentenceTransformer to ONNX (float32 and, with `quantize`, dynamic int8).
+
+    Mean pooling and normalization are part of the exported graph, so the
+    model outputs sentence embeddings directly. The tokenizer is saved next
+    to it as tokenizer.json. Needs torch and sentence-transformers; serving
+    the export needs only onnxruntime and tokenizers.
+    """
+    try:
+        import torch
+        from sentence_transformers import SentenceTransformer
+    except ImportError as e:
+        raise RuntimeError(f"Exporting the ONNX model needs torch and sentence-transformers ({e}); run "
+                           "`python -m scripts.embedder export` where they are installed and ship models/onnx") from e
+
+    output_dir = output_dir or onnx_model_dir(model_name)
+    os.makedirs(output_dir, exist_ok=True)
+    model = SentenceTransformer(model_name, device='cpu')
+    transformer, pooling = model[0], model[1]
+    if pooling.get_pooling_mode_str() != 'mean':
+        raise ValueError(f"Only mean pooling can be exported, {model_name} uses {pooling.get_pooling_mode_str()}")
+    normalize = any(type(module).__name__ == 'Normalize' for module in model)
+
+    class MeanPooling(torch.nn.Module):
+        def __init__(self, encoder):
+            super().__init__()
+            self.encoder = encoder
+
+        def forward(self, input_ids, attention_mask, token_type_ids=None):
+            hidden = self.encoder(input_ids=input_ids, attention_mask=attention_mask,
+                                  token_type_ids=token_type_ids)[0]
+            mask = attention_mask.unsqueeze(-1).to(hidden.dtype)
+            embeddings = (hidden * mask).sum(1) / mask.sum(1).clamp(min=1e-9)
+            return torch.nn.functional.normalize(embeddings, p=2, dim=1) if normalize else embeddings
+
+    sample = model.tokenizer(["export sample"], return_tensors='pt')
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in sample]
+    path = os.path.join(output_dir, onnx_model_file(False))
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes['sentence_embedding'] = {0: 'batch'}
+    with torch.no_grad():
+        torch.onnx.export(MeanPooling(transformer.auto_model.eval()), tuple(sample[name] for name in input_names),
+                          path, input_names=input_names, output_names=['sentence_embedding'],
+                          dynamic_axes=dynamic_axes, opset_version=14, do_constant_folding=True)
+    model.tokenizer.save_pretrained(output_dir)
+    config = {
+        "model_name": model_name,
+        "max_seq_length": model.max_seq_length,
+        "dimension": model.get_sentence_embedding_dimension(),
+        "normalize": normalize,
+        "input_names": input_names
+    }
+    with open(os.path.join(output_dir, 'embedder.json'), 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=2)
+    print(f"Exported {model_name} to {path}")  # Debug log
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantized_path = os.path.join(output_dir, onnx_model_file(True))
+        quantize_dynamic(path, quantized_path, weight_type=QuantType.QInt8)
+        print(f"Quantized weights to int8 in {quantized_path}")  # Debug log
+    return output_dir
+
+
+class _TokenCounter:
+    """Callable like a Hugging Face tokenizer, for chunking.tokenizer_counter"""
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+
+    def __call__(self, texts: List[str], add_special_tokens: bool = True) -> Dict[str, List[List[int]]]:
+        encodings = self.tokenizer.encode_batch(list(texts), add_special_tokens=add_special_tokens)
+        return {"input_ids": [encoding.ids for encoding in encodings]}
+
+
+class OnnxEmbedder:
+    """Sentence embedder running an exported model on ONNX Runtime.
+
+    Implements the part of the `SentenceTransformer` interface the pipeline
+    uses (`encode`, `tokenizer`, `get_sentence_embedding_dimension`) without
+    importing torch. Inputs are sorted by length before batching, so batches
+    need little padding. `threads` sets the intra-op threads (0 lets ONNX
+    Runtime use every core); idle threads sleep instead of spinning, since
+    encodes are short and other processes share the cores.
+    """
+
+    def __init__(self, model_dir: str, quantized: bool = False, threads: int = 0):
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, 'embedder.json'), 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        self.model_name = config["model_name"]
+        self.backend = 'onnx-int8' if quantized else 'onnx'
+        self.max_seq_length = config["max_seq_length"]
+        self.dimension = config["dimension"]
+        self.input_names = config["input_names"]
+        self.model_path = os.path.join(model_dir, onnx_model_file(quantized))
+
+        tokenizer_path = os.path.join(model_dir, 'tokenizer.json')
+        self.tokenizer = _TokenCounter(Tokenizer.from_file(tokenizer_path))
+        self._tokenizer = Tokenizer.from_file(tokenizer_path)
+        self._tokenizer.enable_truncation(self.max_seq_length)
+        self._tokenizer.enable_padding(pad_id=self._tokenizer.token_to_id('[PAD]') or 0)
+        self.session = self._create_session(threads)
+
+    def _create_session(self, threads: int):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.add_session_config_entry('session.intra_op.allow_spinning', '0')
+        return ort.InferenceSession(self.model_path, options, providers=['CPUExecutionProvider'])
+
+    def set_num_threads(self, threads: int):
+        """Recreate the session with a new intra-op thread pool (e.g. in a forked worker)"""
+        self.session = self._create_session(threads)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32, normalize_embeddings: bool = False,
+               convert_to_numpy: bool = True, **kwargs) -> np.ndarray:
+        """Embed sentences as float32 rows (a single row for a string)"""
+        single = isinstance(sentences, str)
+        sentences = [sentences] if single else list(sentences)
+        embeddings = np.empty((len(sentences), self.dimension), dtype=np.float32)
+        order = np.argsort([-len(sentence) for sentence in sentences], kind='stable')
+        for start in range(0, len(sentences), batch_size):
+            rows = order[start:start + batch_size]
+            encodings = self._tokenizer.encode_batch([sentences[row] for row in rows])
+            inputs = {
+                'input_ids': np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+                'attention_mask': np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64),
+                'token_type_ids': np.array([encoding.type_ids for encoding in encodings], dtype=np.int64)
+            }
+            embeddings[rows] = self.session.run(None, {name: inputs[name] for name in self.input_names})[0]
+        if normalize_embeddings:
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings[0] if single else embeddings
+
+
+def load_embedder(backend: str = None, model_name: str = EMBEDDING_MODEL_NAME, threads: int = None):
+    """The sentence embedder selected by EMBEDDING_BACKEND, with EMBEDDING_THREADS intra-op threads.
+
+    The ONNX backends export the model on first use if no export is cached
+    in models/onnx (which needs torch once).
+    """
+    backend = backend or os.getenv('EMBEDDING_BACKEND', 'torch')
+    threads = threads if threads is not None else int(os.getenv('EMBEDDING_THREADS', '0'))
+    if backend == 'torch':
+        # Imported here: sentence-transformers pulls in torch
+        from sentence_transformers import SentenceTransformer
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        return SentenceTransformer(model_name)
+    if backend in ('onnx', 'onnx-int8'):
+        quantized = backend == 'onnx-int8'
+        model_dir = onnx_model_dir(model_name)
+        if not os.path.exists(os.path.join(model_dir, onnx_model_file(quantized))):
+            print(f"No ONNX export of {model_name} in {model_dir}, exporting it")
+            export_onnx(model_name, model_dir, quantize=quantized)
+        return OnnxEmbedder(model_dir, quantized, threads)
+    raise ValueError(f"Unknown EMBEDDING_BACKEND: {backend} (expected one of {', '.join(EMBEDDING_BACKENDS)})")
+
+
+def tokenizer_json(model) -> str:
+    """Tokenizer of an embedder returned by load_embedder, serialized as tokenizer.json"""
+    if isinstance(model, OnnxEmbedder):
+        return model.tokenizer.tokenizer.to_str()
+    return model.tokenizer.backend_tokenizer.to_str()
+
+
+def embedder_id(model) -> str:
+    """Model and backend of an embedder returned by load_embedder, e.g. 'all-MiniLM-L6-v2/onnx-int8'.
+
+    Stored with saved embeddings (intent classifier, FAQ index), which are
+    rebuilt when it no longer matches the embedder in use.
+    """
+    if isinstance(model, OnnxEmbedder):
+        return f"{model.model_name}/{model.backend}"
+    return f"{EMBEDDING_MODEL_NAME}/torch"
+
+
+def saved_embedder_id(data) -> str:
+    """embedder_id stored in a saved .npz (files saved before it was recorded were built with torch)"""
+    return str(data['embedder']) if 'embedder' in data.files else f"{data['model_name']}/torch"
+
+
+def set_num_threads(model, threads: int):
+    """Set the intra-op threads of an embedder returned by load_embedder"""
+    if isinstance(model, OnnxEmbedder):
+        model.set_num_threads(threads)
+    else:
+        import torch
+        torch.set_num_threads(threads)
+
+
+def parity_texts() -> List[str]:
+    """Intent dataset queries plus knowledge base paragraphs (long inputs reach truncation)"""
+    from scripts.intent_classifier import load_csv_split
+    texts = [text for split in ('train', 'test') for text, _ in load_csv_split(split)]
+    knowledge_dir = os.path.join(PROJECT_ROOT, 'customer_Support_bot data', 'knowledge_base')
+    for filename in sorted(os.listdir(knowledge_dir)) if os.path.isdir(knowledge_dir) else []:
+        with open(os.path.join(knowledge_dir, filename), 'r', encoding='utf-8') as f:
+            texts.extend(paragraph.strip() for paragraph in f.read().split('\n\n') if paragraph.strip())
+    return texts
+
+
+def single_query_ms(model, texts: List[str], repeats: int = 50) -> float:
+    """Median latency of embedding one query"""
+    timings = []
+    for text in (texts * (repeats // max(1, len(texts)) + 1))[:repeats]:
+        start = time.perf_counter()
+        model.encode([text], normalize_embeddings=True)
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings) * 1000)
+
+
+def parity(backend: str, min_cosine: float) -> Dict[str, float]:
+    """Cosine similarity of `backend` embeddings to the PyTorch reference on the repo's data"""
+    texts = parity_texts()
+    start = time.perf_counter()
+    reference_model = load_embedder('torch')
+    torch_load_s = time.perf_counter() - start
+    start = time.perf_counter()
+    model = load_embedder(backend)
+    load_s = time.perf_counter() - start
+
+    reference = reference_model.encode(texts, batch_size=64, normalize_embeddings=True, convert_to_numpy=True)
+    candidate = model.encode(texts, batch_size=64, normalize_embeddings=True, convert_to_numpy=True)
+    cosine = (reference * candidate).sum(axis=1)
+    # Nearest-neighbour agreement: does each text's closest other text stay the same?
+    neighbours = []
+    for embeddings in (reference, candidate):
+        similarities = embeddings @ embeddings.T
+        np.fill_diagonal(similarities, -np.inf)
+        neighbours.append(similarities.argmax(axis=1))
+    queries = texts[:64]
+    return {
+        "texts": len(texts),
+        "mean_cosine": float(cosine.mean()),
+        "min_cosine": float(cosine.min()),
+        "below_min_cosine": int((cosine < min_cosine).sum()),
+        "nearest_neighbour_agreement": float((neighbours[0] == neighbours[1]).mean()),
+        "torch_load_s": torch_load_s,
+        "load_s": load_s,
+        "torch_single_query_ms": single_query_ms(reference_model, queries),
+        "single_query_ms": single_query_ms(model, queries)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the ONNX embedding model and check its parity with PyTorch")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help="Export to ONNX and quantize to int8 (needs torch)")
+    export_parser.add_argument('--model', default=EMBEDDING_MODEL_NAME)
+    export_parser.add_argument('--output', help="Export directory (default models/onnx/<model>)")
+    export_parser.add_argument('--no-quantize', action='store_true', help="Skip the int8 model")
+
+    parity_parser = subparsers.add_parser('parity', help="Compare an ONNX backend with the PyTorch model")
+    parity_parser.add_argument('--backend', default='onnx-int8', choices=EMBEDDING_BACKENDS[1:])
+    parity_parser.add_argument('--min-cosine', type=float, default=0.99,
+                               help="Fail if any text's cosine similarity to PyTorch is below this")
+
+    args = parser.parse_args()
+    if args.command == 'export':
+        export_onnx(args.model, args.output, quantize=not args.no_quantize)
+        return
+
+    report = parity(args.backend, args.min_cosine)
+    for name, value in report.items():
+        print(f"  {name}: {value:.4f}" if isinstance(value, float) else f"  {name}: {value}")
+    if report["below_min_cosine"]:
+        print(f"{report['below_min_cosine']} texts below cosine {args.min_cosine}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from scripts.metrics import CACHE_LOOKUPS
+
+
+def normalize_query(text: str) -> str:
+    """Normalize query text for cache keys.
+
+    all-MiniLM-L6-v2 uses an uncased tokenizer, so lowercasing and collapsing
+    whitespace does not change the embedding.
+    """
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+class EmbeddingCache:
+    """LRU cache in front of `SentenceTransformer.encode`.
+
+    Keys are the normalized query text plus the embedder id (model and
+    backend, see `embedder_id`), values are normalized float32 vectors. The
+    in-memory LRU is bounded by entry count and bytes; an optional SQLite file
+    keeps the cache warm across restarts, and never serves vectors of another
+    backend after EMBEDDING_BACKEND changes.
+    Thread-safe, so it can be shared by every pipeline stage that embeds the
+    query. Misses are encoded through `service` (an `EmbeddingService` that
+    micro-batches concurrent callers) when one is given.
+    """
+
+    def __init__(self, model, embedder: str, max_entries: int = None, max_bytes: int = None,
+                 path: Optional[str] = None, service=None):
+        self.model = model
+        self.service = service
+        self.embedder = embedder
+        self.max_entries = max_entries or int(os.getenv('EMBEDDING_CACHE_SIZE', '10000'))
+        self.max_bytes = max_bytes or int(float(os.getenv('EMBEDDING_CACHE_MAX_MB', '64')) * 1024 * 1024)
+        self.path = path if path is not None else os.getenv('EMBEDDING_CACHE_PATH') or None
+
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._db = None
+        if self.path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            self._db.commit()
+
+    def _key(self, text: str) -> str:
+        return f"{self.embedder}\x00{normalize_query(text)}"
+
+    def _get(self, key: str) -> Optional[np.ndarray]:
+        """Look up a key in memory, then on disk (caller holds the lock)"""
+        vector = self._entries.get(key)
+        if vector is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            CACHE_LOOKUPS.labels('embedding', 'hit').inc()
+            return vector
+        if self._db is not None:
+            row = self._db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                vector = np.frombuffer(row[0], dtype=np.float32)
+                self._put(key, vector, persist=False)
+                self.disk_hits += 1
+                CACHE_LOOKUPS.labels('embedding', 'disk_hit').inc()
+                return vector
+        return None
+
+    def _put(self, key: str, vector: np.ndarray, persist: bool = True):
+        """Insert a vector and evict least recently used entries (caller holds the lock)"""
+        vector.setflags(write=False)  # Shared between callers, so make it read-only
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key).nbytes + len(key)
+        self._entries[key] = vector
+        self._bytes += vector.nbytes + len(key)
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            old_key, old_vector = self._entries.popitem(last=False)
+            self._bytes -= old_vector.nbytes + len(old_key)
+            self.evictions += 1
+        if persist and self._db is not None:
+            self._db.execute("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                             (key, vector.tobytes()))
+
+    def encode_batch(self, texts: List[str]) -> np.ndarray:
+        """Embed texts, encoding only cache misses (in a single batch)"""
+        keys = [self._key(text) for text in texts]
+        vectors: List[Optional[np.ndarray]] = [None] * len(texts)
+        with self._lock:
+            for i, key in enumerate(keys):
+                vectors[i] = self._get(key)
+
+        # Encode each distinct missing text once, outside the lock
+        missing: Dict[str, List[int]] = {}
+        for i, key in enumerate(keys):
+            if vectors[i] is None:
+                missing.setdefault(key, []).append(i)
+        if missing:
+            sentences = [normalize_query(texts[indices[0]]) for indices in missing.values()]
+            if self.service is not None:
+                encoded = self.service.encode(sentences)
+            else:
+                encoded = np.asarray(
+                    self.model.encode(sentences, batch_size=64, normalize_embeddings=True, convert_to_numpy=True),
+                    dtype=np.float32
+                )
+            with self._lock:
+                self.misses += len(missing)
+                CACHE_LOOKUPS.labels('embedding', 'miss').inc(len(missing))
+                for (key, indices), vector in zip(missing.items(), encoded):
+                    vector = vector.copy()
+                    self._put(key, vector)
+                    for i in indices:
+                        vectors[i] = vector
+                if self._db is not None:
+                    self._db.commit()
+
+        return np.stack(vectors) if vectors else np.empty((0, 0), dtype=np.float32)
+
+    def encode(self, text: str) -> np.ndarray:
+        """Embed a single text"""
+        return self.encode_batch([text])[0]
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters and current size"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes
+            }
+
+    def close(self):
+        if self._db is not None:
+            with self._lock:
+                self._db.close()
+                self._db = None
@@ -0,0 +1,125 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, NamedTuple
+
+import numpy as np
+
+from scripts.metrics import Histogram
+
+BATCH_SIZES = Histogram('support_embedding_batch_size', 'Texts per micro-batched encode call.',
+                        [1, 2, 4, 8, 16, 32, 64, 128, 256])
+QUEUE_WAIT_SECONDS = Histogram('support_embedding_queue_wait_seconds',
+                               'Time embedding requests waited for their batch to start.',
+                               [0.0001, 0.00025, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1])
+
+
+class _Job(NamedTuple):
+    texts: List[str]
+    future: Future
+    enqueued: float
+
+
+class EmbeddingService:
+    """Micro-batches concurrent encode calls onto a single worker thread.
+
+    Callers block on a future while the worker collects pending requests into
+    one `model.encode` call. A batch closes when it holds `max_batch_size`
+    texts or `max_wait_ms` after its first request arrived, so a lone request
+    waits at most a few milliseconds, while under load requests queued during
+    the previous encode ride along in the next batch.
+    """
+
+    def __init__(self, model, max_batch_size: int = None, max_wait_ms: float = None):
+        self.model = model
+        self.max_batch_size = max_batch_size or int(os.getenv('EMBEDDING_MAX_BATCH_SIZE', '64'))
+        max_wait_ms = max_wait_ms if max_wait_ms is not None else float(os.getenv('EMBEDDING_MAX_WAIT_MS', '2'))
+        self.max_wait = max_wait_ms / 1000
+
+        self._queue: "queue.Queue[_Job]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._pid = None
+
+    def _ensure_worker(self):
+        """Start the worker thread on first use (and again in a forked child)"""
+        if self._worker is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._worker = threading.Thread(target=self._run, name='embedding-service', daemon=True)
+                self._worker.start()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Embed texts (normalized float32); blocks until their batch is encoded"""
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        self._ensure_worker()
+        future = Future()
+        self._queue.put(_Job(list(texts), future, time.perf_counter()))
+        return future.result()
+
+    def _collect(self, first: _Job) -> List[_Job]:
+        """Gather queued jobs into a batch until it is full or the wait expires"""
+        jobs = [first]
+        size = len(first.texts)
+        deadline = first.enqueued + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                job = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                # Shutdown requested: finish this batch, then stop
+                self._queue.put(None)
+                break
+            jobs.append(job)
+            size += len(job.texts)
+        return jobs
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            jobs = self._collect(first)
+
+            started = time.perf_counter()
+            for job in jobs:
+                QUEUE_WAIT_SECONDS.observe(started - job.enqueued)
+            texts = [text for job in jobs for text in job.texts]
+            BATCH_SIZES.observe(len(texts))
+
+            try:
+                vectors = np.asarray(
+                    self.model.encode(texts, batch_size=self.max_batch_size, normalize_embeddings=True,
+                                      convert_to_numpy=True),
+                    dtype=np.float32
+                )
+            except Exception as e:
+                for job in jobs:
+                    job.future.set_exception(e)
+                continue
+
+            offset = 0
+            for job in jobs:
+                job.future.set_result(vectors[offset:offset + len(job.texts)])
+                offset += len(job.texts)
+
+    def stats(self):
+        return {
+            "batch_size": BATCH_SIZES.snapshot(),
+            "queue_wait_seconds": QUEUE_WAIT_SECONDS.snapshot()
+        }
+
+    def close(self):
+        """Stop the worker after the queued requests are encoded"""
+        if self._worker is not None and self._pid == os.getpid():
+            self._queue.put(None)
+            self._worker.join(timeout=5)
+        self._worker = None
@@ -0,0 +1,227 @@
+import argparse
+import hashlib
+import json
+import os
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from scripts.embedder import EMBEDDING_MODEL_NAME, embedder_id, load_embedder, saved_embedder_id
+from scripts.embedding_cache import normalize_query
+from scripts.intent_classifier import INTENT_DIR, INTENT_FILES, PROJECT_ROOT, clean_text, load_csv_split
+from scripts.metrics import CACHE_LOOKUPS
+
+FAQ_INDEX_PATH = os.path.join(PROJECT_ROOT, 'models', 'faq_index.npz')
+# Used until `python -m scripts.faq_index calibrate --save` picks one from the data
+DEFAULT_THRESHOLD = 0.9
+
+
+class FAQEntry(NamedTuple):
+    query: str
+    intent: str
+    response: str
+    source: str  # Intent file the entry comes from
+
+
+def load_faq_entries() -> List[FAQEntry]:
+    """Curated (query, intent, response) entries from the intent JSON files"""
+    entries = []
+    for filename in INTENT_FILES:
+        path = os.path.join(INTENT_DIR, filename)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            # Extract first key which contains the array
+            key = list(data.keys())[0]
+            entries.extend(FAQEntry(entry['query'], entry['intent'], entry['response'], filename)
+                           for entry in data[key] if entry.get('response'))
+        except Exception as e:
+            print(f"Error loading {filename}: {str(e)}")
+    return entries
+
+
+def entries_fingerprint(entries: List[FAQEntry]) -> str:
+    """Hash of the curated entries, so a saved index is rebuilt when they change"""
+    return hashlib.sha1(json.dumps([list(entry) for entry in entries]).encode('utf-8')).hexdigest()
+
+
+def embed_queries(model, texts: List[str]) -> np.ndarray:
+    """Embed texts the way RAGPipeline.embed_query does (same normalization and model)"""
+    return np.asarray(model.encode([normalize_query(text) for text in texts], batch_size=64,
+                                   normalize_embeddings=True, convert_to_numpy=True), dtype=np.float32)
+
+
+class FAQIndex:
+    """Nearest-curated-query lookup that answers common questions without generation.
+
+    Holds the normalized embeddings of every curated query. A query whose
+    cosine similarity to its nearest curated query reaches `threshold` is
+    answered with that entry's vetted response; matching is one small
+    matrix product on the query embedding the pipeline already computed.
+    """
+
+    def __init__(self, embeddings: np.ndarray, entries: List[FAQEntry], threshold: float = None,
+                 fingerprint: str = None, embedder: str = None):
+        self.embeddings = np.asarray(embeddings, dtype=np.float32)
+        self.entries = entries
+        self.fingerprint = fingerprint or entries_fingerprint(entries)
+        # Embedder (model and backend) the curated queries were embedded with
+        self.embedder = embedder
+        self.stored_threshold = threshold if threshold is not None else DEFAULT_THRESHOLD
+        # FAQ_MATCH_THRESHOLD overrides the calibrated threshold
+        self.threshold = float(os.getenv('FAQ_MATCH_THRESHOLD', self.stored_threshold))
+
+    @classmethod
+    def build(cls, model, entries: List[FAQEntry] = None, threshold: float = None):
+        """Embed the curated queries"""
+        entries = entries if entries is not None else load_faq_entries()
+        return cls(embed_queries(model, [entry.query for entry in entries]), entries, threshold,
+                   embedder=embedder_id(model))
+
+    @classmethod
+    def load(cls, path: str = FAQ_INDEX_PATH):
+        data = np.load(path)
+        if str(data['model_name']) != EMBEDDING_MODEL_NAME:
+            raise ValueError(f"{path} was built with {data['model_name']}, expected {EMBEDDING_MODEL_NAME}")
+        entries = [FAQEntry(*entry) for entry in json.loads(str(data['entries']))]
+        return cls(data['embeddings'], entries, float(data['threshold']), str(data['fingerprint']),
+                   saved_embedder_id(data))
+
+    @classmethod
+    def load_or_build(cls, model, path: str = FAQ_INDEX_PATH):
+        """Load the saved index; rebuild and save it if missing, outdated or embedded by another backend"""
+        entries = load_faq_entries()
+        threshold = None
+        if os.path.exists(path):
+            index = cls.load(path)
+            if index.fingerprint != entries_fingerprint(entries):
+                print(f"Curated FAQ data changed, rebuilding {path}")
+            elif index.embedder != embedder_id(model):
+                print(f"{path} was built with {index.embedder} embeddings, rebuilding for {embedder_id(model)}")
+            else:
+                return index
+            threshold = index.stored_threshold  # Keep the calibrated threshold
+        else:
+            print(f"No FAQ index at {path}, building one (calibrate with `python -m scripts.faq_index calibrate`)")
+        index = cls.build(model, entries, threshold)
+        index.save(path)
+        return index
+
+    def save(self, path: str = FAQ_INDEX_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(
+            path,
+            embeddings=self.embeddings,
+            entries=json.dumps([list(entry) for entry in self.entries]),
+            threshold=self.stored_threshold,
+            fingerprint=self.fingerprint,
+            model_name=EMBEDDING_MODEL_NAME,
+            embedder=self.embedder
+        )
+
+    def __len__(self):
+        return len(self.entries)
+
+    def match_embeddings(self, embeddings: np.ndarray) -> List[Optional[Tuple[FAQEntry, float]]]:
+        """(entry, similarity) of the nearest curated query for each embedding, if above the threshold"""
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        if not len(self.entries):
+            return [None] * len(embeddings)
+        similarities = embeddings @ self.embeddings.T
+        best = similarities.argmax(axis=1)
+        matches = []
+        for row, column in enumerate(best):
+            similarity = float(similarities[row, column])
+            hit = similarity >= self.threshold
+            CACHE_LOOKUPS.labels('faq', 'hit' if hit else 'miss').inc()
+            matches.append((self.entries[column], similarity) if hit else None)
+        return matches
+
+    def match(self, embedding: np.ndarray) -> Optional[Tuple[FAQEntry, float]]:
+        return self.match_embeddings(embedding)[0]
+
+
+def leave_one_out(index: FAQIndex, model, texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Similarity of CSV queries to their own curated entry and to the nearest other entry.
+
+    The CSV queries are the curated queries with punctuation stripped. The
+    nearest *other* entry is what a query would be answered with if its own
+    entry did not exist, so that similarity is the score of a wrong answer.
+    """
+    own_entry = {clean_text(entry.query): i for i, entry in enumerate(index.entries)}
+    rows = [i for i, text in enumerate(texts) if text in own_entry]
+    if len(rows) < len(texts):
+        print(f"Skipping {len(texts) - len(rows)} queries without a curated entry")  # Debug log
+    own = np.array([own_entry[texts[i]] for i in rows], dtype=np.int64)
+    similarities = embed_queries(model, [texts[i] for i in rows]) @ index.embeddings.T
+    own_similarity = similarities[np.arange(len(rows)), own]
+    similarities[np.arange(len(rows)), own] = -np.inf
+    return own_similarity, similarities.max(axis=1)
+
+
+def calibrate(index: FAQIndex, model, max_false_rate: float = 0.0, margin: float = 0.02) -> Dict[str, float]:
+    """Pick the match threshold on train.csv and report how it does on test.csv.
+
+    The threshold is the (1 - `max_false_rate`) quantile of the train
+    queries' similarity to their nearest *other* curated query, plus
+    `margin`, so questions without a curated answer almost never get one. On
+    test.csv it reports how many queries still reach their own entry
+    (coverage) and how many would get another entry's answer when their own
+    is left out (false matches).
+    """
+    train = [text for text, _ in load_csv_split('train')]
+    test = [text for text, _ in load_csv_split('test')]
+
+    _, train_wrong = leave_one_out(index, model, train)
+    threshold = float(np.quantile(train_wrong, 1 - max_false_rate)) + margin if len(train_wrong) else DEFAULT_THRESHOLD
+
+    test_own, test_wrong = leave_one_out(index, model, test)
+    return {
+        "threshold": threshold,
+        "train_queries": len(train_wrong),
+        "train_max_wrong_similarity": float(train_wrong.max()) if len(train_wrong) else 0.0,
+        "test_queries": len(test_own),
+        "test_coverage": float((test_own >= threshold).mean()) if len(test_own) else 0.0,
+        "test_false_match_rate": float((test_wrong >= threshold).mean()) if len(test_wrong) else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and calibrate the curated FAQ answer index")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help="Embed the curated queries and save the index")
+    build_parser.add_argument('--threshold', type=float, help="Match threshold (default: calibrate on train.csv)")
+    build_parser.add_argument('--output', default=FAQ_INDEX_PATH)
+
+    calibrate_parser = subparsers.add_parser('calibrate', help="Pick the threshold from train.csv, report on test.csv")
+    calibrate_parser.add_argument('--max-false-rate', type=float, default=0.0,
+                                  help="Tolerated fraction of train queries matching another entry")
+    calibrate_parser.add_argument('--margin', type=float, default=0.02, help="Added to the calibrated threshold")
+    calibrate_parser.add_argument('--save', action='store_true', help="Store the threshold in the saved index")
+    calibrate_parser.add_argument('--index', default=FAQ_INDEX_PATH)
+
+    args = parser.parse_args()
+
+    print("Loading sentence transformer model...")
+    model = load_embedder()
+
+    if args.command == 'build':
+        index = FAQIndex.build(model, threshold=args.threshold)
+        if args.threshold is None:
+            index.stored_threshold = calibrate(index, model)["threshold"]
+        index.save(args.output)
+        print(f"Saved FAQ index with {len(index)} entries (threshold {index.stored_threshold:.3f}) to {args.output}")
+    else:
+        index = FAQIndex.load_or_build(model, args.index)
+        report = calibrate(index, model, args.max_false_rate, args.margin)
+        for name, value in report.items():
+            print(f"  {name}: {value:.3f}" if isinstance(value, float) else f"  {name}: {value}")
+        if args.save:
+            index.stored_threshold = report["threshold"]
+            index.save(args.index)
+            print(f"Saved threshold {report['threshold']:.3f} to {args.index}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,15 @@
+import argparse
 import chromadb
+import hashlib
+import json
 import os
-import numpy as np
+import time
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
-from sentence_transformers import SentenceTransformer
+from scripts.embedder import EMBEDDING_MODEL_NAME, embedder_id, load_embedder, tokenizer_json
+from scripts.chunking import chunk_file, chunk_id, init_worker, tokenizer_counter
+from scripts.lexical_index import BM25Index
+from scripts.vector_store import NumpyVectorStore
 
 # Load environment variables
 load_dotenv()
@@ -12,10 +19,26 @@ load_dotenv()
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) # Get project root (one level up from scripts)
 KNOWLEDGE_DIR = os.path.join(PROJECT_ROOT, 'customer_Support_bot data', 'knowledge_base') # Changed from absolute path
 DB_PATH = os.path.join(PROJECT_ROOT, 'chroma_db') # Changed from absolute path
+INDEX_VERSION_PATH = os.path.join(DB_PATH, 'index_version')
+MANIFEST_PATH = os.path.join(DB_PATH, 'ingest_manifest.json')
+LEXICAL_INDEX_PATH = os.path.join(DB_PATH, 'bm25_index.npz')
+NUMPY_INDEX_PATH = os.path.join(DB_PATH, 'numpy_index')
 
-# Initialize ChromaDB client
-client = chromadb.PersistentClient(path=DB_PATH)
-collection = client.get_or_create_collection("customer_support_docs")
+# The numpy backend serves from a memory-mapped export of the collection
+VECTOR_BACKEND = os.getenv('VECTOR_BACKEND', 'chroma')
+VECTOR_DTYPE = os.getenv('VECTOR_DTYPE', 'float32')  # float32, float16 or int8
+
+# Chunking and batching defaults (overridable from the command line)
+CHUNK_TOKENS = int(os.getenv('CHUNK_TOKENS', '200'))  # all-MiniLM-L6-v2 truncates inputs at 256 tokens
+CHUNK_OVERLAP = int(os.getenv('CHUNK_OVERLAP', '40'))
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', '64'))
+WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE', '1000'))
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', '0'))
+
+def get_collection():
+    """Open the ChromaDB collection (not at import time, so worker processes don't open it)."""
+    client = chromadb.PersistentClient(path=DB_PATH)
+    return client.get_or_create_collection("customer_support_docs")
 
 def check_file_contents():
     """Check if files exist and have content."""
@@ -45,55 +68,264 @@ def check_file_contents():
     
     return True
 
-def process_documents():
-    """Process each document and store its embedding in ChromaDB."""
+def mark_index_updated():
+    """Bump the index version so running servers drop answers cached against the old index."""
+    with open(INDEX_VERSION_PATH, 'w') as f:
+        f.write(str(time.time()))
+
+def file_hash(path):
+    """SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_manifest():
+    """Load the ingestion manifest (file -> hash, chunk IDs), or None if there is none."""
+    try:
+        with open(MANIFEST_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def save_manifest(manifest):
+    """Write the manifest atomically so an interrupted run never leaves it half-written."""
+    tmp_path = MANIFEST_PATH + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+def scan_knowledge_base():
+    """Map each knowledge base .txt file to its (mtime_ns, size)."""
+    snapshot = {}
+    for entry in os.scandir(KNOWLEDGE_DIR):
+        if entry.is_file() and entry.name.endswith('.txt'):
+            stat = entry.stat()
+            snapshot[entry.name] = (stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+def chunk_documents(files, model, chunk_tokens=CHUNK_TOKENS, chunk_overlap=CHUNK_OVERLAP, workers=INGEST_WORKERS):
+    """Split files into chunks, returning {file: [(id, text, metadata), ...]} for files that could be read."""
+    jobs = [(os.path.join(KNOWLEDGE_DIR, filename), filename) for filename in files]
+    results = []
+    if workers > 1:
+        # Chunk files in parallel; each worker loads its own copy of the embedder's tokenizer
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                 initargs=(tokenizer_json(model),)) as pool:
+            futures = {pool.submit(chunk_file, path, source, chunk_tokens, chunk_overlap): source for path, source in jobs}
+            for future, source in futures.items():
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    print(f"Error processing {source}: {str(e)}")
+    else:
+        count_tokens = tokenizer_counter(model.tokenizer)
+        for path, source in jobs:
+            try:
+                results.append(chunk_file(path, source, chunk_tokens, chunk_overlap, count_tokens))
+            except Exception as e:
+                print(f"Error processing {source}: {str(e)}")
+
+    records = {}
+    for source, chunks in results:
+        if not chunks:
+            print(f"Skipping {source}: File is empty")
+        records[source] = []
+        for i, chunk in enumerate(chunks):
+            metadata = {"source": source, "chunk_index": i, "start": chunk.start, "end": chunk.end, "n_tokens": chunk.n_tokens}
+            records[source].append((chunk_id(source, chunk), chunk.text, metadata))
+    return records
+
+def embed_and_store(collection, model, records, batch_size=EMBED_BATCH_SIZE, write_batch_size=WRITE_BATCH_SIZE):
+    """Encode chunk records in large batches and upsert them into ChromaDB in bulk."""
+    for start in range(0, len(records), write_batch_size):
+        window = records[start:start + write_batch_size]
+        embeddings = model.encode([text for _, text, _ in window], batch_size=batch_size, convert_to_numpy=True)
+        collection.upsert(
+            ids=[chunk_id for chunk_id, _, _ in window],
+            documents=[text for _, text, _ in window],
+            embeddings=embeddings.tolist(),  # ChromaDB expects lists
+            metadatas=[metadata for _, _, metadata in window]
+        )
+        print(f"✓ Stored chunks {start + 1}-{start + len(window)} of {len(records)}")
+
+def delete_chunks(collection, ids, write_batch_size=WRITE_BATCH_SIZE):
+    """Delete chunks from ChromaDB in bulk."""
+    ids = list(ids)
+    for start in range(0, len(ids), write_batch_size):
+        collection.delete(ids=ids[start:start + write_batch_size])
+
+def update_index(collection, model, manifest, options):
+    """Bring the collection in line with the knowledge base, re-embedding only what changed.
+
+    Files whose mtime and size match the manifest are assumed unchanged; the
+    others are hashed, and only files with a new hash are re-chunked. Chunks
+    that already exist (same ID, i.e. same source, offset and content) are not
+    re-embedded. Returns a report of added, changed and removed files.
+    """
+    files = manifest["files"]
+    snapshot = scan_knowledge_base()
+    report = {"added": [], "changed": [], "removed": sorted(set(files) - set(snapshot)), "unchanged": 0}
+
+    to_chunk = {}
+    for filename, (mtime_ns, size) in snapshot.items():
+        entry = files.get(filename)
+        if entry and entry["mtime_ns"] == mtime_ns and entry["size"] == size:
+            report["unchanged"] += 1
+            continue
+        content_hash = file_hash(os.path.join(KNOWLEDGE_DIR, filename))
+        if entry and entry["hash"] == content_hash:
+            # Touched but not modified
+            entry.update(mtime_ns=mtime_ns, size=size)
+            report["unchanged"] += 1
+            continue
+        report["changed" if entry else "added"].append(filename)
+        to_chunk[filename] = {"hash": content_hash, "mtime_ns": mtime_ns, "size": size}
+
+    stale_ids = set()
+    for filename in report["removed"]:
+        stale_ids.update(files.pop(filename)["chunk_ids"])
+
+    new_records = []
+    if to_chunk:
+        print(f"\nChunking {len(to_chunk)} files ({options.chunk_tokens} tokens per chunk, {options.chunk_overlap} overlap)...")
+        chunked = chunk_documents(sorted(to_chunk), model, options.chunk_tokens, options.chunk_overlap, options.workers)
+        for filename, records in chunked.items():
+            old_ids = set(files[filename]["chunk_ids"]) if filename in files else set()
+            new_ids = [record[0] for record in records]
+            stale_ids.update(old_ids - set(new_ids))
+            new_records.extend(record for record in records if record[0] not in old_ids)
+            files[filename] = {**to_chunk[filename], "chunk_ids": new_ids}
+
+    if new_records:
+        print(f"\nGenerating embeddings for {len(new_records)} chunks...")
+        embed_and_store(collection, model, new_records, options.batch_size, options.write_batch_size)
+    if stale_ids:
+        print(f"Deleting {len(stale_ids)} stale chunks...")
+        delete_chunks(collection, stale_ids, options.write_batch_size)
+
+    save_manifest(manifest)
+    changed = report["added"] or report["changed"] or report["removed"]
+    if changed or not os.path.exists(LEXICAL_INDEX_PATH):
+        build_lexical_index(collection)
+    if VECTOR_BACKEND == 'numpy' and (changed or not os.path.exists(os.path.join(NUMPY_INDEX_PATH, 'metadata.json'))):
+        export_numpy_index(collection, manifest["embedder"])
+    if changed:
+        mark_index_updated()
+    report["embedded_chunks"] = len(new_records)
+    report["deleted_chunks"] = len(stale_ids)
+    return report
+
+def build_lexical_index(collection):
+    """Rebuild the BM25 index from every chunk in the collection, next to the ChromaDB files."""
+    results = collection.get(include=['documents'])
+    index = BM25Index.build(results['ids'], results['documents'])
+    tmp_path = LEXICAL_INDEX_PATH[:-len('.npz')] + '.tmp.npz'
+    index.save(tmp_path)
+    os.replace(tmp_path, LEXICAL_INDEX_PATH)
+    print(f"Built BM25 index over {len(index)} chunks ({len(index.terms)} terms)")
+
+def export_numpy_index(collection, embedder):
+    """Export every chunk and embedding to the memory-mapped index used by VECTOR_BACKEND=numpy."""
+    results = collection.get(include=['documents', 'embeddings', 'metadatas'])
+    NumpyVectorStore.write(NUMPY_INDEX_PATH, results['ids'], results['documents'], results['embeddings'],
+                           results['metadatas'], dtype=VECTOR_DTYPE, embedder=embedder)
+    print(f"Exported {len(results['ids'])} chunks to the {VECTOR_DTYPE} vector index at {NUMPY_INDEX_PATH}")
+
+def print_report(report):
+    """Summarize what an index update changed."""
+    def names(files):
+        return ", ".join(files[:20]) + (f" (+{len(files) - 20} more)" if len(files) > 20 else "")
+
+    print(f"\nAdded: {len(report['added'])}  Changed: {len(report['changed'])}  "
+          f"Removed: {len(report['removed'])}  Unchanged: {report['unchanged']}")
+    for label in ("added", "changed", "removed"):
+        if report[label]:
+            print(f"  {label}: {names(report[label])}")
+    print(f"Embedded {report['embedded_chunks']} chunks, deleted {report['deleted_chunks']} chunks")
+
+def open_index(options):
+    """Load the model, collection and manifest; start from scratch on --full or without a manifest."""
+    print("\nLoading sentence transformer model (this may take a moment)...")
+    model = load_embedder()
+    print("Model loaded successfully!")
+    collection = get_collection()
+
+    chunking = {"chunk_tokens": options.chunk_tokens, "chunk_overlap": options.chunk_overlap}
+    embedder = embedder_id(model)
+    manifest = load_manifest()
+    # Manifests written before the embedder was recorded were embedded with PyTorch
+    if manifest is not None and manifest.get("embedder", f"{EMBEDDING_MODEL_NAME}/torch") != embedder:
+        print(f"Index was embedded with {manifest.get('embedder', 'torch')}, re-embedding everything with {embedder}")
+        manifest = None
+    if options.full or manifest is None or manifest.get("chunking") != chunking:
+        # Without a (compatible) manifest we can't know which chunks are stale,
+        # so clear existing collection to avoid duplicates
+        try:
+            delete_chunks(collection, collection.get(include=[])["ids"], options.write_batch_size)
+            print("Cleared existing collection.")
+        except Exception:
+            print("Collection was empty or couldn't be cleared.")
+        manifest = {"chunking": chunking, "files": {}}
+    manifest["embedder"] = embedder
+    return model, collection, manifest
+
+def process_documents(options):
+    """Incrementally index the knowledge base: embed new/changed files, drop removed ones."""
     # First check if files exist and have content
     if not check_file_contents():
         return
-    
-    # Initialize the sentence transformer model
-    print("\nLoading sentence transformer model (this may take a moment)...")
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    print("Model loaded successfully!")
-    
-    files_to_process = [f for f in os.listdir(KNOWLEDGE_DIR) if f.endswith('.txt')]
-    print(f"\nProcessing {len(files_to_process)} files for embedding generation...")
-    
-    # First clear existing collection to avoid duplicates
+
+    model, collection, manifest = open_index(options)
+    print_report(update_index(collection, model, manifest, options))
+
+def watch(options):
+    """Poll the knowledge base directory and apply changes to the live collection."""
+    if not os.path.exists(KNOWLEDGE_DIR):
+        print(f"Directory {KNOWLEDGE_DIR} not found!")
+        return
+
+    model, collection, manifest = open_index(options)
+    print_report(update_index(collection, model, manifest, options))
+    print(f"\nWatching {KNOWLEDGE_DIR} every {options.interval}s (Ctrl+C to stop)...")
+
+    snapshot = scan_knowledge_base()
     try:
-        collection.delete(ids=collection.get()["ids"])
-        print("Cleared existing collection.")
-    except:
-        print("Collection was empty or couldn't be cleared.")
-    
-    for filename in files_to_process:
-        file_path = os.path.join(KNOWLEDGE_DIR, filename)
-        
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read().strip()
-                
-                if not content:
-                    print(f"Skipping {filename}: File is empty")
-                    continue
-                
-                # Generate embedding using Sentence Transformers
-                print(f"Generating embedding for {filename}...")
-                embedding = model.encode(content).tolist()  # Convert to list for ChromaDB
-                
-                # Store in ChromaDB
-                collection.add(
-                    documents=[content],
-                    embeddings=[embedding],
-                    metadatas=[{"source": filename}],
-                    ids=[filename]
-                )
-                print(f"✓ Successfully processed {filename}")
-        
-        except Exception as e:
-            print(f"Error processing {filename}: {str(e)}")
+        while True:
+            time.sleep(options.interval)
+            current = scan_knowledge_base()
+            if current != snapshot:
+                snapshot = current
+                try:
+                    print_report(update_index(collection, model, manifest, options))
+                except Exception as e:
+                    print(f"Error updating index: {str(e)}")
+                    # Resync with the last saved manifest and retry on the next poll
+                    manifest = load_manifest() or manifest
+                    snapshot = {}
+    except KeyboardInterrupt:
+        print("Stopped watching.")
 
-if __name__ == '__main__':
-    process_documents()
+def main():
+    parser = argparse.ArgumentParser(description="Chunk, embed and store the knowledge base in ChromaDB")
+    parser.add_argument('--chunk-tokens', type=int, default=CHUNK_TOKENS, help="Maximum tokens per chunk")
+    parser.add_argument('--chunk-overlap', type=int, default=CHUNK_OVERLAP, help="Tokens shared by consecutive chunks")
+    parser.add_argument('--batch-size', type=int, default=EMBED_BATCH_SIZE, help="Chunks per encode batch")
+    parser.add_argument('--write-batch-size', type=int, default=WRITE_BATCH_SIZE, help="Chunks per ChromaDB upsert")
+    parser.add_argument('--workers', type=int, default=INGEST_WORKERS, help="Processes used to chunk files (0 = in-process)")
+    parser.add_argument('--full', action='store_true', help="Clear the collection and re-embed everything")
+    parser.add_argument('--watch', action='store_true', help="Keep running and index changes as they happen")
+    parser.add_argument('--interval', type=float, default=2.0, help="Polling interval in seconds for --watch")
+    args = parser.parse_args()
+
+    if args.watch:
+        watch(args)
+        return
+
+    process_documents(args)
     print("\nEmbedding generation complete.")
-    print(f"Documents stored in ChromaDB at: {DB_PATH}")
\ No newline at end of file
+    print(f"Documents stored in ChromaDB at: {DB_PATH}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+import argparse
+import csv
+import json
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from scripts.embedder import EMBEDDING_MODEL_NAME, embedder_id, load_embedder, saved_embedder_id
+from scripts.embedding_cache import normalize_query
+
+# Configuration
+# Use relative paths for portability
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # Get project root (one level up from scripts)
+DATA_DIR = os.path.join(PROJECT_ROOT, 'customer_Support_bot data')
+INTENT_DIR = os.path.join(DATA_DIR, 'intent')
+PROCESSED_DIR = os.path.join(DATA_DIR, 'data_processed')
+MODEL_PATH = os.path.join(PROJECT_ROOT, 'models', 'intent_classifier.npz')
+
+LABELS = ('faq', 'complaint', 'troubleshooting')
+INTENT_FILES = ['complaints.json', 'faqs.json', 'troubleshooting.json']
+
+
+def clean_text(text: str) -> str:
+    """Normalize text the same way process_intent_data.py does"""
+    text = re.sub(r'[^\w\s]', '', text)
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text.lower()
+
+
+def load_csv_split(name: str) -> List[Tuple[str, str]]:
+    """Load (text, intent) pairs from data_processed/<name>.csv"""
+    path = os.path.join(PROCESSED_DIR, f'{name}.csv')
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        return [(row['text'], row['intent']) for row in csv.DictReader(f)]
+
+
+def load_intent_queries() -> Dict[str, Tuple[str, str]]:
+    """(query, intent) pairs from the intent JSON files, keyed by their clean_text form"""
+    queries = {}
+    for filename in INTENT_FILES:
+        path = os.path.join(INTENT_DIR, filename)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            # Extract first key which contains the array
+            key = list(data.keys())[0]
+            queries.update((clean_text(entry['query']), (entry['query'], entry['intent'])) for entry in data[key])
+        except Exception as e:
+            print(f"Error loading {filename}: {str(e)}")
+    return queries
+
+
+def load_training_data(include_test: bool = False) -> List[Tuple[str, str]]:
+    """Load training examples from the intent JSON files and train.csv.
+
+    The CSV splits hold punctuation-stripped copies of the curated queries;
+    examples use the original wording where it is known, so they are embedded
+    the same way as queries at serving time. Queries that appear in test.csv
+    are left out unless `include_test` is set, so that `eval` reports
+    held-out accuracy.
+    """
+    curated = load_intent_queries()
+    examples = load_csv_split('train') + list(curated.values())
+
+    excluded = set() if include_test else {text for text, _ in load_csv_split('test')}
+    unique = {}
+    for text, intent in examples:
+        key = clean_text(text)
+        if key and key not in excluded:
+            unique[key] = (curated[key][0] if key in curated else text, intent)
+    return list(unique.values())
+
+
+def load_test_data() -> List[Tuple[str, str]]:
+    """test.csv queries in their original wording (see load_training_data)"""
+    curated = load_intent_queries()
+    return [(curated[text][0] if text in curated else text, intent) for text, intent in load_csv_split('test')]
+
+
+class IntentClassifier:
+    """k-nearest-neighbour intent classifier over sentence embeddings.
+
+    Uses the same all-MiniLM-L6-v2 model as retrieval, so classifying a query
+    costs one encode plus a small matrix product. The confidence is the
+    similarity-weighted vote share of the winning label among the k nearest
+    training examples.
+    """
+
+    def __init__(self, model, embeddings: np.ndarray, labels: np.ndarray, k: int = 5,
+                 trained_with_test: bool = False, embedder: str = None, query_normalized: bool = True):
+        self.model = model
+        self.embeddings = embeddings.astype(np.float32)
+        self.labels = labels
+        self.k = min(k, len(labels))
+        self.trained_with_test = trained_with_test
+        # Embedder (model and backend) the training examples were embedded with
+        self.embedder = embedder or embedder_id(model)
+        # Whether the examples were embedded as normalize_query text (older models used punctuation-stripped text)
+        self.query_normalized = query_normalized
+
+    @classmethod
+    def fit(cls, model, examples: List[Tuple[str, str]], k: int = 5, trained_with_test: bool = False):
+        """Embed the training examples and build a classifier"""
+        # Same normalization as RAGPipeline.embed_query, whose embeddings the pipeline classifies
+        texts = [normalize_query(text) for text, _ in examples]
+        labels = np.array([LABELS.index(intent) for _, intent in examples], dtype=np.int64)
+        embeddings = model.encode(texts, batch_size=64, normalize_embeddings=True, convert_to_numpy=True)
+        return cls(model, embeddings, labels, k=k, trained_with_test=trained_with_test)
+
+    @classmethod
+    def load(cls, model, path: str = MODEL_PATH):
+        """Load a classifier saved with `save`"""
+        data = np.load(path)
+        if str(data['model_name']) != EMBEDDING_MODEL_NAME:
+            raise ValueError(f"{path} was trained with {data['model_name']}, expected {EMBEDDING_MODEL_NAME}")
+        return cls(model, data['embeddings'], data['labels'], k=int(data['k']),
+                   trained_with_test=bool(data['trained_with_test']), embedder=saved_embedder_id(data),
+                   query_normalized='query_normalized' in data.files and bool(data['query_normalized']))
+
+    @property
+    def stale(self) -> Optional[str]:
+        """Why the training embeddings do not match the query embeddings of `model`, if they do not"""
+        if self.embedder != embedder_id(self.model):
+            return f"trained with {self.embedder} embeddings, but EMBEDDING_BACKEND gives {embedder_id(self.model)}"
+        if not self.query_normalized:
+            return "trained on punctuation-stripped text instead of normalized queries"
+        return None
+
+    @classmethod
+    def load_or_fit(cls, model, path: str = MODEL_PATH):
+        """Load the saved classifier, or fit one from the intent data if none exists.
+
+        A classifier saved with another embedding backend is refitted on the
+        same data and saved again.
+        """
+        if os.path.exists(path):
+            classifier = cls.load(model, path)
+            if not classifier.stale:
+                return classifier
+            print(f"{path} was {classifier.stale}, refitting")
+            classifier = cls.fit(model, load_training_data(include_test=classifier.trained_with_test), k=classifier.k,
+                                 trained_with_test=classifier.trained_with_test)
+            classifier.save(path)
+            return classifier
+        print(f"No intent classifier at {path}, fitting one from the intent data...")
+        return cls.fit(model, load_training_data(include_test=True), trained_with_test=True)
+
+    def save(self, path: str = MODEL_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(
+            path,
+            embeddings=self.embeddings,
+            labels=self.labels,
+            k=self.k,
+            trained_with_test=self.trained_with_test,
+            model_name=EMBEDDING_MODEL_NAME,
+            embedder=self.embedder,
+            query_normalized=self.query_normalized
+        )
+
+    def predict_embeddings(self, embeddings: np.ndarray) -> List[Tuple[str, float]]:
+        """Classify a batch of normalized query embeddings"""
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        similarities = embeddings @ self.embeddings.T
+        neighbours = np.argpartition(-similarities, self.k - 1, axis=1)[:, :self.k]
+
+        # Similarity-weighted votes per label
+        weights = np.clip(np.take_along_axis(similarities, neighbours, axis=1), 0, None)
+        votes = np.zeros((len(embeddings), len(LABELS)), dtype=np.float32)
+        np.add.at(votes, (np.arange(len(embeddings))[:, None], self.labels[neighbours]), weights)
+
+        totals = votes.sum(axis=1)
+        best = votes.argmax(axis=1)
+        confidence = np.divide(votes[np.arange(len(embeddings)), best], totals,
+                               out=np.zeros_like(totals), where=totals > 0)
+        return [(LABELS[label], float(score)) for label, score in zip(best, confidence)]
+
+    def predict_batch(self, texts: List[str]) -> List[Tuple[str, float]]:
+        """Classify a batch of raw query texts"""
+        embeddings = self.model.encode([normalize_query(text) for text in texts], normalize_embeddings=True,
+                                       convert_to_numpy=True)
+        return self.predict_embeddings(embeddings)
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        """Return (intent, confidence) for a single query"""
+        return self.predict_batch([text])[0]
+
+
+def evaluate(classifier: IntentClassifier, threshold: Optional[float] = None):
+    """Print accuracy, per-label accuracy and LLM fallback rate on test.csv"""
+    test = load_test_data()
+    predictions = classifier.predict_batch([text for text, _ in test])
+
+    correct = Counter()
+    totals = Counter()
+    fallbacks = 0
+    for (text, expected), (predicted, confidence) in zip(test, predictions):
+        totals[expected] += 1
+        if predicted == expected:
+            correct[expected] += 1
+        if threshold is not None and confidence < threshold:
+            fallbacks += 1
+            print(f"  low confidence ({confidence:.2f}): '{text}' -> {predicted} (expected {expected})")
+        elif predicted != expected:
+            print(f"  misclassified ({confidence:.2f}): '{text}' -> {predicted} (expected {expected})")
+
+    if classifier.trained_with_test:
+        print("Warning: this classifier was trained with the test split, accuracy is not held-out")
+    print(f"\nAccuracy on test.csv: {sum(correct.values()) / len(test):.2%} ({sum(correct.values())}/{len(test)})")
+    for label in LABELS:
+        if totals[label]:
+            print(f"  {label}: {correct[label] / totals[label]:.2%} ({correct[label]}/{totals[label]})")
+    if threshold is not None:
+        print(f"LLM fallback rate at threshold {threshold}: {fallbacks / len(test):.2%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train or evaluate the local intent classifier")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    train_parser = subparsers.add_parser('train', help="Fit the classifier and save it")
+    train_parser.add_argument('--k', type=int, default=5, help="Number of neighbours")
+    train_parser.add_argument('--include-test', action='store_true',
+                              help="Also train on test.csv queries (for production models)")
+    train_parser.add_argument('--output', default=MODEL_PATH)
+
+    eval_parser = subparsers.add_parser('eval', help="Report accuracy on test.csv")
+    eval_parser.add_argument('--model', default=MODEL_PATH)
+    eval_parser.add_argument('--threshold', type=float,
+                             default=float(os.getenv('INTENT_CONFIDENCE_THRESHOLD', '0.6')))
+
+    args = parser.parse_args()
+
+    print("Loading sentence transformer model...")
+    model = load_embedder()
+
+    if args.command == 'train':
+        examples = load_training_data(include_test=args.include_test)
+        print(f"Training on {len(examples)} examples: {dict(Counter(intent for _, intent in examples))}")
+        classifier = IntentClassifier.fit(model, examples, k=args.k, trained_with_test=args.include_test)
+        classifier.save(args.output)
+        print(f"Saved intent classifier to {args.output}")
+        evaluate(classifier)
+    else:
+        classifier = IntentClassifier.load(model, args.model)
+        if classifier.stale:
+            parser.error(f"{args.model} was {classifier.stale}; retrain it with the train command")
+        evaluate(classifier, threshold=args.threshold)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+import re
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# Keep codes such as "err-404", "sku_1234" or "inv-2023-001" as single tokens
+TOKEN_RE = re.compile(r'[a-z0-9]+(?:[-_][a-z0-9]+)*')
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'can', 'do', 'for', 'from', 'has', 'have',
+    'how', 'i', 'if', 'in', 'is', 'it', 'its', 'me', 'my', 'of', 'on', 'or', 'our', 'so', 'that', 'the',
+    'their', 'this', 'to', 'was', 'we', 'what', 'when', 'where', 'which', 'will', 'with', 'you', 'your'
+}
+# Query terms found in more than this fraction of chunks are skipped when the query has rarer terms:
+# their BM25 weight is close to zero but their postings would dominate the scoring work
+MAX_DF_RATIO = 0.5
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens; compound words and codes are indexed whole and by their parts.
+
+    Of a code containing digits ("err-404") only the parts with digits are
+    added: prefixes such as "err" or "sku" occur in so many chunks that they
+    add little to the ranking but a lot to the postings scanned per query.
+    """
+    tokens = []
+    for token in TOKEN_RE.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        if '-' in token or '_' in token:
+            parts = [part for part in re.split(r'[-_]', token) if part not in STOPWORDS]
+            if any(char.isdigit() for char in token):
+                parts = [part for part in parts if any(char.isdigit() for char in part)]
+            tokens.extend(parts)
+    return tokens
+
+
+class BM25Index:
+    """In-memory inverted index with BM25 scoring.
+
+    Postings are stored CSR-style in flat arrays: for term t, documents
+    `doc_ids[indptr[t]:indptr[t + 1]]` with their precomputed BM25 term
+    weights in `weights`. A query only touches the postings of its terms, so it
+    stays well under a millisecond on ~100k chunks.
+    """
+
+    def __init__(self, ids: np.ndarray, terms: np.ndarray, indptr: np.ndarray, doc_ids: np.ndarray,
+                 weights: np.ndarray):
+        self.ids = ids
+        self.terms = terms
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.vocab: Dict[str, int] = {term: i for i, term in enumerate(terms.tolist())}
+
+    @classmethod
+    def build(cls, ids: List[str], documents: List[str], k1: float = 1.5, b: float = 0.75):
+        """Build an index over (chunk id, text) pairs"""
+        vocab: Dict[str, int] = {}
+        term_ids, doc_ids, tfs = [], [], []
+        doc_lengths = np.zeros(len(documents), dtype=np.float32)
+        for doc, text in enumerate(documents):
+            tokens = tokenize(text)
+            doc_lengths[doc] = len(tokens)
+            counts: Dict[int, int] = {}
+            for token in tokens:
+                term = vocab.setdefault(token, len(vocab))
+                counts[term] = counts.get(term, 0) + 1
+            term_ids.extend(counts.keys())
+            doc_ids.extend([doc] * len(counts))
+            tfs.extend(counts.values())
+
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        doc_ids = np.asarray(doc_ids, dtype=np.int32)
+        tfs = np.asarray(tfs, dtype=np.float32)
+
+        # Group postings by term
+        order = np.argsort(term_ids, kind='stable')
+        term_ids, doc_ids, tfs = term_ids[order], doc_ids[order], tfs[order]
+        df = np.bincount(term_ids, minlength=len(vocab))
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(df, out=indptr[1:])
+
+        # Precompute the BM25 weight of every posting
+        n_docs = max(len(documents), 1)
+        idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        avg_length = max(float(doc_lengths.mean()) if len(documents) else 0.0, 1.0)
+        norm = k1 * (1 - b + b * doc_lengths[doc_ids] / avg_length)
+        weights = (idf[term_ids] * tfs * (k1 + 1) / (tfs + norm)).astype(np.float32)
+
+        terms = np.array(sorted(vocab, key=vocab.get), dtype=str)
+        return cls(np.array(ids, dtype=str), terms, indptr, doc_ids, weights)
+
+    @classmethod
+    def load(cls, path: str):
+        data = np.load(path)
+        return cls(data['ids'], data['terms'], data['indptr'], data['doc_ids'], data['weights'])
+
+    def save(self, path: str):
+        # numpy appends .npz unless the path already ends with it
+        np.savez(path, ids=self.ids, terms=self.terms, indptr=self.indptr, doc_ids=self.doc_ids,
+                 weights=self.weights)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, query: str, n_results: int = 10) -> List[Tuple[str, float]]:
+        """Return the top (chunk id, BM25 score) pairs for a query"""
+        term_ids = {self.vocab[token] for token in tokenize(query) if token in self.vocab}
+        if not term_ids:
+            return []
+        max_df = MAX_DF_RATIO * len(self.ids)
+        term_ids = {term for term in term_ids if self.indptr[term + 1] - self.indptr[term] <= max_df} or term_ids
+
+        # Only score documents that contain a query term
+        slices = [slice(self.indptr[term], self.indptr[term + 1]) for term in term_ids]
+        candidates = np.concatenate([self.doc_ids[s] for s in slices])
+        scores = np.bincount(candidates, weights=np.concatenate([self.weights[s] for s in slices]),
+                             minlength=len(self.ids))
+
+        # A document has one posting per matching term, so the best n_results * len(slices)
+        # postings cover the best n_results documents
+        n_best = min(n_results * len(slices), len(candidates))
+        best = np.unique(candidates[np.argpartition(-scores[candidates], n_best - 1)[:n_best]])
+        top = best[np.argsort(-scores[best])][:n_results]
+        return [(str(self.ids[doc]), float(scores[doc])) for doc in top]
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], weights: List[float], k: int = 60) -> List[Tuple[str, float]]:
+    """Fuse ranked id lists: score(id) = sum(weight / (k + rank))"""
+    fused: Dict[str, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + weight / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
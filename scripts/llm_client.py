@@ -0,0 +1,174 @@
+import asyncio
+import importlib.util
+import json
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+
+from scripts.metrics import LLM_RETRIES, LLM_TOKENS
+
+# Status codes worth retrying: rate limits, timeouts and transient upstream errors
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header (delta seconds or HTTP date) into seconds"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def record_usage(model: Optional[str], usage: Optional[Dict[str, Any]]):
+    """Count the prompt and completion tokens OpenRouter reports for a completion"""
+    if not usage:
+        return
+    for kind in ('prompt', 'completion'):
+        tokens = usage.get(f'{kind}_tokens')
+        if tokens:
+            LLM_TOKENS.labels(model or 'default', kind).inc(tokens)
+
+
+class OpenRouterClient:
+    """Async OpenRouter chat completions client backed by a pooled httpx client.
+
+    Connections are kept alive and reused across requests (HTTP/2 when the `h2`
+    package is installed and the server negotiates it). Failed calls are
+    retried with full-jitter exponential backoff, honouring `Retry-After`.
+    """
+
+    def __init__(self, api_key: Optional[str], base_url: str = None, pool_size: int = None,
+                 timeout: float = None, max_retries: int = None):
+        self.api_key = api_key
+        self.base_url = (base_url or os.getenv('OPENROUTER_BASE_URL', 'https://openrouter.ai/api/v1')).rstrip('/')
+        self.pool_size = pool_size or int(os.getenv('OPENROUTER_POOL_SIZE', '20'))
+        self.timeout = timeout or float(os.getenv('OPENROUTER_TIMEOUT', '30'))
+        self.connect_timeout = float(os.getenv('OPENROUTER_CONNECT_TIMEOUT', '5'))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv('OPENROUTER_MAX_RETRIES', '3'))
+        self.backoff_base = float(os.getenv('OPENROUTER_BACKOFF_BASE', '0.5'))
+        self.backoff_max = float(os.getenv('OPENROUTER_BACKOFF_MAX', '8'))
+        self.http2 = os.getenv('OPENROUTER_HTTP2', '1') != '0' and importlib.util.find_spec('h2') is not None
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def chat_url(self) -> str:
+        return f"{self.base_url}/chat/completions"
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """The shared connection pool, created on first use"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=self.http2,
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size,
+                    keepalive_expiry=60
+                ),
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "HTTP-Referer": "https://github.com/your-repository",
+                    "X-Title": "Customer Support Bot"
+                }
+            )
+        return self._client
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        """Delay before the next attempt: Retry-After if given, else full jitter"""
+        if retry_after is not None:
+            return min(retry_after, self.timeout)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def chat(self, messages: List[Dict[str, str]], timeout: float = None, **params) -> Dict[str, Any]:
+        """POST a chat completion and return the decoded JSON body"""
+        payload = {"messages": messages, **params}
+        request_timeout = httpx.Timeout(timeout, connect=self.connect_timeout) if timeout else httpx.USE_CLIENT_DEFAULT
+
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                response = await self.client.post(self.chat_url, json=payload, timeout=request_timeout)
+                if response.status_code not in RETRYABLE_STATUS_CODES or attempt == self.max_retries:
+                    response.raise_for_status()
+                    body = response.json()
+                    record_usage(params.get('model'), body.get('usage'))
+                    return body
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                LLM_RETRIES.labels(response.status_code).inc()
+                print(f"OpenRouter returned {response.status_code}, retrying (attempt {attempt + 1})")  # Debug log
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                if attempt == self.max_retries:
+                    raise
+                LLM_RETRIES.labels(type(e).__name__).inc()
+                print(f"OpenRouter request failed: {e!r}, retrying (attempt {attempt + 1})")  # Debug log
+
+            await asyncio.sleep(self._backoff(attempt, retry_after))
+
+    async def stream_chat(self, messages: List[Dict[str, str]], timeout: float = None,
+                          **params) -> AsyncIterator[str]:
+        """Stream a chat completion, yielding content deltas as they arrive.
+
+        Retries only happen before the first token is received. Closing the
+        generator (e.g. when the client disconnects) closes the upstream
+        response, which cancels the completion on OpenRouter's side.
+        """
+        payload = {"messages": messages, "stream": True, **params}
+        request_timeout = httpx.Timeout(timeout, connect=self.connect_timeout) if timeout else httpx.USE_CLIENT_DEFAULT
+        started = False
+
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                async with self.client.stream('POST', self.chat_url, json=payload, timeout=request_timeout) as response:
+                    if response.status_code in RETRYABLE_STATUS_CODES and attempt < self.max_retries:
+                        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                        LLM_RETRIES.labels(response.status_code).inc()
+                        print(f"OpenRouter returned {response.status_code}, retrying (attempt {attempt + 1})")  # Debug log
+                    else:
+                        response.raise_for_status()
+                        async for line in response.aiter_lines():
+                            # Skip blank separators and SSE comments (": OPENROUTER PROCESSING")
+                            if not line.startswith('data:'):
+                                continue
+                            data = line[len('data:'):].strip()
+                            if data == '[DONE]':
+                                return
+                            chunk = json.loads(data)
+                            if 'error' in chunk:
+                                raise RuntimeError(chunk['error'].get('message', str(chunk['error'])))
+                            # Sent with the last chunk when the request asks for usage accounting
+                            record_usage(params.get('model'), chunk.get('usage'))
+                            choices = chunk.get('choices') or [{}]
+                            delta = choices[0].get('delta', {}).get('content')
+                            if delta:
+                                started = True
+                                yield delta
+                        return
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                if started or attempt == self.max_retries:
+                    raise
+                LLM_RETRIES.labels(type(e).__name__).inc()
+                print(f"OpenRouter stream failed: {e!r}, retrying (attempt {attempt + 1})")  # Debug log
+
+            await asyncio.sleep(self._backoff(attempt, retry_after))
+
+    def reset(self):
+        """Forget the connection pool without closing it (its sockets belong to the parent process)"""
+        self._client = None
+
+    async def aclose(self):
+        """Close pooled connections"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
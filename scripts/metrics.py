@@ -0,0 +1,235 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Sequence, Tuple
+
+# Seconds; covers sub-millisecond local stages up to slow LLM calls
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Tuple[str, str] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Base of the metric families: one child per label value combination.
+
+    Children are created once under the family lock; updates only take the
+    child's own lock, so concurrent stages recording different labels never
+    contend and the cost per observation is a dict lookup plus an uncontended
+    lock.
+    """
+
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _samples(self, values, child) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._samples(values, child))
+        return lines
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+    @contextmanager
+    def track(self):
+        """Count the enclosed block as in progress"""
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def _samples(self, values, child):
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"]
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+
+class _HistogramValue:
+    def __init__(self, buckets: List[float]):
+        self.buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)  # Last slot counts values above every bucket
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[slot] += 1
+            self._sum += value
+            self._count += 1
+
+    @contextmanager
+    def time(self):
+        """Observe the duration of the enclosed block in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def cumulative(self) -> Tuple[List[Tuple[float, int]], float, int]:
+        with self._lock:
+            counts, total_sum, count = list(self._counts), self._sum, self._count
+        cumulative, total = [], 0
+        for bound, bucket_count in zip(self.buckets + [float('inf')], counts):
+            total += bucket_count
+            cumulative.append((bound, total))
+        return cumulative, total_sum, count
+
+    def snapshot(self) -> Dict[str, object]:
+        """Cumulative bucket counts keyed by upper bound, plus sum, count and mean"""
+        cumulative, total_sum, count = self.cumulative()
+        return {
+            "buckets": {_format_value(bound) if bound == float('inf') else f"{bound:g}": n for bound, n in cumulative},
+            "sum": total_sum,
+            "count": count,
+            "mean": total_sum / count if count else 0.0
+        }
+
+
+class Histogram(_Metric):
+    """Histogram with fixed, cumulative (Prometheus-style) buckets"""
+
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, buckets: List[float] = None, labelnames: Sequence[str] = (),
+                 registry=None):
+        self.buckets = sorted(buckets or LATENCY_BUCKETS)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def snapshot(self):
+        return self.labels().snapshot()
+
+    def _samples(self, values, child):
+        cumulative, total_sum, count = child.cumulative()
+        lines = [
+            f"{self.name}_bucket{_format_labels(self.labelnames, values, ('le', _format_value(bound) if bound == float('inf') else f'{bound:g}'))} {n}"
+            for bound, n in cumulative
+        ]
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total_sum)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Query pipeline metrics
+STAGE_SECONDS = Histogram('support_stage_seconds', 'Latency of each query pipeline stage in seconds.',
+                          labelnames=['stage'])
+REQUESTS = Counter('support_requests_total', 'Query requests by endpoint and outcome.', ['endpoint', 'status'])
+IN_FLIGHT = Gauge('support_requests_in_flight', 'Query requests currently being processed.', ['endpoint'])
+CACHE_LOOKUPS = Counter('support_cache_lookups_total', 'Cache lookups by cache and result.', ['cache', 'result'])
+COALESCED_REQUESTS = Counter('support_coalesced_requests_total',
+                             'Queries that shared an identical in-flight execution.')
+FALLBACKS = Counter('support_fallbacks_total', 'Queries that took a fallback path.', ['path'])
+LLM_ERRORS = Counter('support_llm_errors_total', 'Failed LLM calls by call site.', ['call'])
+LLM_RETRIES = Counter('support_llm_retries_total', 'Retried OpenRouter requests by reason.', ['reason'])
+LLM_TOKENS = Counter('support_llm_tokens_total', 'Tokens reported by OpenRouter usage.', ['model', 'type'])
+LLM_ACTIVE = Gauge('support_llm_active', 'Generation calls holding an LLM slot.')
+LLM_QUEUE_DEPTH = Gauge('support_llm_queue_depth', 'Generation requests waiting for an LLM slot.', ['priority'])
+LLM_QUEUE_WAIT = Histogram('support_llm_queue_wait_seconds', 'Time generation requests waited for an LLM slot.',
+                           labelnames=['priority'])
+LLM_SHED = Counter('support_llm_shed_total', 'Generation requests rejected by admission control.',
+                   ['priority', 'reason'])
+TRACES = Counter('support_traces_total', 'Request traces handed to the trace writer, by result.', ['result'])
+PROMPT_TOKENS = Histogram('support_prompt_tokens', 'Prompt tokens per generation request, counted locally.',
+                          [128, 256, 512, 768, 1024, 1536, 2048, 3072, 4096, 8192])
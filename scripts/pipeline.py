@@ -0,0 +1,587 @@
+import asyncio
+import contextvars
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from textwrap import dedent
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from scripts.classification import DEFAULT_SENTIMENT, INTENTS
+from scripts.embedding_cache import normalize_query
+from scripts.metrics import FALLBACKS, LLM_ERRORS
+from scripts.tracing import annotate, capture, record_error, record_stage, span, stage
+from scripts.scheduler import LLMScheduler, Overloaded, request_priority
+from scripts.single_flight import SingleFlight
+
+
+class QueryPipeline:
+    """Runs the intent, sentiment, retrieval and generation stages for a query.
+
+    The classification and retrieval stages are blocking (Crew kickoffs,
+    embedding, ChromaDB), so they run on a bounded thread pool instead of the
+    event loop; generation is native async. Intent, sentiment and retrieval
+    start together and generation starts as soon as retrieval is done, so a
+    request costs roughly its slowest branch instead of the sum of all stages.
+    """
+
+    def __init__(self, rag, agents, intent_classifier=None, sentiment_scorer=None, answer_cache=None,
+                 max_workers: int = None, llm_classifier=None, faq_index=None):
+        self.rag = rag
+        self.agents = agents
+
+        # Combined mode: whatever the local models cannot answer is classified
+        # by one structured LLM call instead of the intent and sentiment agents
+        self.llm_classifier = llm_classifier
+
+        # Local classifier answers most queries; the intent agent is only
+        # consulted when its confidence is below the threshold
+        self.intent_classifier = intent_classifier
+        self.intent_threshold = float(os.getenv('INTENT_CONFIDENCE_THRESHOLD', '0.6'))
+
+        # Local sentiment scorer; without one the sentiment agent is used
+        self.sentiment_scorer = sentiment_scorer
+
+        # Semantic answer cache short-circuits retrieval and generation for
+        # near-duplicate queries
+        self.answer_cache = answer_cache
+
+        # Curated FAQ answers returned without retrieval or generation
+        self.faq_index = faq_index
+
+        # Identical queries arriving together (e.g. during an outage) share one
+        # execution instead of each running the full pipeline
+        self.single_flight = SingleFlight() if os.getenv('REQUEST_COALESCING', 'on') == 'on' else None
+
+        # Bounds in-flight generation calls and orders waiting ones by intent and urgency
+        self.scheduler = LLMScheduler()
+
+        # Bound the number of blocking calls in flight across all requests
+        self.max_workers = max_workers or int(os.getenv('PIPELINE_MAX_WORKERS', '16'))
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='pipeline')
+
+        # Items of a batch request that may be generating at the same time
+        self.batch_concurrency = int(os.getenv('BATCH_MAX_CONCURRENCY', '8'))
+
+    async def _run_blocking(self, fn, *args):
+        """Run a blocking callable on the pipeline executor, in the caller's trace context"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, contextvars.copy_context().run, fn, *args)
+
+    def classify_intent(self, text: str, query_embedding=None) -> str:
+        """Classify the query intent, locally when confident enough"""
+        with stage('intent'):
+            return self._classify_intent(text, query_embedding)
+
+    def _classify_intent(self, text: str, query_embedding=None) -> str:
+        if self.intent_classifier is not None:
+            if query_embedding is None:
+                query_embedding = self.rag.embed_query(text)
+            intent, confidence = self.intent_classifier.predict_embeddings(query_embedding)[0]
+            annotate(intent=intent, confidence=round(float(confidence), 3))
+            if confidence >= self.intent_threshold:
+                return intent
+            annotate(fallback='intent_agent')
+            FALLBACKS.labels('intent_agent').inc()
+        return self.classify_intent_llm(text)
+
+    def classify_intent_llm(self, text: str) -> str:
+        """Classify the query intent using the intent agent"""
+        from crewai import Task, Crew
+
+        intent_task = Task(
+            description=dedent(f"""
+                Classify this query: {text}
+                Options: faq, complaint, troubleshooting
+            """),
+            expected_output="The category of the query: either 'faq', 'complaint', or 'troubleshooting'",
+            agent=self.agents.intent_agent
+        )
+
+        intent_crew = Crew(
+            agents=[self.agents.intent_agent],
+            tasks=[intent_task]
+        )
+
+        try:
+            intent = str(intent_crew.kickoff())
+        except Exception:
+            LLM_ERRORS.labels('intent_agent').inc()
+            raise
+        annotate(intent=intent)
+        return intent
+
+    def analyze_sentiment(self, text: str) -> Dict[str, Any]:
+        """Analyze emotion, urgency and satisfaction"""
+        with stage('sentiment'):
+            if self.sentiment_scorer is not None:
+                return self.sentiment_scorer.score(text)
+            return self.analyze_sentiment_llm(text)
+
+    def analyze_sentiment_llm(self, text: str) -> Dict[str, Any]:
+        """Analyze emotion, urgency and satisfaction using the sentiment agent"""
+        from crewai import Task, Crew
+
+        sentiment_task = Task(
+            description=dedent(f"""
+                Analyze the sentiment of this query: {text}
+
+                Return a single word for each category:
+                1. Emotion: frustrated, confused, neutral, or positive
+                2. Urgency: low, medium, or high
+                3. Satisfaction: a number from 1 to 10
+
+                Format your response exactly like this:
+                Emotion: [word]
+                Urgency: [word]
+                Satisfaction: [number]
+            """),
+            expected_output="Three lines with emotion, urgency, and satisfaction values",
+            agent=self.agents.sentiment_agent
+        )
+
+        sentiment_crew = Crew(
+            agents=[self.agents.sentiment_agent],
+            tasks=[sentiment_task]
+        )
+
+        try:
+            sentiment_result = str(sentiment_crew.kickoff())
+        except Exception:
+            LLM_ERRORS.labels('sentiment_agent').inc()
+            raise
+        capture(raw_sentiment=sentiment_result)
+        return parse_sentiment(sentiment_result)
+
+    async def classify(self, text: str, query_embedding) -> Tuple[str, Dict[str, Any]]:
+        """Intent and sentiment in combined mode, using the local models where possible"""
+        with stage('classify'):
+            local_intent = None
+            if self.intent_classifier is not None:
+                local_intent = (await self._run_blocking(self.intent_classifier.predict_embeddings, query_embedding))[0]
+            local_sentiment = None
+            if self.sentiment_scorer is not None:
+                local_sentiment = await self._run_blocking(self.analyze_sentiment, text)
+            return await self.classify_combined(text, local_intent, local_sentiment)
+
+    async def classify_combined(self, text: str, local_intent: Tuple[str, float] = None,
+                                local_sentiment: Dict[str, Any] = None) -> Tuple[str, Dict[str, Any]]:
+        """Fill in what the local models could not answer with at most one LLM call.
+
+        `local_intent` is the local classifier's (label, confidence) and
+        `local_sentiment` the local scorer's result. If the call fails, the
+        low-confidence local intent (or 'faq') and neutral sentiment are used.
+        """
+        confident = local_intent is not None and local_intent[1] >= self.intent_threshold
+        if local_intent is not None:
+            annotate(intent=local_intent[0], confidence=round(float(local_intent[1]), 3))
+        if confident and local_sentiment is not None:
+            return local_intent[0], local_sentiment
+        if local_intent is not None and not confident:
+            annotate(fallback='intent_llm')
+            FALLBACKS.labels('intent_llm').inc()
+
+        try:
+            intent, sentiment = await self.llm_classifier.classify(text)
+        except Exception as e:
+            LLM_ERRORS.labels('classification').inc()
+            annotate(classification_error=str(e))
+            intent = local_intent[0] if local_intent is not None else INTENTS[0]
+            sentiment = dict(DEFAULT_SENTIMENT)
+        return (local_intent[0] if confident else intent), (local_sentiment if local_sentiment is not None else sentiment)
+
+    async def _classify(self, text: str, query_embedding, sentiment_task=None,
+                        intent: str = None) -> Tuple[str, Dict[str, Any]]:
+        """(intent, sentiment) from the combined classifier, or from the separate stages.
+
+        A known `intent` (from a curated FAQ match) skips intent classification.
+        """
+        if sentiment_task is None:
+            if intent is None:
+                return await self.classify(text, query_embedding)
+            local_sentiment = None
+            if self.sentiment_scorer is not None:
+                local_sentiment = await self._run_blocking(self.analyze_sentiment, text)
+            return await self.classify_combined(text, (intent, 1.0), local_sentiment)
+        if intent is None:
+            intent = await self._run_blocking(self.classify_intent, text, query_embedding)
+        return intent, await sentiment_task
+
+    def _faq_answer(self, query_embedding, use_cache: bool):
+        """The curated FAQ entry matching a query, if any (skipped when the cache is bypassed)"""
+        if self.faq_index is None or not use_cache:
+            return None
+        with span('faq_match') as current:
+            match = self.faq_index.match(query_embedding)
+            if current is not None and match is not None:
+                current.attributes.update(query=match[0].query, similarity=round(match[1], 3))
+        return match[0] if match is not None else None
+
+    def _priority(self, classification: asyncio.Future):
+        """Coroutine function giving the scheduling priority of a (possibly pending) classification"""
+        async def priority() -> int:
+            # Shielded: giving up on the priority must not cancel the classification itself
+            intent, sentiment = await asyncio.shield(classification)
+            return request_priority(intent, sentiment)
+        return priority
+
+    async def _generate(self, text: str, context: list, usage: dict, classification: asyncio.Future) -> str:
+        """Generate a response once the scheduler grants an LLM slot (raises Overloaded if shed)"""
+        async with self.scheduler.slot(self._priority(classification)):
+            return await self.rag.generate_response(text, context, usage)
+
+    def _cached_answer(self, query_embedding, use_cache: bool, retrieval_mode: str) -> Optional[Dict[str, Any]]:
+        """Look up a cached answer for a near-duplicate query retrieved the same way"""
+        if self.answer_cache is None or not use_cache:
+            return None
+        with span('answer_cache') as current:
+            cached = self.answer_cache.lookup(query_embedding, self.rag.index_version(),
+                                              retrieval_mode or self.rag.RETRIEVAL_MODE)
+            if current is not None:
+                current.attributes['hit'] = cached is not None
+                if cached is not None:
+                    current.attributes['distance'] = round(float(cached['distance']), 3)
+        return cached
+
+    def _store_answer(self, query_embedding, context: list, response: str, use_cache: bool, retrieval_mode: str):
+        """Cache a generated answer together with its sources"""
+        # generate_response reports failures as "Error ..." strings, which must not be cached
+        if self.answer_cache is None or not use_cache or not response or response.startswith("Error"):
+            return
+        self.answer_cache.store(query_embedding, {"sources": context, "response": response},
+                                self.rag.index_version(), retrieval_mode or self.rag.RETRIEVAL_MODE)
+
+    async def run(self, text: str, use_cache: bool = True, retrieval_mode: str = None) -> Dict[str, Any]:
+        """Process a query, running independent stages concurrently.
+
+        Concurrent calls with the same normalized text and retrieval mode are
+        coalesced into one execution; their results have `coalesced` set.
+        Bypassing the cache also bypasses coalescing.
+        """
+        with stage('total'):
+            if self.single_flight is None or not use_cache:
+                return await self._run(text, use_cache, retrieval_mode)
+            result, shared = await self.single_flight.do(
+                (normalize_query(text), retrieval_mode),
+                lambda: self._run(text, use_cache, retrieval_mode)
+            )
+            result["coalesced"] = shared
+            annotate(coalesced=shared)
+            return result
+
+    async def _run(self, text: str, use_cache: bool, retrieval_mode: str) -> Dict[str, Any]:
+        # Separate mode scores sentiment without waiting for the embedding
+        sentiment_task = None
+        if self.llm_classifier is None:
+            sentiment_task = asyncio.ensure_future(self._run_blocking(self.analyze_sentiment, text))
+        classify_task = None
+
+        try:
+            # Embed the query once and share it between classification and retrieval
+            query_embedding = await self._run_blocking(self.rag.embed_query, text)
+            faq = self._faq_answer(query_embedding, use_cache)
+            classify_task = asyncio.ensure_future(
+                self._classify(text, query_embedding, sentiment_task, faq.intent if faq is not None else None)
+            )
+
+            cached = None if faq is not None else self._cached_answer(query_embedding, use_cache, retrieval_mode)
+            usage = {}
+            if faq is not None:
+                response = faq.response
+            elif cached is not None:
+                response = cached["response"]
+            else:
+                # Retrieval overlaps classification; generation starts once retrieval is
+                # done and only waits for classification (its priority) when it has to queue
+                context = await self._run_blocking(self.rag.retrieve_documents, text, 3, query_embedding,
+                                                   retrieval_mode)
+                response = await self._generate(text, context, usage, classify_task)
+                self._store_answer(query_embedding, context, response, use_cache, retrieval_mode)
+            intent, sentiment_analysis = await classify_task
+        except BaseException:
+            for task in (classify_task, sentiment_task):
+                if task is not None:
+                    task.cancel()
+            raise
+
+        # Ensure response is a string
+        if isinstance(response, dict):
+            response = response.get('response', str(response))
+        else:
+            response = str(response)
+
+        return {
+            "intent": str(intent),  # Ensure intent is a string
+            "sentiment": sentiment_analysis,
+            "response": response,
+            "cached": cached is not None,
+            "fast_path": faq is not None,
+            "coalesced": False,
+            "prompt_tokens": usage.get("prompt_tokens"),
+            "status": "success"
+        }
+
+    async def stream(self, text: str, use_cache: bool = True,
+                     retrieval_mode: str = None) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """Process a query, yielding (event, data) pairs as results become known.
+
+        Emits `sources` once retrieval finishes, `intent` and `sentiment` when
+        classification finishes, `token` for every generated delta, `usage`
+        (prompt token counts) after generation and a final `done`. Closing
+        the generator cancels any stage still running, including the upstream
+        LLM stream.
+        """
+        events = asyncio.Queue()
+        query_embedding = asyncio.ensure_future(self._run_blocking(self.rag.embed_query, text))
+
+        async def match_faq():
+            return self._faq_answer(await query_embedding, use_cache)
+
+        faq_match = asyncio.ensure_future(match_faq())
+
+        async def get_intent():
+            faq = await faq_match
+            if faq is not None:
+                return faq.intent
+            return await self._run_blocking(self.classify_intent, text, await query_embedding)
+
+        async def get_classification():
+            if self.llm_classifier is not None:
+                faq = await faq_match
+                return await self._classify(text, await query_embedding, intent=faq.intent if faq is not None else None)
+            return await intent_result, await sentiment_result
+
+        intent_result = sentiment_result = None
+        if self.llm_classifier is None:
+            intent_result = asyncio.ensure_future(get_intent())
+            sentiment_result = asyncio.ensure_future(self._run_blocking(self.analyze_sentiment, text))
+        # (intent, sentiment), shared by the classification events and generation scheduling
+        classification = asyncio.ensure_future(get_classification())
+        # Answered from the FAQ index or the cache, nothing may await it; mark failures as seen
+        classification.add_done_callback(lambda future: future.cancelled() or future.exception())
+
+        async def classify():
+            events.put_nowait(("intent", {"intent": str(await intent_result)}))
+
+        async def sentiment():
+            events.put_nowait(("sentiment", await sentiment_result))
+
+        async def classify_combined():
+            intent, sentiment_analysis = await classification
+            events.put_nowait(("intent", {"intent": str(intent)}))
+            events.put_nowait(("sentiment", sentiment_analysis))
+
+        async def answer():
+            embedding = await query_embedding
+            faq = await faq_match
+            if faq is not None:
+                events.put_nowait(("sources", {"sources": [faq.source], "cached": False, "fast_path": True}))
+                events.put_nowait(("token", {"text": faq.response}))
+                return
+            cached = self._cached_answer(embedding, use_cache, retrieval_mode)
+            if cached is not None:
+                events.put_nowait(("sources", {"sources": [doc['source'] for doc in cached["sources"]],
+                                               "cached": True, "fast_path": False}))
+                events.put_nowait(("token", {"text": cached["response"]}))
+                return
+
+            context = await self._run_blocking(self.rag.retrieve_documents, text, 3, embedding, retrieval_mode)
+            events.put_nowait(("sources", {"sources": [doc['source'] for doc in context], "cached": False,
+                                           "fast_path": False}))
+            tokens = []
+            usage = {}
+            async with self.scheduler.slot(self._priority(classification)):
+                try:
+                    with stage('generate'):
+                        async for token in self.rag.stream_response(text, context, usage):
+                            tokens.append(token)
+                            events.put_nowait(("token", {"text": token}))
+                except Exception:
+                    LLM_ERRORS.labels('stream').inc()
+                    raise
+            if usage:
+                events.put_nowait(("usage", usage))
+            capture(response="".join(tokens))
+            self._store_answer(embedding, context, "".join(tokens), use_cache, retrieval_mode)
+
+        async def produce(stage_name, coro_fn):
+            try:
+                await coro_fn()
+            except Exception as e:
+                print(f"Error in {stage_name} stage: {str(e)}")  # Debug log
+                record_error(stage_name, e)
+                error = {"stage": stage_name, "detail": str(e)}
+                if isinstance(e, Overloaded):
+                    error.update(status_code=e.status_code, retry_after=e.retry_after)
+                events.put_nowait(("error", error))
+            finally:
+                # Sentinel marking this producer as finished
+                events.put_nowait(None)
+
+        started = time.perf_counter()
+        if self.llm_classifier is not None:
+            stages = [("classification", classify_combined)]
+        else:
+            stages = [("intent", classify), ("sentiment", sentiment)]
+        tasks = [asyncio.ensure_future(produce(stage_name, coro_fn))
+                 for stage_name, coro_fn in stages + [("response", answer)]]
+        try:
+            remaining = len(tasks)
+            failed = False
+            while remaining:
+                event = await events.get()
+                if event is None:
+                    remaining -= 1
+                    continue
+                failed = failed or event[0] == "error"
+                yield event
+            record_stage('total', started)
+            yield ("done", {"status": "error" if failed else "success"})
+        finally:
+            for future in (query_embedding, faq_match, intent_result, sentiment_result, classification):
+                if future is not None:
+                    future.cancel()
+            for task in tasks:
+                task.cancel()
+
+    async def run_batch(self, texts: List[str], use_cache: bool = True,
+                        retrieval_mode: str = None) -> List[Dict[str, Any]]:
+        """Process many queries at once.
+
+        All queries are embedded in one batched encode and retrieved with one
+        multi-embedding ChromaDB query; local intent and sentiment are scored
+        as batches. Generation (and any LLM classification) runs with at most
+        `batch_concurrency` items in flight. Results are returned in input
+        order, and a failing item gets `{"status": "error", "detail": ...}`
+        without failing the rest of the batch.
+        """
+        if not texts:
+            return []
+        with stage('batch_total'):
+            return await self._run_batch(texts, use_cache, retrieval_mode)
+
+    async def _run_batch(self, texts: List[str], use_cache: bool, retrieval_mode: str) -> List[Dict[str, Any]]:
+        embeddings = await self._run_blocking(self.rag.embed_queries, texts)
+        local_intents = None
+        if self.intent_classifier is not None:
+            local_intents = await self._run_blocking(self.intent_classifier.predict_embeddings, embeddings)
+        sentiments = None
+        if self.sentiment_scorer is not None:
+            sentiments = await self._run_blocking(self.sentiment_scorer.score_batch, texts)
+
+        # Curated FAQ answers first, then cached answers
+        faqs = [None] * len(texts)
+        if self.faq_index is not None and use_cache:
+            faqs = [match[0] if match is not None else None for match in self.faq_index.match_embeddings(embeddings)]
+        cached = [None if faq is not None else self._cached_answer(embedding, use_cache, retrieval_mode)
+                  for faq, embedding in zip(faqs, embeddings)]
+
+        # Retrieve context for every remaining query in one call
+        misses = [i for i, answer in enumerate(cached) if answer is None and faqs[i] is None]
+        contexts, retrieval_error = {}, None
+        if misses:
+            try:
+                batch_contexts = await self._run_blocking(
+                    self.rag.retrieve_documents_batch, [texts[i] for i in misses], 3, embeddings[misses], retrieval_mode
+                )
+                contexts = dict(zip(misses, batch_contexts))
+            except Exception as e:
+                print(f"Error in batch retrieval: {str(e)}")  # Debug log
+                record_error('retrieval', e)
+                retrieval_error = str(e)
+
+        semaphore = asyncio.Semaphore(self.batch_concurrency)
+        usages = [{} for _ in texts]
+
+        async def intent(i):
+            if faqs[i] is not None:
+                return faqs[i].intent
+            if local_intents is not None:
+                label, confidence = local_intents[i]
+                if confidence >= self.intent_threshold:
+                    return label
+                FALLBACKS.labels('intent_agent').inc()
+            return await self._run_blocking(self.classify_intent_llm, texts[i])
+
+        async def sentiment(i):
+            if sentiments is not None:
+                return sentiments[i]
+            return await self._run_blocking(self.analyze_sentiment_llm, texts[i])
+
+        async def classify(i):
+            if self.llm_classifier is not None:
+                if faqs[i] is not None:
+                    local_intent = (faqs[i].intent, 1.0)
+                else:
+                    local_intent = local_intents[i] if local_intents is not None else None
+                return await self.classify_combined(texts[i], local_intent,
+                                                    sentiments[i] if sentiments is not None else None)
+            return await asyncio.gather(intent(i), sentiment(i))
+
+        async def answer(i, classification):
+            if faqs[i] is not None:
+                return faqs[i].response
+            if cached[i] is not None:
+                return cached[i]["response"]
+            if retrieval_error is not None:
+                raise RuntimeError(f"Retrieval failed: {retrieval_error}")
+            response = await self._generate(texts[i], contexts[i], usages[i], classification)
+            self._store_answer(embeddings[i], contexts[i], response, use_cache, retrieval_mode)
+            return response
+
+        async def process(i):
+            async with semaphore:
+                try:
+                    classification = asyncio.ensure_future(classify(i))
+                    response = await answer(i, classification)
+                    intent_result, sentiment_analysis = await classification
+                except Exception as e:
+                    print(f"Error in batch item {i}: {str(e)}")  # Debug log
+                    record_error(f'item {i}', e)
+                    return {"status": "error", "detail": str(e)}
+            return {
+                "intent": str(intent_result),
+                "sentiment": sentiment_analysis,
+                "response": str(response),
+                "cached": cached[i] is not None,
+                "fast_path": faqs[i] is not None,
+                "prompt_tokens": usages[i].get("prompt_tokens"),
+                "status": "success"
+            }
+
+        return list(await asyncio.gather(*(process(i) for i in range(len(texts)))))
+
+    def shutdown(self):
+        """Release the executor threads"""
+        self.executor.shutdown(wait=False)
+
+    def after_fork(self):
+        """Replace the executor inherited from the parent process, whose threads did not survive fork"""
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='pipeline')
+
+
+def parse_sentiment(sentiment_result: str) -> Dict[str, Any]:
+    """Parse the Emotion/Urgency/Satisfaction lines returned by the sentiment agent"""
+    sentiment_analysis = {
+        "emotion": "neutral",
+        "urgency": "medium",
+        "satisfaction": 5
+    }
+
+    try:
+        # Extract values using regex
+        emotion_match = re.search(r'Emotion:\s*(\w+)', sentiment_result)
+        urgency_match = re.search(r'Urgency:\s*(\w+)', sentiment_result)
+        satisfaction_match = re.search(r'Satisfaction:\s*(\d+)', sentiment_result)
+
+        if emotion_match:
+            sentiment_analysis["emotion"] = emotion_match.group(1).lower()
+        if urgency_match:
+            sentiment_analysis["urgency"] = urgency_match.group(1).lower()
+        if satisfaction_match:
+            satisfaction = int(satisfaction_match.group(1))
+            sentiment_analysis["satisfaction"] = max(1, min(10, satisfaction))  # Clamp between 1-10
+    except Exception as e:
+        print(f"Error parsing sentiment: {e}")  # Debug log
+
+    return sentiment_analysis
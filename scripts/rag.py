@@ -1,9 +1,25 @@
-import chromadb
-import os
+import asyncio
 import json
-import requests
+import os
+import threading
+import time
+from contextlib import contextmanager
 from dotenv import load_dotenv
-from sentence_transformers import SentenceTransformer
+from scripts.llm_client import OpenRouterClient
+from scripts.embedding_cache import EmbeddingCache
+from scripts.embedder import EMBEDDING_MODEL_NAME, embedder_id, load_embedder
+from scripts.embedding_service import EmbeddingService
+from scripts.lexical_index import BM25Index, reciprocal_rank_fusion
+from scripts.vector_store import VectorStoreLease, open_vector_store
+from scripts.context_builder import ContextBuilder, count_message_tokens, get_encoder
+from scripts.metrics import FALLBACKS, LLM_ERRORS, PROMPT_TOKENS
+from scripts.tracing import record_stage, stage
+
+# Project root (one level up from scripts)
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Marks the BM25 index as not loaded yet (index_version() may itself be None)
+_NOT_LOADED = object()
 
 class RAGPipeline:  
     def __init__(self):
@@ -11,78 +27,313 @@ class RAGPipeline:
         load_dotenv()
 
         # Configuration
-        # Use relative path for portability
-        self.DB_PATH = os.path.join('..', 'chroma_db') # Changed from absolute path
+        # Use relative path for portability (same location generate_embeddings.py writes to)
+        self.DB_PATH = os.path.join(PROJECT_ROOT, 'chroma_db')
+        self.INDEX_VERSION_PATH = os.path.join(self.DB_PATH, 'index_version')
+        self.LEXICAL_INDEX_PATH = os.path.join(self.DB_PATH, 'bm25_index.npz')
+        self.MANIFEST_PATH = os.path.join(self.DB_PATH, 'ingest_manifest.json')
         self.OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY')
-        self.OPENROUTER_URL = 'https://openrouter.ai/api/v1/chat/completions'
+        self.OPENROUTER_MODEL = os.getenv('OPENROUTER_MODEL', 'openai/gpt-4o-mini')
+
+        # Pooled async client for generation (base URL is configurable via OPENROUTER_BASE_URL)
+        self.llm = OpenRouterClient(self.OPENROUTER_API_KEY)
+        self.OPENROUTER_URL = self.llm.chat_url
+
+        # Packs retrieved passages into the prompt within CONTEXT_TOKEN_BUDGET tokens
+        self.context_builder = ContextBuilder(self.OPENROUTER_MODEL)
 
-        # Initialize ChromaDB client
-        self.client = chromadb.PersistentClient(path=self.DB_PATH)
-        self.collection = self.client.get_collection("customer_support_docs")
+        # Vector store: 'chroma' (HNSW) or 'numpy' (exact search over a memory-mapped
+        # matrix exported next to the collection by generate_embeddings.py)
+        self.VECTOR_BACKEND = os.getenv('VECTOR_BACKEND', 'chroma')
+        self._vector_store_version = self.index_version()
+        self._vector_lease = VectorStoreLease(open_vector_store(self.VECTOR_BACKEND, self.DB_PATH))
+        self._vector_lock = threading.Lock()
 
-        # Initialize embedding model
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+        # Initialize embedding model (PyTorch or ONNX Runtime, see EMBEDDING_BACKEND)
+        self.MODEL_NAME = EMBEDDING_MODEL_NAME
+        self.model = load_embedder()
+        self.check_index_embedder()
 
-    def retrieve_documents(self, query: str, n_results: int = 3) -> list:
-        """Retrieve relevant context from ChromaDB"""
+        # Concurrent cache misses are micro-batched into shared encode calls
+        self.embedding_service = None
+        if os.getenv('EMBEDDING_BATCHING', 'on') == 'on':
+            self.embedding_service = EmbeddingService(self.model)
+
+        # Query embedding cache shared by every component that embeds the query
+        self.embedding_cache = EmbeddingCache(self.model, embedder_id(self.model), service=self.embedding_service)
+
+        # Retrieval mode: 'vector', 'lexical' (BM25) or 'hybrid' (reciprocal-rank fusion of both)
+        self.RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'vector')
+        self.HYBRID_VECTOR_WEIGHT = float(os.getenv('HYBRID_VECTOR_WEIGHT', '1.0'))
+        self.HYBRID_LEXICAL_WEIGHT = float(os.getenv('HYBRID_LEXICAL_WEIGHT', '1.0'))
+        self.RRF_K = int(os.getenv('RRF_K', '60'))
+        self.HYBRID_CANDIDATES = int(os.getenv('HYBRID_CANDIDATES', '20'))
+
+        # BM25 index built next to the collection by generate_embeddings.py
+        self._lexical_index = None
+        self._lexical_index_version = _NOT_LOADED
+        self._lexical_lock = threading.Lock()
+
+    def index_version(self):
+        """Version of the knowledge base index, bumped by generate_embeddings.py on every re-index"""
         try:
-            # Generate query embedding
-            query_embedding = self.model.encode(query).tolist()
-            
-            # Query ChromaDB
-            results = self.collection.query(
-                query_embeddings=[query_embedding],
-                n_results=n_results
-            )
-            
-            # Format results
-            context = []
-            for doc, meta in zip(results['documents'][0], results['metadatas'][0]):
-                context.append({
-                    'source': meta['source'],
-                    'content': doc
-                })
-            return context
+            return os.stat(self.INDEX_VERSION_PATH).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def indexed_embedder(self):
+        """embedder_id the knowledge base was embedded with, as recorded by generate_embeddings.py (None if unknown)"""
+        with self.vector_index() as store:
+            embedder = store.embedder()
+        if embedder is not None:
+            return embedder
+        try:
+            with open(self.MANIFEST_PATH, 'r', encoding='utf-8') as f:
+                # Manifests written before the embedder was recorded were embedded with PyTorch
+                return json.load(f).get("embedder", f"{EMBEDDING_MODEL_NAME}/torch")
+        except (OSError, ValueError):
+            return None
+
+    def check_index_embedder(self):
+        """Warn when queries would be embedded by another backend than the indexed chunks"""
+        indexed, current = self.indexed_embedder(), embedder_id(self.model)
+        if indexed is not None and indexed != current:
+            print(f"Warning: the knowledge base was embedded with {indexed} but EMBEDDING_BACKEND gives {current}; "
+                  "similarities will drift until generate_embeddings.py re-indexes it")  # Debug log
+
+    def embed_query(self, query: str):
+        """Embed a query through the shared embedding cache"""
+        with stage('embed'):
+            return self.embedding_cache.encode(query)
+
+    def warmup(self):
+        """Run dummy encodes and pre-touch the indexes so the first real requests are not slow"""
+        # Straight to the model: cached or micro-batched calls would not exercise it
+        for batch in (["warmup query"], ["warmup query"] * 8):
+            self.model.encode(batch, normalize_embeddings=True, convert_to_numpy=True)
+        with self.vector_index() as store:
+            store.warmup()
+        self.lexical_index()
+        # Loads (or downloads) the tiktoken encoding here rather than in the first request
+        get_encoder(self.OPENROUTER_MODEL)
+
+    @contextmanager
+    def vector_index(self):
+        """The vector store, reopened whenever the knowledge base index version changes.
+
+        The NumPy store reloads itself when its files change; a Chroma client
+        keeps the HNSW index it loaded in memory, so it is reopened to see
+        chunks added or removed by a re-index. The replacement is opened before
+        it is swapped in, and the old store is closed once the searches still
+        using it have finished.
+        """
+        if self.VECTOR_BACKEND == 'chroma':
+            self._reopen_vector_store()
+        lease = self._vector_lease
+        # A lease retired between reading and acquiring it has already been replaced
+        while not lease.acquire():
+            lease = self._vector_lease
+        try:
+            yield lease.store
+        finally:
+            lease.release()
+
+    def _reopen_vector_store(self):
+        """Swap in a new Chroma store if the index version changed since the current one was opened"""
+        version = self.index_version()
+        if self._vector_store_version != version:
+            with self._vector_lock:
+                if self._vector_store_version != version:
+                    old = self._vector_lease
+                    old.store.detach()
+                    self._vector_lease = VectorStoreLease(open_vector_store(self.VECTOR_BACKEND, self.DB_PATH))
+                    self._vector_store_version = version
+                    old.retire()
+                    print("Reopened vector store after re-index")  # Debug log
+
+    def lexical_index(self):
+        """The BM25 index, (re)loaded whenever the knowledge base index version changes"""
+        version = self.index_version()
+        if self._lexical_index_version != version:
+            with self._lexical_lock:
+                if self._lexical_index_version != version:
+                    try:
+                        self._lexical_index = BM25Index.load(self.LEXICAL_INDEX_PATH)
+                    except FileNotFoundError:
+                        print(f"No BM25 index at {self.LEXICAL_INDEX_PATH}, run generate_embeddings.py")
+                        self._lexical_index = None
+                    self._lexical_index_version = version
+        return self._lexical_index
+
+    def embed_queries(self, queries: list):
+        """Embed many queries with a single batched encode (cache misses only)"""
+        with stage('embed'):
+            return self.embedding_cache.encode_batch(queries)
+
+    def _vector_search_batch(self, queries: list, n_results: int, query_embeddings=None) -> list:
+        """Dense search for many queries in one call.
+
+        Returns one {chunk id: (document, metadata)} dict per query, in rank order.
+        """
+        # Generate query embeddings unless the caller already has them
+        if query_embeddings is None:
+            query_embeddings = self.embed_queries(queries)
+        with stage('vector_search'):
+            with self.vector_index() as store:
+                return store.search(query_embeddings, n_results)
+
+    def _get_chunks(self, ids: list) -> dict:
+        """Fetch documents and metadata for chunk ids from the vector store"""
+        with self.vector_index() as store:
+            return store.get(ids)
+
+    def retrieve_documents_batch(self, queries: list, n_results: int = 3, query_embeddings=None,
+                                 mode: str = None) -> list:
+        """Retrieve context for many queries using vector, lexical or hybrid search.
+
+        All queries share one batched encode and one multi-embedding vector
+        store query. Returns one context list per query, in input order;
+        vector store errors are raised to the caller.
+        """
+        if not queries:
+            return []
+        mode = mode or self.RETRIEVAL_MODE
+        lexical_index = self.lexical_index() if mode in ('lexical', 'hybrid') else None
+        if lexical_index is None:
+            # Pure dense search (also the fallback when no BM25 index exists)
+            if mode != 'vector':
+                FALLBACKS.labels('no_lexical_index').inc()
+            mode = 'vector'
+        n_candidates = n_results if mode == 'vector' else max(n_results, self.HYBRID_CANDIDATES)
+
+        vector_hits = [{} for _ in queries]
+        if mode != 'lexical':
+            vector_hits = self._vector_search_batch(queries, n_candidates, query_embeddings)
+
+        rankings = []
+        lexical_start = time.perf_counter()
+        for query, hits in zip(queries, vector_hits):
+            if mode == 'vector':
+                ids = list(hits)[:n_results]
+            elif mode == 'lexical':
+                ids = [chunk_id for chunk_id, _ in lexical_index.search(query, n_results)]
+            else:
+                lexical_ids = [chunk_id for chunk_id, _ in lexical_index.search(query, n_candidates)]
+                fused = reciprocal_rank_fusion(
+                    [list(hits), lexical_ids],
+                    [self.HYBRID_VECTOR_WEIGHT, self.HYBRID_LEXICAL_WEIGHT],
+                    k=self.RRF_K
+                )
+                ids = [chunk_id for chunk_id, _ in fused[:n_results]]
+            rankings.append(ids)
+        if mode != 'vector':
+            record_stage('lexical_search', lexical_start)
+
+        # Fetch the chunks only found by BM25 in a single call
+        chunks = {}
+        for hits in vector_hits:
+            chunks.update(hits)
+        chunks.update(self._get_chunks(list({
+            chunk_id for ids in rankings for chunk_id in ids if chunk_id not in chunks
+        })))
+
+        # Format results
+        return [
+            [{'source': chunks[chunk_id][1]['source'], 'content': chunks[chunk_id][0]}
+             for chunk_id in ids if chunk_id in chunks]
+            for ids in rankings
+        ]
+
+    def retrieve_documents(self, query: str, n_results: int = 3, query_embedding=None, mode: str = None) -> list:
+        """Retrieve relevant context using vector, lexical or hybrid search"""
+        try:
+            query_embeddings = None if query_embedding is None else [query_embedding]
+            return self.retrieve_documents_batch([query], n_results, query_embeddings, mode)[0]
         except Exception as e:
             print(f"Error retrieving context: {e}")
             return []
 
-    def generate_response(self, query: str, context: list) -> str:
+    def _build_messages(self, query: str, context: list, usage: dict = None) -> list:
+        """Build the chat messages sent to the LLM, fitting the context into the token budget.
+
+        When `usage` is given it receives the prompt token count and how much
+        of the context was used.
+        """
+        system_prompt = ("You are a customer support assistant. Answer the query using the provided context. "
+                         "If unsure, say you don't know. Keep responses concise and helpful.")
+        built = self.context_builder.build(context)
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": f"Query: {query}\n\nContext:\n{built.text}"}
+        ]
+
+        prompt_tokens = count_message_tokens(messages, self.OPENROUTER_MODEL)
+        PROMPT_TOKENS.observe(prompt_tokens)
+        if usage is not None:
+            usage.update(prompt_tokens=prompt_tokens, context_tokens=built.tokens,
+                         context_passages=built.passages, context_truncated=built.truncated)
+        return messages
+
+    async def generate_response(self, query: str, context: list, usage: dict = None) -> str:
         """Generate response using OpenRouter's API"""
         if not self.OPENROUTER_API_KEY:
             return "Error: OPENROUTER_API_KEY not found in environment variables"
 
-        system_prompt = """You are a customer support assistant. Answer the query using the provided context. \
-            If unsure, say you don't know. Keep responses concise and helpful."""
-
         try:
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Query: {query}\nContext: {json.dumps(context)}"}
-            ]
-
-            payload = {
-                "model":"openai/gpt-4o-mini",
-                "messages": messages,
-                "temperature": 0.7,
-                "max_tokens": 500
-            }
-
-            headers = {
-                "Authorization": f"Bearer {self.OPENROUTER_API_KEY}",
-                "HTTP-Referer": "https://github.com/your-repository",
-                "X-Title": "Customer Support Bot"
-            }
-
-            response = requests.post(self.OPENROUTER_URL, json=payload, headers=headers)
-            response.raise_for_status()
+            messages = self._build_messages(query, context, usage)
+
+            with stage('generate'):
+                data = await self.llm.chat(
+                    messages,
+                    model=self.OPENROUTER_MODEL,
+                    temperature=0.7,
+                    max_tokens=500
+                )
             
-            return response.json()['choices'][0]['message']['content']
+            return data['choices'][0]['message']['content']
         except Exception as e:
+            LLM_ERRORS.labels('generate').inc()
             return f"Error generating response: {str(e)}"
 
+    async def stream_response(self, query: str, context: list, usage: dict = None):
+        """Stream the generated response token by token"""
+        if not self.OPENROUTER_API_KEY:
+            yield "Error: OPENROUTER_API_KEY not found in environment variables"
+            return
+
+        async for token in self.llm.stream_chat(
+            self._build_messages(query, context, usage),
+            model=self.OPENROUTER_MODEL,
+            temperature=0.7,
+            max_tokens=500,
+            usage={"include": True}  # Token counts arrive with the last chunk
+        ):
+            yield token
+
+    def after_fork(self):
+        """Drop per-process state inherited from the parent process (see main.preload)"""
+        # Connections are opened lazily, so each worker gets its own pool
+        self.llm.reset()
+        # The memory-mapped NumPy index is safe to share; a Chroma client (SQLite
+        # connection, HNSW index in process memory) is reopened per worker. The
+        # inherited store is only detached: stopping it would close the parent's handles
+        if self.VECTOR_BACKEND == 'chroma':
+            self._vector_lease.store.detach()
+            self._vector_store_version = self.index_version()
+            self._vector_lease = VectorStoreLease(open_vector_store(self.VECTOR_BACKEND, self.DB_PATH))
+
+    async def aclose(self):
+        """Close the pooled HTTP connections, the embedding service and the embedding cache"""
+        await self.llm.aclose()
+        if self.embedding_service is not None:
+            self.embedding_service.close()
+        self.embedding_cache.close()
+
     def interactive_query(self):
         """Interactive query interface"""
+        asyncio.run(self._interactive_query())
+
+    async def _interactive_query(self):
         print("\n=== Customer Support RAG System ===")
         print("Type 'exit' to quit\n")
 
@@ -98,10 +349,12 @@ class RAGPipeline:
                 continue
 
             # Generate and display response
-            response = self.generate_response(query, context)
+            response = await self.generate_response(query, context)
             print("\nAssistant:", response)
             print("\n" + "="*50 + "\n")
 
+        await self.aclose()
+
 if __name__ == '__main__':
     rag = RAGPipeline()
     if not rag.OPENROUTER_API_KEY:
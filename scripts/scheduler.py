@@ -0,0 +1,188 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Union
+
+from scripts.metrics import LLM_ACTIVE, LLM_QUEUE_DEPTH, LLM_QUEUE_WAIT, LLM_SHED
+from scripts.tracing import annotate, span
+
+PRIORITIES = ('high', 'normal', 'low')
+# Used when the real priority is not known yet (classification still running) or could not be computed
+DEFAULT_PRIORITY = PRIORITIES.index('normal')
+
+
+def request_priority(intent: str, sentiment: Dict[str, Any]) -> int:
+    """Scheduling priority (index into PRIORITIES) from the classified intent and sentiment"""
+    urgency = (sentiment or {}).get('urgency')
+    emotion = (sentiment or {}).get('emotion')
+    if urgency == 'high' or (intent == 'complaint' and emotion == 'frustrated'):
+        return 0
+    if urgency == 'medium' or intent in ('complaint', 'troubleshooting'):
+        return 1
+    return 2
+
+
+class Overloaded(Exception):
+    """A generation request was shed by admission control"""
+
+    def __init__(self, reason: str, priority: int, retry_after: int):
+        self.reason = reason
+        self.priority = priority
+        self.retry_after = retry_after
+        # 429 when the queue is full, 503 when the request waited past its deadline
+        self.status_code = 429 if reason == 'queue_full' else 503
+        super().__init__(f"Service overloaded ({reason.replace('_', ' ')}), retry in {retry_after}s")
+
+
+class LLMScheduler:
+    """Admission control and priority scheduling for upstream LLM calls.
+
+    At most `max_concurrency` calls hold a slot at a time; the rest wait in a
+    priority queue (highest priority first, FIFO within a priority) and a
+    released slot is handed straight to the next waiter. A waiter gives up
+    with Overloaded after its priority's queue-time deadline. When
+    `max_queue` requests are waiting, a new request displaces the newest
+    lower-priority waiter, or is rejected itself if there is none. The
+    retry hint is estimated from the queue length and the average time a
+    slot is held.
+    """
+
+    def __init__(self, max_concurrency: int = None, max_queue: int = None, deadlines: List[float] = None):
+        self.max_concurrency = max_concurrency or int(os.getenv('LLM_MAX_CONCURRENCY', '16'))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv('LLM_QUEUE_SIZE', '200'))
+        # Queue-time deadlines in seconds per priority: urgent requests wait longest before being shed
+        self.deadlines = deadlines or [float(seconds) for seconds in
+                                       os.getenv('LLM_QUEUE_DEADLINES', '30,10,3').split(',')]
+        if len(self.deadlines) != len(PRIORITIES):
+            raise ValueError(f"LLM_QUEUE_DEADLINES needs one deadline per priority ({', '.join(PRIORITIES)})")
+        # Longest a queued request waits for its classification before queueing at the default priority
+        self.priority_timeout = float(os.getenv('LLM_PRIORITY_TIMEOUT', '2'))
+
+        self._active = 0
+        self._waiting = [0] * len(PRIORITIES)
+        # Heap of [priority, sequence, future]; entries whose future is done are stale and skipped
+        self._queue = []
+        self._sequence = itertools.count()
+        self._hold_seconds = 1.0  # Moving average of how long a slot is held
+
+    @property
+    def waiting(self) -> int:
+        return sum(self._waiting)
+
+    def retry_after(self) -> int:
+        """Seconds until the current queue has likely drained"""
+        return max(1, math.ceil(self._hold_seconds * (self.waiting + 1) / self.max_concurrency))
+
+    def _shed(self, reason: str, priority: int) -> Overloaded:
+        # Counted here; the shed request's llm_queue span records the Overloaded error
+        LLM_SHED.labels(PRIORITIES[priority], reason).inc()
+        return Overloaded(reason, priority, self.retry_after())
+
+    def _displace(self, priority: int) -> bool:
+        """Reject the newest waiter with a lower priority than `priority`, if any"""
+        candidates = [entry for entry in self._queue if not entry[2].done() and entry[0] > priority]
+        if not candidates:
+            return False
+        victim = max(candidates)
+        victim[2].set_exception(self._shed('queue_full', victim[0]))
+        return True
+
+    def try_acquire(self, priority: int) -> bool:
+        """Take a slot if one is free and nobody is waiting, without queueing"""
+        if self._active >= self.max_concurrency or self.waiting:
+            return False
+        self._active += 1
+        LLM_ACTIVE.labels().set(self._active)
+        LLM_QUEUE_WAIT.labels(PRIORITIES[priority]).observe(0.0)
+        return True
+
+    async def acquire(self, priority: int):
+        """Wait for a slot; raises Overloaded when the queue is full or the deadline passes"""
+        if self.try_acquire(priority):
+            return
+        if self.waiting >= self.max_queue and not self._displace(priority):
+            raise self._shed('queue_full', priority)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, [priority, next(self._sequence), future])
+        self._waiting[priority] += 1
+        LLM_QUEUE_DEPTH.labels(PRIORITIES[priority]).inc()
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(future, timeout=self.deadlines[priority])
+        except asyncio.TimeoutError:
+            raise self._shed('deadline', priority) from None
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # The slot was handed over just as the caller went away
+                self.release(0.0)
+            raise
+        finally:
+            self._waiting[priority] -= 1
+            LLM_QUEUE_DEPTH.labels(PRIORITIES[priority]).dec()
+            LLM_QUEUE_WAIT.labels(PRIORITIES[priority]).observe(time.monotonic() - start)
+            if len(self._queue) > 2 * self.max_queue:
+                # Drop stale entries left by timed out or cancelled waiters
+                self._queue = [entry for entry in self._queue if not entry[2].done()]
+                heapq.heapify(self._queue)
+
+    def release(self, held_seconds: float):
+        """Free a slot, handing it to the highest-priority waiter"""
+        if held_seconds:
+            self._hold_seconds = 0.9 * self._hold_seconds + 0.1 * held_seconds
+        while self._queue:
+            future = heapq.heappop(self._queue)[2]
+            if not future.done():
+                future.set_result(None)  # The slot moves to the waiter; _active is unchanged
+                return
+        self._active -= 1
+        LLM_ACTIVE.labels().set(self._active)
+
+    async def _resolve(self, priority_fn: Callable[[], Awaitable[int]]) -> int:
+        """Await a pending priority for at most `priority_timeout` seconds, else use the default"""
+        try:
+            return await asyncio.wait_for(priority_fn(), timeout=self.priority_timeout)
+        except asyncio.TimeoutError:
+            annotate(priority_timeout=True)
+            return DEFAULT_PRIORITY
+        except Exception:
+            # Classification failed; the caller's own stage reports it
+            return DEFAULT_PRIORITY
+
+    @asynccontextmanager
+    async def slot(self, priority: Union[int, Callable[[], Awaitable[int]]]):
+        """Hold an LLM slot for the enclosed block.
+
+        `priority` may be a coroutine function computing it, e.g. from a
+        classification still in progress. It is only called when no slot is
+        free, so generation never waits on classification while there is
+        spare capacity; a free slot is taken at the default priority. A
+        queued request waits up to `priority_timeout` seconds for it.
+        """
+        with span('llm_queue'):
+            if callable(priority) and self.try_acquire(DEFAULT_PRIORITY):
+                annotate(priority=PRIORITIES[DEFAULT_PRIORITY])
+            else:
+                if callable(priority):
+                    priority = await self._resolve(priority)
+                annotate(priority=PRIORITIES[priority])
+                await self.acquire(priority)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self._active,
+            "max_concurrency": self.max_concurrency,
+            "waiting": dict(zip(PRIORITIES, self._waiting)),
+            "max_queue": self.max_queue,
+            "avg_hold_seconds": round(self._hold_seconds, 3),
+            "retry_after": self.retry_after()
+        }
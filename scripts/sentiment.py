@@ -0,0 +1,161 @@
+import argparse
+import re
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+# Lexicon weights per word: (frustrated, confused, positive, urgency)
+LEXICON = {
+    # Frustration / anger
+    'frustrated': (2.0, 0, 0, 0.5), 'frustrating': (2.0, 0, 0, 0.5), 'angry': (2.0, 0, 0, 0.5),
+    'annoyed': (1.5, 0, 0, 0.3), 'annoying': (1.5, 0, 0, 0.3), 'upset': (1.5, 0, 0, 0.3),
+    'furious': (2.5, 0, 0, 0.8), 'terrible': (2.0, 0, 0, 0.3), 'awful': (2.0, 0, 0, 0.3),
+    'horrible': (2.0, 0, 0, 0.3), 'worst': (2.0, 0, 0, 0.3), 'unacceptable': (2.0, 0, 0, 0.8),
+    'ridiculous': (1.5, 0, 0, 0.3), 'useless': (1.5, 0, 0, 0.3), 'disappointed': (1.5, 0, 0, 0),
+    'disappointing': (1.5, 0, 0, 0), 'hate': (2.0, 0, 0, 0), 'unsatisfactory': (1.5, 0, 0, 0),
+    'poor': (1.0, 0, 0, 0), 'bad': (1.0, 0, 0, 0), 'rude': (1.5, 0, 0, 0), 'scam': (2.0, 0, 0, 1.0),
+    'waste': (1.0, 0, 0, 0), 'wrong': (1.0, 0, 0, 0.3), 'damaged': (1.0, 0, 0, 0.5),
+    'broken': (1.0, 0, 0, 0.5), 'defective': (1.0, 0, 0, 0.5), 'late': (0.8, 0, 0, 0.3),
+    'delayed': (0.8, 0, 0, 0.3), 'overcharged': (1.5, 0, 0, 0.8), 'charged': (0.5, 0, 0, 0.8),
+    'twice': (0.5, 0, 0, 0.5), 'ignored': (1.5, 0, 0, 0.5), 'complaint': (1.0, 0, 0, 0.3),
+    'slow': (0.8, 0, 0, 0), 'again': (0.5, 0, 0, 0.3), 'still': (0.5, 0, 0, 0.5),
+    'refuse': (1.0, 0, 0, 0.3), 'refused': (1.0, 0, 0, 0.3),
+    # Confusion
+    'confused': (0, 2.0, 0, 0), 'confusing': (0, 2.0, 0, 0), 'unclear': (0, 1.5, 0, 0),
+    'unsure': (0, 1.5, 0, 0), 'understand': (0, 0.8, 0, 0), 'explain': (0, 0.8, 0, 0),
+    'lost': (0, 0.8, 0, 0.3), 'wondering': (0, 0.8, 0, 0), 'figure': (0, 0.5, 0, 0),
+    'how': (0, 0.3, 0, 0), 'why': (0, 0.5, 0, 0), 'what': (0, 0.3, 0, 0), 'where': (0, 0.3, 0, 0),
+    'which': (0, 0.3, 0, 0), 'mean': (0, 0.5, 0, 0),
+    # Positive
+    'thanks': (0, 0, 1.5, 0), 'thank': (0, 0, 1.5, 0), 'great': (0, 0, 1.5, 0),
+    'love': (0, 0, 2.0, 0), 'awesome': (0, 0, 2.0, 0), 'excellent': (0, 0, 2.0, 0),
+    'good': (0, 0, 1.0, 0), 'happy': (0, 0, 1.5, 0), 'appreciate': (0, 0, 1.5, 0),
+    'perfect': (0, 0, 2.0, 0), 'amazing': (0, 0, 2.0, 0), 'helpful': (0, 0, 1.5, 0),
+    'wonderful': (0, 0, 2.0, 0), 'pleased': (0, 0, 1.5, 0), 'glad': (0, 0, 1.5, 0),
+    'nice': (0, 0, 1.0, 0), 'fantastic': (0, 0, 2.0, 0), 'satisfied': (0, 0, 1.5, 0),
+    # Urgency
+    'urgent': (0, 0, 0, 2.0), 'urgently': (0, 0, 0, 2.0), 'asap': (0, 0, 0, 2.0),
+    'immediately': (0, 0, 0, 2.0), 'emergency': (0, 0, 0, 2.0), 'critical': (0.5, 0, 0, 1.5),
+    'now': (0, 0, 0, 0.8), 'today': (0, 0, 0, 0.8), 'quickly': (0, 0, 0, 0.8),
+    'deadline': (0, 0, 0, 1.0), 'locked': (0.5, 0, 0, 1.0), 'stuck': (0.5, 0, 0, 0.8),
+    'down': (0.3, 0, 0, 0.8), 'fraud': (1.0, 0, 0, 2.0), 'stolen': (1.0, 0, 0, 2.0),
+    'hacked': (1.0, 0, 0, 2.0), 'unable': (0.3, 0, 0, 0.5), 'cant': (0.3, 0, 0, 0.5),
+    'cannot': (0.3, 0, 0, 0.5), 'need': (0, 0, 0, 0.3), 'weeks': (0.5, 0, 0, 0.5),
+    'days': (0.3, 0, 0, 0.3),
+}
+
+# Weights for words following a negator, when swapping positive and
+# frustrated weights is not enough ("not sure", "not working")
+NEGATED_LEXICON = {
+    'sure': (0, 1.5, 0, 0),
+    'working': (1.0, 0, 0, 0.8), 'work': (1.0, 0, 0, 0.8), 'works': (1.0, 0, 0, 0.8),
+    'received': (1.0, 0, 0, 0.8), 'arrived': (1.0, 0, 0, 0.8), 'responded': (1.5, 0, 0, 0.5),
+    'bad': (0, 0, 0.5, 0),
+}
+
+NEGATORS = {'not', 'no', 'never', 'dont', 'doesnt', 'didnt', 'isnt', 'wasnt', 'cant', 'cannot',
+            'wont', 'havent', 'hasnt', 'without'}
+NEGATION_WINDOW = 3  # Tokens after a negator that are treated as negated
+
+TOKEN_RE = re.compile(r"[a-z']+")
+CAPS_RE = re.compile(r"\b[A-Z]{3,}\b")
+
+
+class SentimentScorer:
+    """Lexicon and rule-based scorer for emotion, urgency and satisfaction.
+
+    Texts are mapped to lexicon term counts (with negated terms as separate
+    columns), so a batch is scored with a single matrix product. Punctuation
+    and casing cues are added on top. Produces the same
+    `{emotion, urgency, satisfaction}` structure as the sentiment agent.
+    """
+
+    def __init__(self, lexicon: Dict[str, tuple] = None, negated_lexicon: Dict[str, tuple] = None,
+                 emotion_threshold: float = 1.0):
+        lexicon = LEXICON if lexicon is None else lexicon
+        negated_lexicon = NEGATED_LEXICON if negated_lexicon is None else negated_lexicon
+        self.emotion_threshold = emotion_threshold
+
+        terms = sorted(set(lexicon) | set(negated_lexicon))
+        self.vocab = {term: i for i, term in enumerate(terms)}
+        self.n_terms = len(terms)
+
+        # Rows [0, n) hold plain weights, rows [n, 2n) weights for negated terms
+        self.weights = np.zeros((2 * self.n_terms, 4), dtype=np.float32)
+        for term, i in self.vocab.items():
+            frustrated, confused, positive, urgency = lexicon.get(term, (0, 0, 0, 0))
+            self.weights[i] = (frustrated, confused, positive, urgency)
+            self.weights[self.n_terms + i] = negated_lexicon.get(term, (positive, confused, frustrated, urgency))
+
+    def _term_ids(self, text: str) -> List[int]:
+        """Map a text to lexicon column ids, applying negation"""
+        ids = []
+        negated = 0
+        for token in TOKEN_RE.findall(text.lower()):
+            token = token.replace("'", "")
+            i = self.vocab.get(token)
+            if i is not None:
+                ids.append(i + self.n_terms if negated else i)
+            negated = NEGATION_WINDOW if token in NEGATORS else max(0, negated - 1)
+        return ids
+
+    def score_batch(self, texts: List[str]) -> List[Dict[str, Any]]:
+        """Score a batch of texts"""
+        if not texts:
+            return []
+        rows, cols = [], []
+        for row, text in enumerate(texts):
+            ids = self._term_ids(text)
+            rows.extend([row] * len(ids))
+            cols.extend(ids)
+
+        counts = np.zeros((len(texts), 2 * self.n_terms), dtype=np.float32)
+        np.add.at(counts, (rows, cols), 1)
+        frustrated, confused, positive, urgency = (counts @ self.weights).T
+
+        # Punctuation and casing cues
+        exclamations = np.minimum([text.count('!') for text in texts], 3)
+        questions = np.minimum([text.count('?') for text in texts], 2)
+        shouting = np.minimum([len(CAPS_RE.findall(text)) for text in texts], 2)
+
+        frustrated = frustrated + 0.4 * exclamations + 0.5 * shouting
+        confused = confused + 0.3 * questions
+        urgency = urgency + 0.3 * exclamations + 0.5 * shouting + 0.3 * frustrated
+
+        emotions = np.stack([frustrated, confused, positive], axis=1)
+        best = emotions.argmax(axis=1)
+        is_neutral = emotions.max(axis=1) < self.emotion_threshold
+        satisfaction = np.clip(np.rint(5 + 1.5 * positive - 1.2 * frustrated - 0.5 * confused), 1, 10)
+
+        results = []
+        for i in range(len(texts)):
+            results.append({
+                "emotion": "neutral" if is_neutral[i] else ("frustrated", "confused", "positive")[best[i]],
+                "urgency": "high" if urgency[i] >= 2.0 else "medium" if urgency[i] >= 0.8 else "low",
+                "satisfaction": int(satisfaction[i])
+            })
+        return results
+
+    def score(self, text: str) -> Dict[str, Any]:
+        """Score a single text"""
+        return self.score_batch([text])[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score texts with the local sentiment scorer")
+    parser.add_argument('texts', nargs='+', help="Texts to score")
+    args = parser.parse_args()
+
+    scorer = SentimentScorer()
+    start = time.perf_counter()
+    results = scorer.score_batch(args.texts)
+    elapsed = time.perf_counter() - start
+
+    for text, result in zip(args.texts, results):
+        print(f"{result}  <- {text}")
+    print(f"\nScored {len(args.texts)} texts in {elapsed * 1000:.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
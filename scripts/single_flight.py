@@ -0,0 +1,55 @@
+import asyncio
+import copy
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+from scripts.metrics import COALESCED_REQUESTS
+
+
+class SingleFlight:
+    """Shares one in-progress execution between concurrent calls with the same key.
+
+    The first caller for a key starts the work as its own task; callers that
+    arrive while it is running wait for the same task instead of starting
+    another. Every caller gets its own deep copy of the result, and an
+    exception is raised to every caller. Nothing is kept once the task
+    finishes, so a failure is never replayed to later calls. A caller that is
+    cancelled (e.g. its client disconnected) only stops waiting; the work is
+    cancelled once no caller is waiting for it any more.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, Tuple[asyncio.Task, list]] = {}
+
+    def __len__(self):
+        return len(self._calls)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Return (result of `fn()`, whether it was shared with an earlier caller)"""
+        call = self._calls.get(key)
+        shared = call is not None
+        if shared:
+            COALESCED_REQUESTS.inc()
+        else:
+            task = asyncio.ensure_future(fn())
+            call = (task, [0])  # Task and its number of waiting callers
+            self._calls[key] = call
+            task.add_done_callback(lambda _, key=key, call=call: self._forget(key, call))
+
+        task, waiters = call
+        waiters[0] += 1
+        try:
+            # Shielded so that cancelling one caller does not cancel the shared task
+            result = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done() and waiters[0] == 1:
+                # Later callers must start fresh instead of joining the cancelled task
+                self._forget(key, call)
+                task.cancel()
+            raise
+        finally:
+            waiters[0] -= 1
+        return copy.deepcopy(result), shared
+
+    def _forget(self, key: Hashable, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
@@ -0,0 +1,70 @@
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+
+class Startup:
+    """Loads the heavy application components off the request path and tracks readiness.
+
+    Each component is loaded by `step`, which records its status (pending,
+    loading, ready or failed), load time and error. `start` runs the loader
+    on a background thread so the server can answer liveness probes while
+    models load; `ready` turns true once the loader has finished without
+    errors.
+    """
+
+    def __init__(self, components: List[str]):
+        self.started_at = time.monotonic()
+        self.components: Dict[str, Dict[str, Any]] = {
+            name: {"status": "pending", "seconds": None, "error": None} for name in components
+        }
+        self.ready = False
+        self.error = None
+        self.total_seconds = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def step(self, name: str, fn: Callable, *args):
+        """Load one component, recording its status and timing"""
+        with self._lock:
+            self.components.setdefault(name, {})
+            self.components[name].update(status="loading", seconds=None, error=None)
+        start = time.perf_counter()
+        try:
+            result = fn(*args)
+        except Exception as e:
+            with self._lock:
+                self.components[name].update(status="failed", seconds=time.perf_counter() - start, error=str(e))
+            raise
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.components[name].update(status="ready", seconds=elapsed)
+        print(f"Loaded {name} in {elapsed:.2f}s")  # Debug log
+        return result
+
+    def run(self, loader: Callable[["Startup"], None]):
+        """Run the loader in the calling thread"""
+        try:
+            loader(self)
+        except Exception as e:
+            self.error = str(e)
+            print(f"Startup failed: {self.error}")  # Debug log
+            return
+        self.total_seconds = time.monotonic() - self.started_at
+        self.ready = True
+        print(f"Ready to serve after {self.total_seconds:.2f}s")  # Debug log
+
+    def start(self, loader: Callable[["Startup"], None]):
+        """Run the loader on a background thread"""
+        self._thread = threading.Thread(target=self.run, args=(loader,), name='startup', daemon=True)
+        self._thread.start()
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "status": "ready" if self.ready else "failed" if self.error else "starting",
+                "uptime_seconds": time.monotonic() - self.started_at,
+                "startup_seconds": self.total_seconds,
+                "error": self.error,
+                "components": {name: dict(info) for name, info in self.components.items()}
+            }
@@ -0,0 +1,451 @@
+import argparse
+import contextvars
+import glob
+import itertools
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+from scripts.metrics import STAGE_SECONDS, TRACES
+
+# Project root (one level up from scripts)
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRACE_DIR = os.path.join(PROJECT_ROOT, 'logs', 'traces')
+
+# Trace of the request being handled and the innermost open span; asyncio
+# tasks inherit both, and QueryPipeline copies them into its executor threads
+_current_trace: contextvars.ContextVar[Optional['Trace']] = contextvars.ContextVar('trace', default=None)
+_current_span: contextvars.ContextVar[Optional['Span']] = contextvars.ContextVar('span', default=None)
+
+
+class Span:
+    __slots__ = ('name', 'span_id', 'parent_id', 'start', 'duration', 'attributes', 'error')
+
+    def __init__(self, name: str, span_id: int, parent_id: Optional[int], start: float,
+                 attributes: Dict[str, Any] = None):
+        self.name = name
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.start = start
+        self.duration = None
+        self.attributes = attributes or {}
+        self.error = None
+
+    def to_record(self, trace_start: float) -> Dict[str, Any]:
+        record = {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_ms": round((self.start - trace_start) * 1000, 3),
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None
+        }
+        if self.attributes:
+            record["attributes"] = self.attributes
+        if self.error:
+            record["error"] = self.error
+        return record
+
+
+class Trace:
+    """Spans, attributes and payload of one request.
+
+    Attributes (small metadata such as the intent or cache hits) are always
+    written with the trace; the payload (query, sentiment, full response) is
+    only written for sampled or failed requests.
+    """
+
+    def __init__(self, endpoint: str, request_id: str, sampled: bool):
+        self.endpoint = endpoint
+        self.request_id = request_id
+        self.sampled = sampled
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration = None
+        self.status = None
+        self.error = None
+        self.attributes: Dict[str, Any] = {}
+        self.payload: Dict[str, Any] = {}
+        self.spans: List[Span] = []
+        self._span_ids = itertools.count(1)
+
+    def open_span(self, name: str, parent: Optional[Span], attributes: Dict[str, Any] = None) -> Span:
+        span = Span(name, next(self._span_ids), parent.span_id if parent is not None else None,
+                    time.perf_counter(), attributes)
+        self.spans.append(span)
+        return span
+
+    def to_record(self, reason: str) -> Dict[str, Any]:
+        record = {
+            "request_id": self.request_id,
+            "endpoint": self.endpoint,
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started_at)),
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "status": self.status,
+            "reason": reason,
+            "pid": os.getpid(),
+            "attributes": self.attributes,
+            "spans": [span.to_record(self.start) for span in list(self.spans)]
+        }
+        if self.error:
+            record["error"] = self.error
+        if reason in ('sampled', 'error'):
+            record["payload"] = self.payload
+        return record
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time the enclosed block as a span of the current trace (a no-op outside a traced request)"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    current = trace.open_span(name, _current_span.get(), attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.duration = time.perf_counter() - current.start
+        _current_span.reset(token)
+
+
+@contextmanager
+def stage(name: str):
+    """Time a pipeline stage: the support_stage_seconds histogram and a span of the current trace"""
+    start = time.perf_counter()
+    try:
+        with span(name):
+            yield
+    finally:
+        STAGE_SECONDS.labels(name).observe(time.perf_counter() - start)
+
+
+def record_stage(name: str, start: float):
+    """Record a stage timed by hand from `start` (a time.perf_counter() value) until now"""
+    end = time.perf_counter()
+    STAGE_SECONDS.labels(name).observe(end - start)
+    trace = _current_trace.get()
+    if trace is not None:
+        recorded = trace.open_span(name, _current_span.get())
+        recorded.start = start
+        recorded.duration = end - start
+
+
+def annotate(**attributes):
+    """Attach metadata to the innermost open span (or the trace)"""
+    current = _current_span.get()
+    if current is not None:
+        current.attributes.update(attributes)
+    elif _current_trace.get() is not None:
+        _current_trace.get().attributes.update(attributes)
+
+
+def capture(**payload):
+    """Attach request data to the trace; it is only written for sampled or failed requests"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.payload.update(payload)
+
+
+def record_error(stage_name: str, error: BaseException):
+    """Mark the current trace as failed, so it is written with its payload"""
+    trace = _current_trace.get()
+    if trace is not None and trace.error is None:
+        trace.error = {"stage": stage_name, "type": type(error).__name__, "detail": str(error)}
+
+
+class TraceWriter:
+    """Writes trace records as JSON lines from a background thread.
+
+    `write` only enqueues the finished trace and never blocks: when the queue
+    is full the trace is dropped and counted. The worker thread serializes
+    queued traces in batches, so neither JSON encoding nor file I/O runs on
+    the request path. Each process appends to its own
+    `traces-<pid>.jsonl`, which is rotated to `.1` past `max_bytes`.
+    """
+
+    def __init__(self, directory: str, max_queue: int = 10000, max_bytes: int = 100 * 1024 * 1024):
+        self.directory = directory
+        self.max_queue = max_queue
+        self.max_bytes = max_bytes
+        self._queue = queue.Queue(max_queue)  # (trace, reason) pairs; None stops the writer
+        self._lock = threading.Lock()
+        self._worker = None
+        self._pid = None
+
+    def _ensure_worker(self):
+        """Start the writer thread on first use (and again in a forked child)"""
+        if self._worker is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker is None or self._pid != os.getpid():
+                self._queue = queue.Queue(self.max_queue)
+                self._pid = os.getpid()
+                self._worker = threading.Thread(target=self._run, name='trace-writer', daemon=True)
+                self._worker.start()
+
+    def write(self, trace: Trace, reason: str):
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((trace, reason))
+        except queue.Full:
+            TRACES.labels('dropped').inc()
+
+    def _run(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'traces-{os.getpid()}.jsonl')
+        f = open(path, 'a', encoding='utf-8')
+        try:
+            while True:
+                batch = [self._queue.get()]
+                while len(batch) < 256:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stop = None in batch
+                lines = []
+                for item in batch:
+                    if item is None:
+                        continue
+                    try:
+                        lines.append(json.dumps(item[0].to_record(item[1]), default=str))
+                    except Exception as e:
+                        TRACES.labels('error').inc()
+                        print(f"Error serializing trace: {e}")  # Debug log
+                if lines:
+                    try:
+                        f.write('\n'.join(lines) + '\n')
+                        f.flush()
+                        TRACES.labels('written').inc(len(lines))
+                        if f.tell() > self.max_bytes:
+                            f.close()
+                            os.replace(path, path + '.1')
+                            f = open(path, 'a', encoding='utf-8')
+                    except OSError as e:
+                        # Keep the thread alive (e.g. disk full); these traces are lost
+                        TRACES.labels('error').inc(len(lines))
+                        print(f"Error writing traces: {e}")  # Debug log
+                if stop:
+                    return
+        finally:
+            f.close()
+
+    def close(self, timeout: float = 5.0):
+        """Flush queued traces and stop the writer thread"""
+        if self._worker is None or self._pid != os.getpid():
+            return
+        self._queue.put(None)
+        self._worker.join(timeout)
+        self._worker = None
+
+
+class Tracer:
+    """Starts, samples and hands off request traces.
+
+    A `TRACE_SAMPLE_RATE` fraction of requests (and any request sent with
+    `X-Trace: 1`) is written with its payload. Failed requests are always
+    written with their payload; requests slower than `TRACE_SLOW_MS` are
+    written without it. Other traces are discarded once the request ends.
+    """
+
+    def __init__(self, directory: str = None, sample_rate: float = None, slow_ms: float = None):
+        self.enabled = os.getenv('TRACING', 'on') == 'on'
+        self.sample_rate = sample_rate if sample_rate is not None else float(os.getenv('TRACE_SAMPLE_RATE', '0.01'))
+        slow_ms = slow_ms if slow_ms is not None else float(os.getenv('TRACE_SLOW_MS', '2000'))
+        self.slow_seconds = slow_ms / 1000
+        self.writer = TraceWriter(
+            directory or os.getenv('TRACE_DIR', TRACE_DIR),
+            int(os.getenv('TRACE_QUEUE_SIZE', '10000')),
+            int(float(os.getenv('TRACE_FILE_MAX_MB', '100')) * 1024 * 1024)
+        )
+
+    @contextmanager
+    def trace(self, endpoint: str, request_id: str = None, force_sample: bool = False) -> Iterator[Trace]:
+        """Trace the enclosed request; its stages record spans through the context"""
+        trace = Trace(endpoint, request_id or uuid.uuid4().hex, force_sample or random.random() < self.sample_rate)
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        except Exception as e:
+            record_error('request', e)
+            raise
+        finally:
+            try:
+                _current_trace.reset(token)
+            except ValueError:
+                pass  # Finished from another context (e.g. a closed streaming generator)
+            self.finish(trace)
+
+    def finish(self, trace: Trace):
+        trace.duration = time.perf_counter() - trace.start
+        if trace.error is not None:
+            reason = 'error'
+        elif trace.sampled:
+            reason = 'sampled'
+        elif trace.duration >= self.slow_seconds:
+            reason = 'slow'
+        else:
+            return
+        self.writer.write(trace, reason)
+
+
+class TracingMiddleware:
+    """ASGI middleware tracing every request under `prefix`.
+
+    The request id comes from the `X-Request-ID` header (or is generated)
+    and is returned in the response's `X-Request-ID`. Responses with status
+    500 or above mark the trace as failed, except 503: requests shed under
+    overload are not worth a trace each.
+    """
+
+    def __init__(self, app, tracer: Tracer, prefix: str = '/api/'):
+        self.app = app
+        self.tracer = tracer
+        self.prefix = prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not scope['path'].startswith(self.prefix) or not self.tracer.enabled:
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope['headers'])
+        request_id = headers.get(b'x-request-id', b'').decode('latin-1')[:128] or None
+        force_sample = headers.get(b'x-trace', b'').lower() in (b'1', b'true', b'yes')
+
+        with self.tracer.trace(scope['path'], request_id, force_sample) as trace:
+            async def send_with_request_id(message):
+                if message['type'] == 'http.response.start':
+                    trace.status = message['status']
+                    if trace.status >= 500 and trace.status != 503 and trace.error is None:
+                        trace.error = {"stage": "response", "type": "HTTPStatus", "detail": str(trace.status)}
+                    message = dict(message, headers=list(message.get('headers', []))
+                                   + [(b'x-request-id', trace.request_id.encode('latin-1'))])
+                await send(message)
+
+            await self.app(scope, receive, send_with_request_id)
+
+
+def read_traces(paths: List[str]) -> Iterator[Dict[str, Any]]:
+    """Trace records from JSONL files or directories of them"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, 'traces-*.jsonl*'))))
+        else:
+            files.append(path)
+    for filename in files:
+        with open(filename, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Partially written last line
+
+
+def summarize(traces: List[Dict[str, Any]], top: int = 20, name: str = None) -> Dict[str, Any]:
+    """Latency percentiles per span name and endpoint, and the slowest individual spans"""
+    durations: Dict[str, List[float]] = {}
+    slowest = []
+    for trace in traces:
+        durations.setdefault(f"request {trace['endpoint']}", []).append(trace['duration_ms'] or 0.0)
+        for recorded in trace['spans']:
+            if recorded['duration_ms'] is None or (name and recorded['name'] != name):
+                continue
+            durations.setdefault(recorded['name'], []).append(recorded['duration_ms'])
+            slowest.append((recorded['duration_ms'], recorded['name'], trace['request_id'], trace['endpoint'],
+                            trace.get('reason')))
+    slowest.sort(reverse=True)
+
+    def percentiles(values: List[float]) -> Dict[str, float]:
+        values = np.asarray(values)
+        return {"count": int(len(values)), "p50_ms": float(np.percentile(values, 50)),
+                "p95_ms": float(np.percentile(values, 95)), "max_ms": float(values.max())}
+
+    return {
+        "traces": len(traces),
+        "spans": {key: percentiles(values) for key, values in durations.items()},
+        "slowest": slowest[:top]
+    }
+
+
+def show(trace: Dict[str, Any]):
+    """Print one trace as an indented span tree"""
+    print(f"{trace['request_id']} {trace['endpoint']} {trace['timestamp']} {trace['duration_ms']:.1f} ms "
+          f"status {trace['status']} ({trace['reason']})")
+    if trace.get('error'):
+        print(f"  error: {trace['error']}")
+    if trace.get('attributes'):
+        print(f"  attributes: {json.dumps(trace['attributes'])}")
+    children: Dict[Optional[int], List[Dict[str, Any]]] = {}
+    for recorded in trace['spans']:
+        children.setdefault(recorded['parent_id'], []).append(recorded)
+
+    def walk(parent_id, depth):
+        for recorded in sorted(children.get(parent_id, []), key=lambda item: item['start_ms']):
+            duration = f"{recorded['duration_ms']:9.2f} ms" if recorded['duration_ms'] is not None else "  unfinished"
+            extra = f"  {json.dumps(recorded['attributes'])}" if recorded.get('attributes') else ""
+            error = f"  error: {recorded['error']}" if recorded.get('error') else ""
+            print(f"  +{recorded['start_ms']:9.2f} ms {duration}  {'  ' * depth}{recorded['name']}{extra}{error}")
+            walk(recorded['span_id'], depth + 1)
+
+    walk(None, 0)
+    if 'payload' in trace:
+        print(f"  payload: {json.dumps(trace['payload'], default=str)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize request traces written by the API")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    summary_parser = subparsers.add_parser('summarize', help="Latency per span and the slowest spans")
+    summary_parser.add_argument('paths', nargs='*', default=[TRACE_DIR], help="Trace files or directories")
+    summary_parser.add_argument('--top', type=int, default=20, help="Slowest spans to list")
+    summary_parser.add_argument('--span', help="Only this span name")
+    summary_parser.add_argument('--endpoint', help="Only traces of this endpoint (e.g. /api/query)")
+
+    show_parser = subparsers.add_parser('show', help="Print the span tree of one request")
+    show_parser.add_argument('request_id')
+    show_parser.add_argument('paths', nargs='*', default=[TRACE_DIR], help="Trace files or directories")
+
+    args = parser.parse_args()
+    if args.command == 'show':
+        found = [trace for trace in read_traces(args.paths) if trace['request_id'] == args.request_id]
+        if not found:
+            print(f"No trace for request {args.request_id}")
+            sys.exit(1)
+        for trace in found:
+            show(trace)
+        return
+
+    traces = [trace for trace in read_traces(args.paths) if not args.endpoint or trace['endpoint'] == args.endpoint]
+    if not traces:
+        print("No traces found")
+        sys.exit(1)
+    report = summarize(traces, args.top, args.span)
+    print(f"{report['traces']} traces\n")
+    print(f"{'span':32s} {'count':>7s} {'p50 ms':>10s} {'p95 ms':>10s} {'max ms':>10s}")
+    for key, stats in sorted(report['spans'].items(), key=lambda item: -item[1]['p95_ms']):
+        print(f"{key:32s} {stats['count']:7d} {stats['p50_ms']:10.2f} {stats['p95_ms']:10.2f} {stats['max_ms']:10.2f}")
+    print("\nSlowest spans:")
+    for duration, name, request_id, endpoint, reason in report['slowest']:
+        print(f"  {duration:10.2f} ms  {name:24s} {request_id}  {endpoint} ({reason})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,352 @@
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+COLLECTION_NAME = "customer_support_docs"
+
+# Rows of a quantized index converted and scored per block (cache-sized float32 copies)
+SEARCH_BLOCK_ROWS = 4096
+
+VECTOR_DTYPES = ('float32', 'float16', 'int8')
+
+
+def quantize_int8(embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-vector scalar quantization: row ~= codes * scale"""
+    if not len(embeddings):
+        return np.zeros(embeddings.shape, np.int8), np.zeros(0, np.float32)
+    scales = np.maximum(np.abs(embeddings).max(axis=1) / 127, 1e-12).astype(np.float32)
+    codes = np.rint(embeddings / scales[:, None]).astype(np.int8)
+    return codes, scales
+
+
+class VectorStore:
+    """Read-side interface of a retriever backend.
+
+    `search` returns, for each query embedding, an ordered
+    {chunk id: (document, metadata)} dict of the nearest chunks; `get` fetches
+    chunks by id.
+    """
+
+    def search(self, query_embeddings: np.ndarray, n_results: int) -> List[Dict[str, Tuple[str, dict]]]:
+        raise NotImplementedError
+
+    def get(self, ids: List[str]) -> Dict[str, Tuple[str, dict]]:
+        raise NotImplementedError
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def warmup(self):
+        """Load the index into memory ahead of the first query"""
+
+    def detach(self):
+        """Stop sharing handles with stores opened later, without closing them (see VectorStoreLease)"""
+
+    def close(self):
+        """Release the handles held by the store"""
+
+    def embedder(self) -> Optional[str]:
+        """embedder_id the indexed chunks were embedded with, if the index records it"""
+        return None
+
+
+class VectorStoreLease:
+    """Counts the searches using a vector store, so a store replaced by a re-index
+    is closed once the last of them has finished rather than under them.
+    """
+
+    def __init__(self, store: VectorStore):
+        self.store = store
+        self._readers = 0
+        self._retired = False
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        """Register a reader; False once the store is retired (use its replacement instead)"""
+        with self._lock:
+            if self._retired:
+                return False
+            self._readers += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._readers -= 1
+            close = self._retired and self._readers == 0
+        if close:
+            self.store.close()
+
+    def retire(self):
+        """Close the store now if it is idle, else when its last reader releases it"""
+        with self._lock:
+            self._retired = True
+            close = self._readers == 0
+        if close:
+            self.store.close()
+
+
+class ChromaVectorStore(VectorStore):
+    """Approximate (HNSW) search over the persistent ChromaDB collection"""
+
+    def __init__(self, db_path: str, collection_name: str = COLLECTION_NAME):
+        import chromadb
+        self.client = chromadb.PersistentClient(path=db_path)
+        # Held here: the client looks its System up in a per-path cache that detach() evicts
+        self.system = self.client._system
+        self.collection = self.client.get_collection(collection_name)
+
+    def detach(self):
+        # Systems are cached per path; evicting ours makes the next client open its own
+        # SQLite connection and HNSW segment while this one keeps serving its readers
+        cache = type(self.client)._identifier_to_system
+        if cache.get(self.client._identifier) is self.system:
+            del cache[self.client._identifier]
+
+    def close(self):
+        self.detach()
+        self.system.stop()
+
+    def search(self, query_embeddings, n_results):
+        results = self.collection.query(
+            query_embeddings=np.asarray(query_embeddings, dtype=np.float32).tolist(),  # ChromaDB expects lists
+            n_results=n_results
+        )
+        return [
+            {chunk_id: (doc, meta) for chunk_id, doc, meta in zip(ids, docs, metas)}
+            for ids, docs, metas in zip(results['ids'], results['documents'], results['metadatas'])
+        ]
+
+    def get(self, ids):
+        if not ids:
+            return {}
+        results = self.collection.get(ids=ids, include=['documents', 'metadatas'])
+        return {
+            chunk_id: (doc, meta)
+            for chunk_id, doc, meta in zip(results['ids'], results['documents'], results['metadatas'])
+        }
+
+    def count(self):
+        return self.collection.count()
+
+    def warmup(self):
+        # The HNSW index is loaded by the first query
+        sample = self.collection.peek(limit=1)
+        if len(sample['ids']):
+            self.search([sample['embeddings'][0]], 1)
+
+
+class NumpyVectorStore(VectorStore):
+    """Exact in-process search over a memory-mapped embedding matrix.
+
+    The index directory holds `embeddings.npy` (normalized rows stored as
+    float32, float16, or int8 with per-row scales in `scales.npy`),
+    `documents.bin` (UTF-8 chunk texts back to back) and `metadata.json` (ids,
+    document offsets and chunk metadata). All binary files are memory-mapped
+    read-only, so worker processes share their pages through the OS page
+    cache. A search is one matrix product plus `argpartition`. The index
+    reloads when `metadata.json` (written last by `write`) changes; a reload
+    swaps in a new snapshot, so a search never mixes rows of two versions.
+
+    Quantized indexes also keep a float32 copy in `embeddings_full.npy`. The
+    top `n_results * rescore_factor` approximate candidates are re-scored
+    against it, which only reads those rows, so the copy stays on disk
+    instead of in RAM.
+    """
+
+    def __init__(self, path: str, rescore_factor: int = None):
+        self.path = path
+        self.rescore_factor = rescore_factor if rescore_factor is not None else int(os.getenv('VECTOR_RESCORE_FACTOR', '4'))
+        self._reload_lock = threading.Lock()
+        self._index = None
+        self._load()
+
+    @staticmethod
+    def write(path: str, ids: List[str], documents: List[str], embeddings, metadatas: List[dict],
+              dtype: str = 'float32', full_precision: bool = True, embedder: str = None):
+        """Write an index; each file is replaced atomically, metadata last.
+
+        `full_precision` keeps the float32 copy used to re-score the
+        candidates of a quantized (float16 or int8) index; `embedder` records
+        the embedder_id of the embeddings.
+        """
+        if dtype not in VECTOR_DTYPES:
+            raise ValueError(f"Unknown vector dtype {dtype!r}, expected one of {', '.join(VECTOR_DTYPES)}")
+        os.makedirs(path, exist_ok=True)
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1) if len(ids) else np.zeros((0, 0), np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        full = embeddings / np.maximum(norms, 1e-12)
+        scales = None
+        if dtype == 'int8':
+            stored, scales = quantize_int8(full)
+        else:
+            stored = full.astype(dtype, copy=False)
+        full_precision = full_precision and dtype != 'float32'
+
+        encoded = [doc.encode('utf-8') for doc in documents]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(doc) for doc in encoded], out=offsets[1:])
+
+        def replace(name, write_fn):
+            tmp_path = os.path.join(path, name + '.tmp')
+            with open(tmp_path, 'wb') as f:
+                write_fn(f)
+            os.replace(tmp_path, os.path.join(path, name))
+
+        replace('embeddings.npy', lambda f: np.save(f, stored))
+        if scales is not None:
+            replace('scales.npy', lambda f: np.save(f, scales))
+        if full_precision:
+            replace('embeddings_full.npy', lambda f: np.save(f, full))
+        replace('documents.bin', lambda f: f.write(b''.join(encoded)))
+        replace('metadata.json', lambda f: f.write(json.dumps({
+            "ids": list(ids),
+            "offsets": offsets.tolist(),
+            "metadatas": metadatas,
+            "dtype": dtype,
+            "full_precision": full_precision,
+            "embedder": embedder
+        }).encode('utf-8')))
+
+    def _load(self):
+        """Read the index files into a new snapshot and swap it in"""
+        meta_path = os.path.join(self.path, 'metadata.json')
+        mtime = os.stat(meta_path).st_mtime_ns
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        embeddings = np.load(os.path.join(self.path, 'embeddings.npy'), mmap_mode='r')
+        scales = np.load(os.path.join(self.path, 'scales.npy'), mmap_mode='r') if embeddings.dtype == np.int8 else None
+        full = np.load(os.path.join(self.path, 'embeddings_full.npy'), mmap_mode='r') if meta.get("full_precision") else None
+        docs_path = os.path.join(self.path, 'documents.bin')
+        documents = np.memmap(docs_path, dtype=np.uint8, mode='r') if os.path.getsize(docs_path) else np.empty(0, np.uint8)
+        if (embeddings.shape[0] != len(meta["ids"]) or len(documents) != meta["offsets"][-1]
+                or (scales is not None and len(scales) != len(meta["ids"]))
+                or (full is not None and full.shape != embeddings.shape)):
+            raise ValueError(f"Vector index at {self.path} is inconsistent; rebuild it with generate_embeddings.py")
+
+        # One reference swap: a search in progress keeps using the snapshot it started with
+        self._index = _IndexSnapshot(meta["ids"], meta["offsets"], meta["metadatas"], embeddings, scales, full,
+                                     documents, mtime, meta.get("embedder"))
+
+    def refresh(self):
+        """Reload if the index has been rewritten since it was loaded"""
+        try:
+            mtime = os.stat(os.path.join(self.path, 'metadata.json')).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._index.mtime:
+            return
+        with self._reload_lock:
+            # Another thread may have reloaded while this one waited for the lock
+            if mtime == self._index.mtime:
+                return
+            try:
+                self._load()
+                print(f"Reloaded vector index ({len(self._index.ids)} chunks)")  # Debug log
+            except (OSError, ValueError) as e:
+                # Files are mid-rewrite; keep serving the previous index
+                print(f"Error reloading vector index: {e}")
+
+    # Read-only views of the current snapshot (used by the benchmarks)
+    ids = property(lambda self: self._index.ids)
+    rows = property(lambda self: self._index.rows)
+    embeddings = property(lambda self: self._index.embeddings)
+    scales = property(lambda self: self._index.scales)
+    full = property(lambda self: self._index.full)
+
+    def scores(self, query_embeddings: np.ndarray) -> np.ndarray:
+        """Cosine similarity of every query against every row (approximate for quantized indexes)"""
+        return self._index.scores(query_embeddings)
+
+    def _rescore(self, index: '_IndexSnapshot', query: np.ndarray, candidates: np.ndarray,
+                 n_results: int) -> np.ndarray:
+        """Rank approximate candidates by their full-precision score"""
+        candidates = np.sort(candidates)  # Sequential reads from the memory-mapped copy
+        exact = np.asarray(index.full[candidates]) @ query
+        top = np.argpartition(-exact, n_results - 1)[:n_results]
+        return candidates[top[np.argsort(-exact[top])]]
+
+    def search(self, query_embeddings, n_results):
+        self.refresh()
+        index = self._index  # Read once, so a concurrent reload cannot mix two indexes
+        if not index.ids:
+            return [{} for _ in range(len(np.atleast_2d(query_embeddings)))]
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(-1, index.embeddings.shape[1])
+        scores = index.scores(queries)
+        n_results = min(n_results, scores.shape[1])
+        rescore = index.full is not None and self.rescore_factor > 1
+        n_candidates = min(n_results * self.rescore_factor, scores.shape[1]) if rescore else n_results
+        top = np.argpartition(-scores, n_candidates - 1, axis=1)[:, :n_candidates]
+        results = []
+        for query, row_scores, candidates in zip(queries, scores, top):
+            if rescore:
+                ranked = self._rescore(index, query, candidates, n_results)
+            else:
+                ranked = candidates[np.argsort(-row_scores[candidates])]
+            results.append({index.ids[row]: index.chunk(row) for row in ranked})
+        return results
+
+    def get(self, ids):
+        self.refresh()
+        index = self._index
+        return {chunk_id: index.chunk(index.rows[chunk_id]) for chunk_id in ids if chunk_id in index.rows}
+
+    def count(self):
+        return len(self._index.ids)
+
+    def embedder(self):
+        return self._index.embedder
+
+    def warmup(self):
+        # Scoring reads every embedding row; strided reads fault in the document pages
+        index = self._index
+        if index.ids:
+            index.scores(np.zeros(index.embeddings.shape[1], dtype=np.float32))
+            int(index.documents[::4096].sum())
+
+
+class _IndexSnapshot:
+    """One loaded version of a NumpyVectorStore index; never modified after construction"""
+
+    __slots__ = ('ids', 'offsets', 'metadatas', 'rows', 'embeddings', 'scales', 'full', 'documents', 'mtime',
+                 'embedder')
+
+    def __init__(self, ids, offsets, metadatas, embeddings, scales, full, documents, mtime, embedder=None):
+        self.ids = ids
+        self.offsets = offsets
+        self.metadatas = metadatas
+        self.rows = {chunk_id: row for row, chunk_id in enumerate(ids)}
+        self.embeddings = embeddings
+        self.scales = scales
+        self.full = full
+        self.documents = documents
+        self.mtime = mtime
+        self.embedder = embedder
+
+    def chunk(self, row: int) -> Tuple[str, dict]:
+        doc = bytes(self.documents[self.offsets[row]:self.offsets[row + 1]]).decode('utf-8')
+        return doc, self.metadatas[row]
+
+    def scores(self, query_embeddings: np.ndarray) -> np.ndarray:
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(-1, self.embeddings.shape[1])
+        if self.embeddings.dtype == np.float32:
+            return queries @ self.embeddings.T
+        scores = np.empty((len(queries), len(self.ids)), dtype=np.float32)
+        for start in range(0, len(self.ids), SEARCH_BLOCK_ROWS):
+            block = np.asarray(self.embeddings[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+            block_scores = scores[:, start:start + len(block)]
+            np.matmul(queries, block.T, out=block_scores)
+            if self.scales is not None:
+                block_scores *= self.scales[start:start + len(block)]
+        return scores
+
+
+def open_vector_store(backend: str, db_path: str, numpy_index_path: Optional[str] = None) -> VectorStore:
+    """Open the retriever backend selected by VECTOR_BACKEND ('chroma' or 'numpy')"""
+    if backend == 'numpy':
+        return NumpyVectorStore(numpy_index_path or os.path.join(db_path, 'numpy_index'))
+    if backend == 'chroma':
+        return ChromaVectorStore(db_path)
+    raise ValueError(f"Unknown VECTOR_BACKEND: {backend}")
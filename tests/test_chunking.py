@@ -0,0 +1,44 @@
+import sys
+
+import pytest
+
+from scripts import chunking
+from scripts.chunking import chunk_file, chunk_text, init_worker
+
+tokenizers = pytest.importorskip('tokenizers')
+
+
+def word_tokenizer():
+    """Whitespace word-level tokenizer that adds [CLS]/[SEP] like the embedder's"""
+    from tokenizers import Tokenizer, models, pre_tokenizers, processors
+    vocab = {"[UNK]": 0, "[CLS]": 1, "[SEP]": 2, "[PAD]": 3}
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+    tokenizer.post_processor = processors.TemplateProcessing(
+        single="[CLS] $A [SEP]", special_tokens=[("[CLS]", 1), ("[SEP]", 2)])
+    tokenizer.enable_truncation(4)
+    return tokenizer
+
+
+def test_worker_counts_with_the_serialized_tokenizer(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'transformers', None)  # Not needed by workers
+    init_worker(word_tokenizer().to_str())
+    # No special tokens and no truncation, like tokenizer_counter on the parent's tokenizer
+    assert chunking._worker_count_tokens(["one two three four five six", "seven"]) == [6, 1]
+    assert chunking._worker_count_tokens([]) == []
+
+
+def test_worker_chunks_match_the_parent(tmp_path, monkeypatch):
+    monkeypatch.setattr(chunking, '_worker_count_tokens', None)
+    text = " ".join(f"Sentence number {i} has five words." for i in range(20))
+    path = tmp_path / 'doc.txt'
+    path.write_text(text, encoding='utf-8')
+
+    def count_words(texts):
+        return [len(t.split()) for t in texts]
+
+    init_worker(word_tokenizer().to_str())
+    source, chunks = chunk_file(str(path), 'doc.txt', 30, 10)
+    assert source == 'doc.txt'
+    assert chunks == chunk_text(text, count_words, 30, 10)
+    assert all(chunk.n_tokens <= 30 for chunk in chunks)
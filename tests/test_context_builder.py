@@ -0,0 +1,109 @@
+import sys
+import time
+import types
+
+import pytest
+
+from scripts import context_builder
+from scripts.context_builder import ContextBuilder, count_message_tokens, count_tokens, get_encoder
+
+MODEL = 'test/char-model'
+
+
+class CharEncoder:
+    """One token per character, so budgets are easy to reason about"""
+
+    def encode_ordinary(self, text):
+        return [ord(char) for char in text]
+
+    def decode(self, tokens):
+        return ''.join(map(chr, tokens))
+
+
+@pytest.fixture(autouse=True)
+def encoders(monkeypatch):
+    """Fresh encoder caches, with the character encoder registered for MODEL"""
+    monkeypatch.setattr(context_builder, '_encoders', {MODEL: CharEncoder()})
+    monkeypatch.setattr(context_builder, '_retry_at', {})
+
+
+def passages():
+    return [
+        {'source': 'billing.txt', 'content': "Refunds take five days. Contact billing for help. Keep your receipt."},
+        {'source': 'shipping.txt', 'content': "Keep your receipt. Orders ship in two days. Tracking is emailed."},
+        {'source': 'returns.txt', 'content': "Returns are free within thirty days."}
+    ]
+
+
+def test_everything_fits_within_a_large_budget():
+    built = ContextBuilder(MODEL, max_tokens=10000).build(passages())
+    assert not built.truncated
+    assert built.passages == 3
+    # Relevance order and numbered headers
+    assert built.text.startswith("[1] billing.txt\nRefunds take five days.")
+    assert built.text.index("[2] shipping.txt") < built.text.index("[3] returns.txt")
+    assert built.tokens >= count_tokens(built.text, MODEL)
+
+
+def test_sentences_repeated_across_passages_are_included_once():
+    built = ContextBuilder(MODEL, max_tokens=10000).build(passages())
+    assert built.text.count("Keep your receipt.") == 1
+    assert "[2] shipping.txt\nOrders ship in two days." in built.text
+
+
+@pytest.mark.parametrize('budget', [40, 60, 90, 120, 150])
+def test_budget_is_respected_and_cut_at_a_sentence_boundary(budget):
+    built = ContextBuilder(MODEL, max_tokens=budget).build(passages())
+    assert built.truncated
+    assert built.tokens <= budget
+    assert count_tokens(built.text, MODEL) <= budget
+    # Every included sentence is complete
+    assert built.text.endswith('.')
+
+
+def test_oversized_top_sentence_is_truncated_instead_of_dropped():
+    context = [{'source': 'long.txt', 'content': "word " * 200 + "end."}]
+    built = ContextBuilder(MODEL, max_tokens=50).build(context)
+    assert built.truncated
+    assert built.passages == 1
+    assert built.tokens == 50
+    assert count_tokens(built.text, MODEL) <= 50
+    assert built.text.startswith("[1] long.txt\nword word")
+
+
+def test_empty_context():
+    built = ContextBuilder(MODEL, max_tokens=100).build([{'source': 'empty.txt', 'content': ''}])
+    assert built == ("", 0, 0, False)
+
+
+def test_message_tokens_include_the_chat_overhead():
+    messages = [{"role": "system", "content": "abc"}, {"role": "user", "content": "de"}]
+    assert count_message_tokens(messages, MODEL) == 3 + 2 + 2 * context_builder.TOKENS_PER_MESSAGE \
+        + context_builder.TOKENS_PER_REPLY
+
+
+def test_failed_encoder_load_falls_back_and_is_retried(monkeypatch):
+    attempts = []
+
+    def encoding_for_model(name):
+        attempts.append(name)
+        if len(attempts) == 1:
+            raise OSError("offline")
+        return CharEncoder()
+
+    fake_tiktoken = types.SimpleNamespace(encoding_for_model=encoding_for_model, get_encoding=None)
+    monkeypatch.setitem(sys.modules, 'tiktoken', fake_tiktoken)
+    monkeypatch.setattr(context_builder, 'ENCODER_RETRY_SECONDS', 0)
+    model = 'openai/offline-model'
+
+    assert get_encoder(model) is None
+    # Estimated at about four characters per token meanwhile
+    assert count_tokens("x" * 40, model) == 10
+
+    # The retry runs in the background; calls keep falling back until it succeeds
+    deadline = time.monotonic() + 5
+    while get_encoder(model) is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert isinstance(get_encoder(model), CharEncoder)
+    assert attempts[0] == 'offline-model'
+    assert count_tokens("x" * 40, model) == 40
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from scripts.embedder import EMBEDDING_MODEL_NAME, OnnxEmbedder, embedder_id
+from scripts.embedding_cache import EmbeddingCache
+
+PARITY_TEXTS = [
+    "How do I reset my password?",
+    "My order arrived damaged and I want a refund.",
+    "The app crashes with error ERR-404 when I open settings.",
+    "What are your shipping options to Canada?",
+    "I was charged twice for the same purchase, this is unacceptable!"
+]
+
+
+class FakeModel:
+    """Deterministic stand-in for an embedder: the vector depends on the text and a per-backend seed"""
+
+    def __init__(self, seed: int):
+        self.seed = seed
+        self.calls = 0
+
+    def encode(self, texts, **kwargs):
+        self.calls += 1
+        vectors = np.stack([np.random.default_rng([self.seed, len(text)]).normal(size=8) for text in texts])
+        return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def onnx_embedder(backend: str) -> OnnxEmbedder:
+    model = OnnxEmbedder.__new__(OnnxEmbedder)
+    model.model_name, model.backend = EMBEDDING_MODEL_NAME, backend
+    return model
+
+
+def test_embedder_id_distinguishes_backends():
+    ids = {embedder_id(object()), embedder_id(onnx_embedder('onnx')), embedder_id(onnx_embedder('onnx-int8'))}
+    assert ids == {f"{EMBEDDING_MODEL_NAME}/torch", f"{EMBEDDING_MODEL_NAME}/onnx", f"{EMBEDDING_MODEL_NAME}/onnx-int8"}
+
+
+def test_persisted_cache_is_keyed_by_backend(tmp_path):
+    path = str(tmp_path / 'embeddings.sqlite')
+    torch_model = FakeModel(seed=1)
+    cache = EmbeddingCache(torch_model, f"{EMBEDDING_MODEL_NAME}/torch", path=path)
+    torch_vector = cache.encode("reset my password").copy()
+    cache.close()
+
+    int8_model = FakeModel(seed=2)
+    cache = EmbeddingCache(int8_model, f"{EMBEDDING_MODEL_NAME}/onnx-int8", path=path)
+    int8_vector = cache.encode("reset my password")
+    cache.close()
+    # The int8 backend must embed the query itself instead of reading the torch vector from disk
+    assert int8_model.calls == 1
+    assert not np.allclose(torch_vector, int8_vector)
+
+
+@pytest.fixture(scope='module')
+def reference():
+    """PyTorch embeddings and an ONNX export of the model; skipped without torch or the model files"""
+    pytest.importorskip('torch')
+    sentence_transformers = pytest.importorskip('sentence_transformers')
+    pytest.importorskip('onnxruntime')
+    pytest.importorskip('onnx')
+    pytest.importorskip('tokenizers')
+    try:
+        model = sentence_transformers.SentenceTransformer(EMBEDDING_MODEL_NAME, device='cpu')
+    except Exception as e:
+        pytest.skip(f"{EMBEDDING_MODEL_NAME} is not available: {e}")
+    return model.encode(PARITY_TEXTS, normalize_embeddings=True, convert_to_numpy=True)
+
+
+@pytest.fixture(scope='module')
+def export_dir(reference, tmp_path_factory):
+    from scripts.embedder import export_onnx
+    return export_onnx(EMBEDDING_MODEL_NAME, str(tmp_path_factory.mktemp('onnx')), quantize=True)
+
+
+@pytest.mark.parametrize('quantized, min_cosine', [(False, 0.999), (True, 0.98)])
+def test_onnx_matches_torch(reference, export_dir, quantized, min_cosine):
+    model = OnnxEmbedder(export_dir, quantized=quantized, threads=1)
+    embeddings = model.encode(PARITY_TEXTS, normalize_embeddings=True, convert_to_numpy=True)
+    cosine = np.sum(embeddings * reference, axis=1)
+    assert cosine.min() >= min_cosine
+    # Every text's nearest neighbour among the reference embeddings is itself
+    assert list((embeddings @ reference.T).argmax(axis=1)) == list(range(len(PARITY_TEXTS)))
@@ -0,0 +1,88 @@
+import math
+
+import numpy as np
+import pytest
+
+from scripts.lexical_index import BM25Index, reciprocal_rank_fusion, tokenize
+
+
+def reference_bm25(documents, query, k1=1.5, b=0.75):
+    """Textbook BM25 over tokenized documents"""
+    docs = [tokenize(doc) for doc in documents]
+    avg_length = max(sum(map(len, docs)) / len(docs), 1.0)
+    scores = []
+    for tokens in docs:
+        score = 0.0
+        for term in set(tokenize(query)):
+            df = sum(term in other for other in docs)
+            tf = tokens.count(term)
+            if tf:
+                idf = math.log1p((len(docs) - df + 0.5) / (df + 0.5))
+                score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(tokens) / avg_length))
+        scores.append(score)
+    return scores
+
+
+@pytest.fixture
+def corpus():
+    rng = np.random.default_rng(0)
+    words = [f"word{i}" for i in range(60)]
+    documents = [" ".join(rng.choice(words, size=rng.integers(5, 30))) for _ in range(200)]
+    return [f"chunk-{i}" for i in range(len(documents))], documents
+
+
+def test_tokenize_keeps_codes_and_their_numeric_parts():
+    assert tokenize("What is ERR-404 on my order?") == ['err-404', '404', 'order']
+    assert tokenize("sku_1234 and follow-up") == ['sku_1234', '1234', 'follow-up', 'follow', 'up']
+
+
+def test_scores_match_reference_bm25(corpus):
+    ids, documents = corpus
+    index = BM25Index.build(ids, documents)
+    query = "word3 word17 word42"
+    expected = reference_bm25(documents, query)
+    results = index.search(query, n_results=10)
+    assert len(results) == 10
+    for chunk_id, score in results:
+        assert score == pytest.approx(expected[ids.index(chunk_id)], rel=1e-4)
+    # Ranked by score, and the top 10 of the reference ranking
+    scores = [score for _, score in results]
+    assert scores == sorted(scores, reverse=True)
+    assert scores[-1] >= sorted(expected, reverse=True)[9] - 1e-4
+
+
+def test_common_terms_are_skipped_when_the_query_has_rarer_ones():
+    documents = [f"common filler text {i}" for i in range(10)] + ["common rare-term answer"]
+    index = BM25Index.build([str(i) for i in range(len(documents))], documents)
+    assert [chunk_id for chunk_id, _ in index.search("common rare-term")] == ['10']
+    # A query of only common terms still matches
+    assert len(index.search("common", n_results=20)) == len(documents)
+
+
+def test_unknown_terms_return_nothing(corpus):
+    index = BM25Index.build(*corpus)
+    assert index.search("nothing matches") == []
+    assert index.search("the and of") == []
+
+
+def test_save_and_load_round_trip(corpus, tmp_path):
+    index = BM25Index.build(*corpus)
+    path = str(tmp_path / 'bm25_index.npz')
+    index.save(path)
+    loaded = BM25Index.load(path)
+    assert len(loaded) == len(index)
+    assert loaded.search("word5 word6") == index.search("word5 word6")
+
+
+def test_reciprocal_rank_fusion_ordering():
+    fused = reciprocal_rank_fusion([['a', 'b', 'c'], ['c', 'a', 'd']], [1.0, 1.0], k=60)
+    ids = [chunk_id for chunk_id, _ in fused]
+    # 'a' ranks 1st and 2nd, 'c' 3rd and 1st, 'b' appears once at rank 2, 'd' once at rank 3
+    assert ids == ['a', 'c', 'b', 'd']
+    assert dict(fused)['a'] == pytest.approx(1 / 61 + 1 / 62)
+
+
+def test_reciprocal_rank_fusion_weights():
+    fused = reciprocal_rank_fusion([['a', 'b'], ['b', 'a']], [1.0, 2.0])
+    assert [chunk_id for chunk_id, _ in fused] == ['b', 'a']
+    assert reciprocal_rank_fusion([], []) == []
@@ -0,0 +1,82 @@
+import threading
+
+import pytest
+
+from scripts import rag as rag_module
+from scripts.rag import RAGPipeline
+from scripts.vector_store import VectorStore, VectorStoreLease
+
+
+class FakeStore(VectorStore):
+    def __init__(self):
+        self.detached = False
+        self.closed = False
+
+    def search(self, query_embeddings, n_results):
+        assert not self.closed, "searched a closed store"
+        return [{} for _ in query_embeddings]
+
+    def detach(self):
+        self.detached = True
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    """A RAGPipeline with only the vector store state, on the Chroma code path"""
+    opened = []
+
+    def open_store(backend, path):
+        opened.append(FakeStore())
+        return opened[-1]
+
+    monkeypatch.setattr(rag_module, 'open_vector_store', open_store)
+    rag = RAGPipeline.__new__(RAGPipeline)
+    rag.VECTOR_BACKEND, rag.DB_PATH = 'chroma', 'unused'
+    rag.version = 1
+    monkeypatch.setattr(rag, 'index_version', lambda: rag.version, raising=False)
+    rag._vector_store_version = rag.index_version()
+    rag._vector_lease = VectorStoreLease(open_store('chroma', rag.DB_PATH))
+    rag._vector_lock = threading.Lock()
+    rag.opened = opened
+    return rag
+
+
+def test_reindex_closes_idle_store(pipeline):
+    pipeline.version = 2
+    with pipeline.vector_index() as store:
+        assert store is pipeline.opened[1]
+    old = pipeline.opened[0]
+    assert old.detached and old.closed
+    assert not pipeline.opened[1].closed
+
+
+def test_reindex_waits_for_readers_of_the_old_store(pipeline):
+    with pipeline.vector_index() as old:
+        pipeline.version = 2
+        with pipeline.vector_index() as new:
+            assert new is not old
+        # Replaced (and detached, so the new store got its own System) but still in use
+        assert old.detached and not old.closed
+        old.search([[0.0]], 1)
+    assert old.closed
+    assert not new.closed
+
+
+def test_unchanged_version_keeps_the_store(pipeline):
+    for _ in range(3):
+        with pipeline.vector_index() as store:
+            assert store is pipeline.opened[0]
+    assert len(pipeline.opened) == 1
+
+
+def test_retired_lease_is_not_acquired():
+    lease = VectorStoreLease(FakeStore())
+    assert lease.acquire()
+    lease.retire()
+    assert not lease.store.closed
+    assert not lease.acquire()
+    lease.release()
+    assert lease.store.closed
@@ -0,0 +1,202 @@
+import asyncio
+
+import pytest
+
+from scripts.scheduler import DEFAULT_PRIORITY, LLMScheduler, Overloaded, request_priority
+
+HIGH, NORMAL, LOW = 0, 1, 2
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def settle():
+    """Let every ready task run up to its next wait"""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_request_priority():
+    assert request_priority('faq', {'urgency': 'high'}) == HIGH
+    assert request_priority('complaint', {'emotion': 'frustrated', 'urgency': 'low'}) == HIGH
+    assert request_priority('troubleshooting', {'urgency': 'low'}) == NORMAL
+    assert request_priority('faq', {'urgency': 'medium'}) == NORMAL
+    assert request_priority('faq', {'urgency': 'low'}) == LOW
+    assert request_priority('faq', None) == LOW
+
+
+def test_waiters_are_served_by_priority_then_arrival():
+    async def main():
+        scheduler = LLMScheduler(max_concurrency=1, max_queue=10, deadlines=[5, 5, 5])
+        order = []
+
+        async def job(priority, name):
+            async with scheduler.slot(priority):
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        holder = asyncio.ensure_future(job(NORMAL, 'holder'))
+        await settle()
+        tasks = []
+        for priority, name in [(LOW, 'low1'), (NORMAL, 'normal1'), (HIGH, 'high'), (LOW, 'low2'), (NORMAL, 'normal2')]:
+            tasks.append(asyncio.ensure_future(job(priority, name)))
+            await settle()
+        assert scheduler.stats()['waiting'] == {'high': 1, 'normal': 2, 'low': 2}
+        await asyncio.gather(holder, *tasks)
+        assert order == ['holder', 'high', 'normal1', 'normal2', 'low1', 'low2']
+        assert scheduler.stats()['active'] == 0
+
+    run(main())
+
+
+def test_full_queue_displaces_newest_lower_priority_waiter():
+    async def main():
+        scheduler = LLMScheduler(max_concurrency=1, max_queue=2, deadlines=[5, 5, 5])
+        assert scheduler.try_acquire(NORMAL)
+        low1 = asyncio.ensure_future(scheduler.acquire(LOW))
+        low2 = asyncio.ensure_future(scheduler.acquire(LOW))
+        await settle()
+
+        high = asyncio.ensure_future(scheduler.acquire(HIGH))
+        await settle()
+        assert low2.done() and not low1.done()
+        error = low2.exception()
+        assert isinstance(error, Overloaded)
+        assert (error.reason, error.status_code, error.priority) == ('queue_full', 429, LOW)
+        assert error.retry_after >= 1
+
+        # Nobody waiting has a lower priority than a new low request: it is rejected itself
+        with pytest.raises(Overloaded) as rejected:
+            await scheduler.acquire(LOW)
+        assert rejected.value.reason == 'queue_full'
+
+        scheduler.release(0.1)
+        await high
+        scheduler.release(0.1)
+        await low1
+        scheduler.release(0.1)
+        assert scheduler.stats()['active'] == 0
+        assert scheduler.waiting == 0
+
+    run(main())
+
+
+def test_waiter_is_shed_after_its_deadline():
+    async def main():
+        scheduler = LLMScheduler(max_concurrency=1, max_queue=10, deadlines=[5, 5, 0.05])
+        assert scheduler.try_acquire(NORMAL)
+        with pytest.raises(Overloaded) as shed:
+            await scheduler.acquire(LOW)
+        assert (shed.value.reason, shed.value.status_code) == ('deadline', 503)
+        assert scheduler.waiting == 0
+        # The shed waiter does not take the slot when it is released
+        scheduler.release(0.1)
+        assert scheduler.stats()['active'] == 0
+
+    run(main())
+
+
+def test_cancelled_waiter_leaves_no_slot_or_queue_entry():
+    async def main():
+        scheduler = LLMScheduler(max_concurrency=1, max_queue=10, deadlines=[5, 5, 5])
+        assert scheduler.try_acquire(NORMAL)
+        waiter = asyncio.ensure_future(scheduler.acquire(NORMAL))
+        await settle()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler.waiting == 0
+        scheduler.release(0.1)
+        assert scheduler.stats()['active'] == 0
+
+    run(main())
+
+
+def test_slot_handed_to_a_cancelled_waiter_is_not_leaked():
+    async def main():
+        scheduler = LLMScheduler(max_concurrency=1, max_queue=10, deadlines=[5, 5, 5])
+        assert scheduler.try_acquire(NORMAL)
+
+        async def job():
+            async with scheduler.slot(NORMAL):
+                pass
+
+        waiter = asyncio.ensure_future(job())
+        await settle()
+        # The slot moves to the waiter, which is cancelled before it resumes. Depending on
+        # the Python version the cancellation wins or the waiter runs its block; either way
+        # the slot is given back
+        scheduler.release(0.1)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert scheduler.stats()['active'] == 0
+        assert scheduler.try_acquire(NORMAL)
+
+    run(main())
+
+
+def test_slot_is_released_when_the_block_raises():
+    async def main():
+        scheduler = LLMScheduler(max_concurrency=1, max_queue=10, deadlines=[5, 5, 5])
+        with pytest.raises(RuntimeError):
+            async with scheduler.slot(NORMAL):
+                assert scheduler.stats()['active'] == 1
+                raise RuntimeError("upstream failed")
+        assert scheduler.stats()['active'] == 0
+
+        # Also when the block is cancelled
+        async def hold():
+            async with scheduler.slot(NORMAL):
+                await asyncio.sleep(10)
+
+        task = asyncio.ensure_future(hold())
+        await settle()
+        assert scheduler.stats()['active'] == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert scheduler.stats()['active'] == 0
+
+    run(main())
+
+
+def test_pending_priority_is_only_awaited_when_queueing():
+    async def main():
+        scheduler = LLMScheduler(max_concurrency=1, max_queue=10, deadlines=[5, 5, 5])
+        calls = []
+
+        async def priority():
+            calls.append(1)
+            return HIGH
+
+        # A free slot is taken at the default priority without waiting for classification
+        async with scheduler.slot(priority):
+            assert calls == []
+
+            async def slow_priority():
+                await asyncio.sleep(10)
+                return HIGH
+
+            scheduler.priority_timeout = 0.05
+            queued = asyncio.ensure_future(scheduler.slot(slow_priority).__aenter__())
+            await asyncio.sleep(0.1)
+            # Classification timed out: queued at the default priority
+            assert scheduler.stats()['waiting'][('high', 'normal', 'low')[DEFAULT_PRIORITY]] == 1
+        await queued
+        assert scheduler.stats()['active'] == 1
+
+    run(main())
+
+
+def test_retry_after_grows_with_the_queue():
+    scheduler = LLMScheduler(max_concurrency=2, max_queue=10, deadlines=[5, 5, 5])
+    scheduler._hold_seconds = 2.0
+    assert scheduler.retry_after() == 1
+    scheduler._waiting = [3, 2, 0]
+    assert scheduler.retry_after() == 6
+
+
+def test_deadlines_need_one_value_per_priority():
+    with pytest.raises(ValueError):
+        LLMScheduler(max_concurrency=1, deadlines=[5, 5])
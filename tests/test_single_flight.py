@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+from scripts.single_flight import SingleFlight
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_concurrent_calls_share_one_execution():
+    async def main():
+        flight = SingleFlight()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"answer": [1, 2]}
+
+        results = await asyncio.gather(*(flight.do('q', work) for _ in range(5)))
+        assert len(calls) == 1
+        assert [shared for _, shared in results] == [False, True, True, True, True]
+        # Each caller gets its own copy
+        results[0][0]["answer"].append(3)
+        assert results[1][0] == {"answer": [1, 2]}
+        assert len(flight) == 0
+
+    run(main())
+
+
+def test_different_keys_run_separately():
+    async def main():
+        flight = SingleFlight()
+
+        async def work(value):
+            await asyncio.sleep(0.01)
+            return value
+
+        results = await asyncio.gather(flight.do('a', lambda: work('a')), flight.do('b', lambda: work('b')))
+        assert results == [('a', False), ('b', False)]
+
+    run(main())
+
+
+def test_failure_reaches_every_caller_and_is_not_replayed():
+    async def main():
+        flight = SingleFlight()
+        attempts = []
+
+        async def failing():
+            attempts.append(1)
+            await asyncio.sleep(0.01)
+            raise RuntimeError("upstream failed")
+
+        results = await asyncio.gather(flight.do('q', failing), flight.do('q', failing), return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert len(attempts) == 1
+
+        async def working():
+            return 'ok'
+
+        assert await flight.do('q', working) == ('ok', False)
+
+    run(main())
+
+
+def test_cancelling_one_caller_keeps_the_shared_work_running():
+    async def main():
+        flight = SingleFlight()
+        finished = []
+
+        async def work():
+            await asyncio.sleep(0.05)
+            finished.append(1)
+            return 'done'
+
+        first = asyncio.ensure_future(flight.do('q', work))
+        second = asyncio.ensure_future(flight.do('q', work))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        assert await second == ('done', True)
+        assert finished == [1]
+
+    run(main())
+
+
+def test_work_is_cancelled_when_the_last_caller_goes_away():
+    async def main():
+        flight = SingleFlight()
+        started, cancelled = [], []
+
+        async def work():
+            started.append(1)
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+
+        callers = [asyncio.ensure_future(flight.do('q', work)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert cancelled == [1]
+        assert len(flight) == 0
+
+        # A later call starts fresh instead of joining the cancelled work
+        async def quick():
+            return 'fresh'
+
+        assert await flight.do('q', quick) == ('fresh', False)
+        assert started == [1]
+
+    run(main())
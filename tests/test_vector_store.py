@@ -0,0 +1,145 @@
+import os
+
+import numpy as np
+import pytest
+
+from benchmarks.quantization import clustered_corpus, recall_at_k, top_rows
+from scripts.vector_store import NumpyVectorStore, open_vector_store, quantize_int8
+
+
+def normalized(rows):
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+def write_index(path, embeddings, dtype='float32', prefix='doc', **kwargs):
+    ids = [f"{prefix}-{i}" for i in range(len(embeddings))]
+    documents = [f"{prefix} text {i} é" for i in range(len(embeddings))]
+    metadatas = [{"source": f"{prefix}.txt", "row": i} for i in range(len(embeddings))]
+    NumpyVectorStore.write(str(path), ids, documents, embeddings, metadatas, dtype=dtype, **kwargs)
+    return ids
+
+
+def bump_mtime(path, seconds=10):
+    """Make a rewrite visible even on filesystems with coarse timestamps"""
+    meta_path = os.path.join(str(path), 'metadata.json')
+    mtime = os.stat(meta_path).st_mtime_ns + seconds * 10**9
+    os.utime(meta_path, ns=(mtime, mtime))
+
+
+@pytest.fixture
+def embeddings():
+    return np.random.default_rng(0).normal(size=(300, 16)).astype(np.float32)
+
+
+def test_search_is_exact(tmp_path, embeddings):
+    ids = write_index(tmp_path, embeddings)
+    store = NumpyVectorStore(str(tmp_path))
+    queries = np.random.default_rng(1).normal(size=(3, 16)).astype(np.float32)
+    results = store.search(queries, 5)
+    expected = np.argsort(-(queries @ normalized(embeddings).T), axis=1)[:, :5]
+    assert [list(result) for result in results] == [[ids[row] for row in rows] for rows in expected]
+    # Documents and metadata come back with the ids
+    assert results[0][ids[expected[0][0]]] == (f"doc text {expected[0][0]} é", {"source": "doc.txt", "row": int(expected[0][0])})
+
+
+def test_get_and_count(tmp_path, embeddings):
+    write_index(tmp_path, embeddings, embedder='model/onnx')
+    store = open_vector_store('numpy', 'unused', numpy_index_path=str(tmp_path))
+    assert store.count() == len(embeddings)
+    assert store.get(['doc-7', 'missing']) == {'doc-7': ("doc text 7 é", {"source": "doc.txt", "row": 7})}
+    assert store.embedder() == 'model/onnx'
+
+
+def test_empty_index(tmp_path):
+    NumpyVectorStore.write(str(tmp_path), [], [], [], [])
+    store = NumpyVectorStore(str(tmp_path))
+    assert store.count() == 0
+    assert store.search(np.zeros((2, 16), np.float32), 3) == [{}, {}]
+
+
+def test_reload_after_rewrite(tmp_path, embeddings):
+    write_index(tmp_path, embeddings)
+    store = NumpyVectorStore(str(tmp_path))
+    old_index = store._index
+    ids = write_index(tmp_path, embeddings[:50], prefix='new')
+    bump_mtime(tmp_path)
+    result = store.search(embeddings[:1], 1)[0]
+    assert list(result) == [ids[0]]
+    assert store.count() == 50
+    # The previous snapshot is untouched, so a search that started on it stays consistent
+    assert old_index is not store._index
+    assert len(old_index.ids) == len(embeddings)
+    assert old_index.chunk(299) == ("doc text 299 é", {"source": "doc.txt", "row": 299})
+
+
+def test_inconsistent_rewrite_keeps_the_previous_index(tmp_path, embeddings):
+    write_index(tmp_path, embeddings)
+    store = NumpyVectorStore(str(tmp_path))
+    # A half-written index: embeddings replaced (atomically, like write does), metadata still the old version
+    tmp_file = os.path.join(str(tmp_path), 'embeddings.npy.tmp')
+    with open(tmp_file, 'wb') as f:
+        np.save(f, normalized(embeddings[:10]))
+    os.replace(tmp_file, os.path.join(str(tmp_path), 'embeddings.npy'))
+    bump_mtime(tmp_path)
+    assert store.count() == len(embeddings)
+    assert len(store.search(embeddings[:1], 3)[0]) == 3
+    assert store.count() == len(embeddings)
+
+
+def test_unknown_dtype_is_rejected(tmp_path, embeddings):
+    with pytest.raises(ValueError):
+        write_index(tmp_path, embeddings, dtype='int4')
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        open_vector_store('faiss', 'unused')
+
+
+def test_int8_quantization_error_is_bounded():
+    rows = normalized(np.random.default_rng(2).normal(size=(50, 32)).astype(np.float32))
+    codes, scales = quantize_int8(rows)
+    assert codes.dtype == np.int8
+    # Rounding to the nearest code is off by at most half a step per component
+    assert np.all(np.abs(codes * scales[:, None] - rows) <= scales[:, None] / 2 + 1e-7)
+
+
+@pytest.fixture(scope='module')
+def recall_setup():
+    embeddings = clustered_corpus(4000, dim=64, clusters=32)
+    rng = np.random.default_rng(1)
+    queries = embeddings[rng.integers(0, len(embeddings), 100)]
+    queries = normalized(queries + rng.standard_normal(queries.shape).astype(np.float32) * (0.3 / np.sqrt(64)))
+    exact = np.argsort(-(queries @ embeddings.T), axis=1)[:, :10].tolist()
+    return embeddings, queries, exact
+
+
+@pytest.mark.parametrize('dtype', ['int8', 'float16'])
+def test_rescoring_restores_recall(tmp_path, recall_setup, dtype):
+    embeddings, queries, exact = recall_setup
+    write_index(tmp_path, embeddings, dtype=dtype)
+    store = NumpyVectorStore(str(tmp_path), rescore_factor=1)
+    assert store.full is not None
+    approximate = recall_at_k(top_rows(store, queries, 10), exact, 10)
+    store.rescore_factor = 4
+    rescored = recall_at_k(top_rows(store, queries, 10), exact, 10)
+    assert rescored >= 0.95
+    assert rescored >= approximate
+
+
+def test_rescored_results_are_ranked_by_full_precision_score(tmp_path, recall_setup):
+    embeddings, queries, _ = recall_setup
+    write_index(tmp_path, embeddings, dtype='int8')
+    store = NumpyVectorStore(str(tmp_path), rescore_factor=4)
+    for query, rows in zip(queries[:10], top_rows(store, queries[:10], 10)):
+        exact_scores = embeddings[rows] @ query
+        assert np.all(np.diff(exact_scores) <= 1e-6)
+
+
+def test_int8_without_full_precision_copy(tmp_path, recall_setup):
+    embeddings, queries, exact = recall_setup
+    write_index(tmp_path, embeddings, dtype='int8', full_precision=False)
+    store = NumpyVectorStore(str(tmp_path))
+    assert store.full is None
+    assert not os.path.exists(os.path.join(str(tmp_path), 'embeddings_full.npy'))
+    assert recall_at_k(top_rows(store, queries, 10), exact, 10) >= 0.8